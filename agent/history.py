@@ -0,0 +1,130 @@
+from google.genai import types
+
+# Rough size of a token for English text and code. Good enough to compare prompt
+# sizes against a budget without calling the count_tokens API every turn.
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(contents) -> int:
+    """Estimates the number of prompt tokens a list of types.Content will cost."""
+    chars = 0
+    for content in contents:
+        for part in content.parts or []:
+            if part.text:
+                chars += len(part.text)
+            if part.function_call:
+                chars += len(part.function_call.name or "") + len(str(part.function_call.args or {}))
+            if part.function_response:
+                response = part.function_response.response or {}
+                chars += len(part.function_response.name or "") + sum(len(str(value)) for value in response.values())
+    return chars // CHARS_PER_TOKEN
+
+
+def _format_call(function_call):
+    if function_call is None:
+        return "tool call"
+    args = ", ".join(f"{key}={value!r}" for key, value in (function_call.args or {}).items()
+                     if key not in ("content", "edits", "patch"))
+    return f"{function_call.name}({args})"
+
+
+class HistoryManager:
+    """
+    Keeps the prompt sent to the model under a token budget.
+
+    The full `messages` list is never modified. compact() returns the list to
+    send instead, in which old tool results have been shrunk or replaced by a
+    short stub until the estimate fits the budget. User prompts and the last
+    `keep_recent_turns` tool calls (with their results) are always sent whole;
+    the system prompt is sent separately and is never touched.
+
+    Args:
+        token_budget: Target size of the prompt in estimated tokens. None disables compaction.
+        keep_recent_turns: How many of the latest tool call/result pairs are never compacted.
+        shrink_to_chars: Old results are first cut down to this many characters (head and tail).
+
+    Indexes in `pinned` are never compacted (later results refer back to them),
+    and `elided` holds the indexes the last compact() call shrank or stubbed.
+    """
+
+    def __init__(self, token_budget=None, keep_recent_turns=4, shrink_to_chars=1000):
+        self.token_budget = token_budget
+        self.keep_recent_turns = keep_recent_turns
+        self.shrink_to_chars = shrink_to_chars
+        self.pinned = set()
+        self.elided = set()
+
+    def compact(self, messages):
+        self.elided = set()
+        if self.token_budget is None or estimate_tokens(messages) <= self.token_budget:
+            return list(messages)
+
+        compacted = list(messages)
+        sizes = [estimate_tokens([content]) for content in messages]
+        total = sum(sizes)
+
+        # First pass: shrink the oldest results to their head and tail.
+        # Second pass: if that was not enough, replace them with a one-line stub.
+        for shrink in (self._shrink, self._stub):
+            for index, function_call in self._compactable(messages):
+                if total <= self.token_budget:
+                    return compacted
+                replacement = shrink(messages[index], function_call)
+                if replacement is not None:
+                    compacted[index] = replacement
+                    self.elided.add(index)
+                    new_size = estimate_tokens([replacement])
+                    total += new_size - sizes[index]
+                    sizes[index] = new_size
+        return compacted
+
+    def _compactable(self, messages):
+        """Returns (index, function_call) for each old tool result, oldest first."""
+        result_indexes = [i for i, content in enumerate(messages) if self._result_text(content) is not None]
+        if self.keep_recent_turns > 0:
+            result_indexes = result_indexes[:-self.keep_recent_turns]
+        result_indexes = [i for i in result_indexes if i not in self.pinned]
+
+        candidates = []
+        for index in result_indexes:
+            function_call = None
+            previous = messages[index - 1] if index > 0 else None
+            if previous is not None and previous.parts and previous.parts[0].function_call:
+                function_call = previous.parts[0].function_call
+            candidates.append((index, function_call))
+        return candidates
+
+    @staticmethod
+    def _result_text(content):
+        if content.role != "tool" or not content.parts or not content.parts[0].function_response:
+            return None
+        response = content.parts[0].function_response.response or {}
+        result = response.get("result")
+        return result if isinstance(result, str) else None
+
+    @staticmethod
+    def _with_result(content, text):
+        name = content.parts[0].function_response.name
+        return types.Content(
+            role="tool",
+            parts=[types.Part.from_function_response(name=name, response={"result": text})],
+        )
+
+    def _shrink(self, content, function_call):
+        text = self._result_text(content)
+        if len(text) <= self.shrink_to_chars:
+            return None
+        half = self.shrink_to_chars // 2
+        elided = len(text) - 2 * half
+        return self._with_result(
+            content, text[:half] + f"\n[... {elided} characters elided from this earlier result ...]\n" + text[-half:]
+        )
+
+    def _stub(self, content, function_call):
+        text = self._result_text(content)
+        lines = text.count("\n") + 1
+        return self._with_result(
+            content,
+            f"[Earlier result of {_format_call(function_call)} elided "
+            f"({len(text)} characters, {lines} lines). Call the tool again if you need it.]",
+        )
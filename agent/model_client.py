@@ -0,0 +1,254 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import defaultdict, deque
+
+from google.genai import types
+
+from .history import estimate_tokens
+
+
+class ModelClient:
+    """
+    The small part of the Gemini client the agent loop actually uses.
+
+    Anything with these methods can drive the loop: the live API,
+    a recording of it, a replay of that recording, or a scripted fake.
+    """
+
+    def generate_content(self, model, contents, config):
+        raise NotImplementedError
+
+    def generate_content_stream(self, model, contents, config):
+        # Clients that cannot stream return the whole response as a single chunk
+        yield self.generate_content(model=model, contents=contents, config=config)
+
+    async def generate_content_async(self, model, contents, config):
+        # Clients without a native async API run the blocking call in a thread
+        return await asyncio.to_thread(self.generate_content, model=model, contents=contents, config=config)
+
+
+class GeminiClient(ModelClient):
+    """The live Gemini API."""
+
+    def __init__(self, api_key):
+        from google import genai
+        self.client = genai.Client(api_key=api_key)
+
+    def generate_content(self, model, contents, config):
+        return self.client.models.generate_content(model=model, contents=contents, config=config)
+
+    def generate_content_stream(self, model, contents, config):
+        return self.client.models.generate_content_stream(model=model, contents=contents, config=config)
+
+    async def generate_content_async(self, model, contents, config):
+        return await self.client.aio.models.generate_content(model=model, contents=contents, config=config)
+
+
+def _dump(obj):
+    return obj.model_dump(mode="json", exclude_none=True)
+
+
+def request_key(method, model, contents, config):
+    """Hash identifying a request, used to look up its recorded response."""
+    request = {
+        "method": method,
+        "model": model,
+        "contents": [_dump(content) for content in contents],
+        "config": _dump(config) if config is not None else None,
+    }
+    encoded = json.dumps(request, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def _open_log(path, mode):
+    # A ".gz" suffix keeps long recordings small on disk
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class RecordingClient(ModelClient):
+    """
+    Passes requests through to another client and appends every request/response
+    pair to a JSONL log, one line per call: {"key": ..., "chunks": [...]}.
+    Streamed calls store each chunk; plain calls store a single one.
+    """
+
+    def __init__(self, inner, log_path):
+        self.inner = inner
+        self.log_path = log_path
+        self._lock = threading.Lock()
+
+    def _append(self, key, chunks):
+        line = json.dumps({"key": key, "chunks": [_dump(chunk) for chunk in chunks]}, separators=(",", ":"))
+        with self._lock, _open_log(self.log_path, "a") as log:
+            log.write(line + "\n")
+
+    def generate_content(self, model, contents, config):
+        response = self.inner.generate_content(model=model, contents=contents, config=config)
+        self._append(request_key("generate_content", model, contents, config), [response])
+        return response
+
+    def generate_content_stream(self, model, contents, config):
+        chunks = []
+        for chunk in self.inner.generate_content_stream(model=model, contents=contents, config=config):
+            chunks.append(chunk)
+            yield chunk
+        self._append(request_key("generate_content_stream", model, contents, config), chunks)
+
+    async def generate_content_async(self, model, contents, config):
+        response = await self.inner.generate_content_async(model=model, contents=contents, config=config)
+        # Recorded under the same key as a blocking call: the request and response are the same
+        self._append(request_key("generate_content", model, contents, config), [response])
+        return response
+
+
+def is_retryable(error):
+    """True for errors worth retrying: rate limiting (429) and server errors (5xx)."""
+    code = getattr(error, "code", None)
+    if not isinstance(code, int):
+        code = getattr(error, "status_code", None)
+    return isinstance(code, int) and (code == 429 or 500 <= code < 600)
+
+
+class RateLimitedClient(ModelClient):
+    """
+    Wraps a client for many concurrent async sessions: every async request
+    first waits for the shared agent.rate_limit.RateLimiter, and requests that
+    fail with 429 or 5xx are retried with exponential backoff and jitter.
+
+    Counters for the whole batch are kept in `stats`.
+    """
+
+    def __init__(self, inner, limiter, max_retries=5, base_delay=1.0, max_delay=60.0):
+        self.inner = inner
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {"requests": 0, "retries": 0, "rate_limit_wait_s": 0.0}
+
+    def generate_content(self, model, contents, config):
+        return self.inner.generate_content(model=model, contents=contents, config=config)
+
+    def generate_content_stream(self, model, contents, config):
+        return self.inner.generate_content_stream(model=model, contents=contents, config=config)
+
+    async def generate_content_async(self, model, contents, config):
+        estimated = estimate_tokens(contents)
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            await self.limiter.acquire(estimated)
+            self.stats["rate_limit_wait_s"] += time.monotonic() - started
+            self.stats["requests"] += 1
+            try:
+                response = await self.inner.generate_content_async(model=model, contents=contents, config=config)
+            except Exception as error:
+                if attempt == self.max_retries or not is_retryable(error):
+                    raise
+                self.stats["retries"] += 1
+                # Jitter keeps sessions that failed together from retrying together
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+                await asyncio.sleep(random.uniform(delay / 2, delay))
+                continue
+            usage = response.usage_metadata
+            self.limiter.record(estimated, usage.total_token_count if usage else None)
+            return response
+
+
+class ReplayMissError(LookupError):
+    """Raised when a replayed session sends a request that was never recorded."""
+
+
+class ReplayClient(ModelClient):
+    """
+    Serves responses from a log written by RecordingClient, without any network access.
+
+    If the same request was recorded several times, the responses are served in
+    the order they were recorded; the last one is repeated after that.
+    """
+
+    def __init__(self, log_path):
+        self._recorded = defaultdict(deque)
+        self._lock = threading.Lock()
+        with _open_log(log_path, "r") as log:
+            for line in log:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._recorded[entry["key"]].append(entry["chunks"])
+
+    def _chunks(self, method, model, contents, config):
+        key = request_key(method, model, contents, config)
+        with self._lock:
+            recorded = self._recorded.get(key)
+            if not recorded:
+                raise ReplayMissError(f"No recorded response for {method} request {key[:12]}")
+            chunks = recorded.popleft() if len(recorded) > 1 else recorded[0]
+        return [types.GenerateContentResponse.model_validate(chunk) for chunk in chunks]
+
+    def generate_content(self, model, contents, config):
+        return self._chunks("generate_content", model, contents, config)[0]
+
+    def generate_content_stream(self, model, contents, config):
+        yield from self._chunks("generate_content_stream", model, contents, config)
+
+
+def text_response(text):
+    """Builds a model response containing a single text part."""
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text=text)]))]
+    )
+
+
+def function_call_response(*calls):
+    """Builds a model response asking for one or more tool calls, given as (name, args) pairs."""
+    parts = [types.Part(function_call=types.FunctionCall(name=name, args=args)) for name, args in calls]
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=types.Content(role="model", parts=parts))]
+    )
+
+
+class ScriptedClient(ModelClient):
+    """
+    A fake model that plays back a fixed script, for tests and benchmarks.
+
+    Each script entry answers one request. It may be a GenerateContentResponse,
+    a string (a final text answer), or a callable taking the request contents
+    and returning a response. Every request's contents are kept in `requests`.
+    When the script runs out, the last entry is repeated.
+
+    Streaming yields one chunk per part, so the streaming code path is exercised too.
+    """
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def generate_content(self, model, contents, config):
+        with self._lock:
+            self.requests.append(list(contents))
+            index = min(len(self.requests), len(self.script)) - 1
+        entry = self.script[index]
+        if callable(entry):
+            entry = entry(contents)
+        if isinstance(entry, str):
+            entry = text_response(entry)
+        return entry
+
+    def generate_content_stream(self, model, contents, config):
+        response = self.generate_content(model=model, contents=contents, config=config)
+        candidate = response.candidates[0] if response.candidates else None
+        if candidate is None or not candidate.content or not candidate.content.parts:
+            yield response
+            return
+        for part in candidate.content.parts:
+            yield types.GenerateContentResponse(
+                candidates=[types.Candidate(content=types.Content(role="model", parts=[part]))],
+                usage_metadata=response.usage_metadata,
+            )
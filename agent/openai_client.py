@@ -0,0 +1,345 @@
+import http.client
+import json
+import queue
+from urllib.parse import urlsplit
+
+from google.genai import types
+
+from .model_client import ModelClient
+
+# What a dropped keep-alive connection looks like when it is reused
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                            ConnectionResetError, BrokenPipeError)
+
+
+# The only key of a call's args when its arguments were not valid JSON (the
+# raw text is its value); functions.call_function answers such a call with an
+# error for the model instead of running the tool
+MALFORMED_ARGUMENTS = "$malformed_arguments"
+
+
+class ChatCompletionError(Exception):
+    """An error response from the server. `code` is the HTTP status, so is_retryable can judge it."""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code}: {message}")
+        self.code = code
+
+
+# --- Neutral format ---
+# The agent loop speaks google.genai types. These functions turn its tool
+# declarations and message history into the plain JSON of the OpenAI chat
+# completions API, which llama.cpp, Ollama, vLLM and most local servers
+# accept, and turn the answer back.
+
+def schema_to_json(schema):
+    """A types.Schema (or its dict) as JSON Schema."""
+    if isinstance(schema, types.Schema):
+        schema = schema.model_dump(mode="json", exclude_none=True)
+    converted = {}
+    for key, value in schema.items():
+        if key == "type":
+            converted["type"] = value.lower()
+        elif key == "properties":
+            converted["properties"] = {name: schema_to_json(item) for name, item in value.items()}
+        elif key == "items":
+            converted["items"] = schema_to_json(value)
+        elif key in ("description", "enum", "required", "nullable", "format"):
+            converted[key] = value
+    return converted
+
+
+def tools_to_json(tools):
+    """The function declarations of a list of types.Tool as chat completions "tools"."""
+    converted = []
+    for tool in tools or []:
+        for declaration in tool.function_declarations or []:
+            function = {"name": declaration.name, "description": declaration.description or ""}
+            function["parameters"] = (schema_to_json(declaration.parameters) if declaration.parameters
+                                      else {"type": "object", "properties": {}})
+            converted.append({"type": "function", "function": function})
+    return converted
+
+
+def _text(content):
+    if isinstance(content, str):
+        return content
+    if isinstance(content, types.Content):
+        return "".join(part.text or "" for part in content.parts or [])
+    return str(content or "")
+
+
+def contents_to_messages(contents, system_instruction=None):
+    """
+    The message history as chat completions "messages".
+
+    Tool call ids are numbered by position ("call_0", "call_1", ...) and
+    arguments are serialized with sorted keys, so the part of the history
+    that did not change serializes to the same bytes every turn. That is what
+    lets a server that caches prompt prefixes (llama.cpp's cache_prompt,
+    vLLM's prefix caching) skip re-reading it.
+    """
+    messages = []
+    if system_instruction:
+        messages.append({"role": "system", "content": _text(system_instruction)})
+    call_ids = [] # Ids of the calls still waiting for their result, oldest first
+    next_id = 0
+    for content in contents:
+        texts = [part.text for part in content.parts or [] if part.text]
+        calls = [part.function_call for part in content.parts or [] if part.function_call]
+        responses = [part.function_response for part in content.parts or [] if part.function_response]
+        if content.role == "model":
+            message = {"role": "assistant", "content": "".join(texts) or None}
+            if calls:
+                message["tool_calls"] = []
+                for call in calls:
+                    call_id = f"call_{next_id}"
+                    next_id += 1
+                    call_ids.append(call_id)
+                    message["tool_calls"].append({
+                        "id": call_id, "type": "function",
+                        "function": {"name": call.name,
+                                     "arguments": json.dumps(call.args or {}, sort_keys=True, default=str)},
+                    })
+            messages.append(message)
+        elif responses:
+            for response in responses:
+                result = response.response or {}
+                if set(result) == {"result"} and isinstance(result["result"], str):
+                    text = result["result"]
+                else:
+                    text = json.dumps(result, sort_keys=True, default=str)
+                call_id = call_ids.pop(0) if call_ids else f"call_{next_id}"
+                messages.append({"role": "tool", "tool_call_id": call_id, "content": text})
+        else:
+            messages.append({"role": "user", "content": "".join(texts)})
+    return messages
+
+
+def _usage_metadata(usage):
+    if not usage:
+        return None
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    return types.GenerateContentResponseUsageMetadata(
+        prompt_token_count=usage.get("prompt_tokens"),
+        candidates_token_count=usage.get("completion_tokens"),
+        total_token_count=usage.get("total_tokens"),
+        cached_content_token_count=cached,
+    )
+
+
+def _function_call(name, arguments):
+    try:
+        args = json.loads(arguments) if arguments else {}
+    except ValueError:
+        args = None
+    if not isinstance(args, dict):
+        # Small local models sometimes send broken JSON; the model is told to try again
+        args = {MALFORMED_ARGUMENTS: arguments}
+    return types.FunctionCall(name=name, args=args)
+
+
+def _response(parts, usage=None, finish_reason=None):
+    candidate = types.Candidate(content=types.Content(role="model", parts=parts))
+    if finish_reason == "length":
+        candidate.finish_reason = types.FinishReason.MAX_TOKENS
+    elif finish_reason:
+        candidate.finish_reason = types.FinishReason.STOP
+    return types.GenerateContentResponse(candidates=[candidate], usage_metadata=_usage_metadata(usage))
+
+
+def completion_to_response(completion):
+    """A chat completions response as a types.GenerateContentResponse."""
+    choices = completion.get("choices") or []
+    if not choices:
+        return types.GenerateContentResponse(candidates=[], usage_metadata=_usage_metadata(completion.get("usage")))
+    message = choices[0].get("message") or {}
+    parts = []
+    if message.get("content"):
+        parts.append(types.Part(text=message["content"]))
+    for call in message.get("tool_calls") or []:
+        function = call.get("function") or {}
+        parts.append(types.Part(function_call=_function_call(function.get("name"), function.get("arguments"))))
+    return _response(parts, completion.get("usage"), choices[0].get("finish_reason"))
+
+
+class ConnectionPool:
+    """
+    Keeps HTTP connections to one server open between requests, so a turn
+    does not pay for a new TCP (and TLS) handshake. Connections are taken
+    most recently used first; at most `size` idle ones are kept.
+    """
+
+    def __init__(self, base_url, size=4, timeout=300):
+        parts = urlsplit(base_url)
+        self.https = parts.scheme == "https"
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.created = 0
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        self.created += 1
+        connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return connection_class(self.host, self.port, timeout=self.timeout)
+
+    def acquire(self):
+        """An idle connection if there is one (and whether it was reused), else a new one."""
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self._connect(), False
+
+    def release(self, connection):
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def request(self, path, body, headers):
+        """
+        Sends a POST and returns (connection, response) with the response
+        unread. The caller reads it and then hands the connection back with
+        release(). A reused connection the server has meanwhile closed is
+        replaced once.
+        """
+        connection, reused = self.acquire()
+        try:
+            connection.request("POST", self.path + path, body=body, headers=headers)
+            return connection, connection.getresponse()
+        except _STALE_CONNECTION_ERRORS:
+            connection.close()
+            if not reused:
+                raise
+        connection = self._connect()
+        connection.request("POST", self.path + path, body=body, headers=headers)
+        return connection, connection.getresponse()
+
+
+class OpenAICompatibleClient(ModelClient):
+    """
+    A model served by a local (or any) OpenAI-compatible HTTP server, such as
+    llama.cpp's llama-server, Ollama or vLLM, so turns need no remote API.
+
+    Requests go over kept-alive pooled connections. The history is serialized
+    deterministically (see contents_to_messages), and the server is asked to
+    keep the prompt cache (llama.cpp's cache_prompt) and the model loaded
+    (Ollama's keep_alive) between turns, so each turn only processes the
+    tokens added since the last one.
+
+    Args:
+        base_url: The server's API root, e.g. "http://127.0.0.1:8080/v1".
+        model: Model name sent to the server; by default the name the loop asks for.
+        api_key: Sent as a bearer token if given.
+        pool_size: Idle connections kept open.
+        cache_prompt, keep_alive: Sent with every request; None leaves them out
+                                  (for servers that reject unknown fields).
+    """
+
+    def __init__(self, base_url, model=None, api_key=None, pool_size=4, timeout=300,
+                 cache_prompt=True, keep_alive="30m"):
+        self.model = model
+        self.api_key = api_key
+        self.cache_prompt = cache_prompt
+        self.keep_alive = keep_alive
+        self.pool = ConnectionPool(base_url, size=pool_size, timeout=timeout)
+        self.stats = {"requests": 0, "connections": 0, "cached_tokens": 0}
+
+    def _body(self, model, contents, config, stream):
+        body = {
+            "model": self.model or model,
+            "messages": contents_to_messages(contents, config.system_instruction if config else None),
+            "stream": stream,
+        }
+        tools = tools_to_json(config.tools if config else None)
+        if tools:
+            body["tools"] = tools
+            mode = (config.tool_config and config.tool_config.function_calling_config
+                    and config.tool_config.function_calling_config.mode)
+            body["tool_choice"] = "none" if mode is not None and str(getattr(mode, "value", mode)) == "NONE" else "auto"
+        if config is not None:
+            if config.temperature is not None:
+                body["temperature"] = config.temperature
+            if config.max_output_tokens is not None:
+                body["max_tokens"] = config.max_output_tokens
+        if stream:
+            body["stream_options"] = {"include_usage": True}
+        if self.cache_prompt is not None:
+            body["cache_prompt"] = self.cache_prompt
+        if self.keep_alive is not None:
+            body["keep_alive"] = self.keep_alive
+        return json.dumps(body, separators=(",", ":")).encode("utf-8")
+
+    def _post(self, body):
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        created = self.pool.created
+        connection, response = self.pool.request("/chat/completions", body, headers)
+        self.stats["requests"] += 1
+        self.stats["connections"] += self.pool.created - created
+        if response.status >= 400:
+            message = response.read().decode("utf-8", errors="replace")[:500]
+            self.pool.release(connection)
+            raise ChatCompletionError(response.status, message)
+        return connection, response
+
+    def _record_usage(self, usage):
+        cached = ((usage or {}).get("prompt_tokens_details") or {}).get("cached_tokens")
+        if cached:
+            self.stats["cached_tokens"] += cached
+
+    def generate_content(self, model, contents, config):
+        connection, response = self._post(self._body(model, contents, config, stream=False))
+        try:
+            completion = json.loads(response.read())
+        finally:
+            self.pool.release(connection)
+        self._record_usage(completion.get("usage"))
+        return completion_to_response(completion)
+
+    def generate_content_stream(self, model, contents, config):
+        """
+        Yields text as it arrives, one chunk per delta. Function calls arrive
+        in pieces, so they are yielded together, complete, in the last chunk
+        (with the usage).
+        """
+        connection, response = self._post(self._body(model, contents, config, stream=True))
+        calls = {} # index -> {"name", "arguments"}
+        usage = None
+        finish_reason = None
+        finished = False
+        try:
+            for line in response:
+                line = line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                usage = chunk.get("usage") or usage
+                for choice in chunk.get("choices") or []:
+                    finish_reason = choice.get("finish_reason") or finish_reason
+                    delta = choice.get("delta") or {}
+                    if delta.get("content"):
+                        yield _response([types.Part(text=delta["content"])])
+                    for call in delta.get("tool_calls") or []:
+                        entry = calls.setdefault(call.get("index", len(calls)), {"name": "", "arguments": ""})
+                        function = call.get("function") or {}
+                        entry["name"] += function.get("name") or ""
+                        entry["arguments"] += function.get("arguments") or ""
+            response.read() # Drain what is left so the connection can be reused
+            finished = True
+        finally:
+            if finished:
+                self.pool.release(connection)
+            else:
+                connection.close() # Stopped mid-response: the connection cannot be reused
+
+        self._record_usage(usage)
+        parts = [types.Part(function_call=_function_call(call["name"], call["arguments"]))
+                 for _, call in sorted(calls.items())]
+        yield _response(parts, usage, finish_reason)
@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket for asyncio code: `rate_per_minute` tokens are added
+    continuously, up to `capacity` (by default one minute's worth).
+
+    acquire() waits until the bucket holds the requested amount and takes it.
+    Waiters are served in arrival order, so a large request is not starved by
+    a stream of small ones. settle() corrects an earlier estimate once the real
+    cost is known; the balance may go negative, which delays later callers.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(capacity if capacity is not None else rate_per_minute)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount=1):
+        # A request bigger than the whole bucket waits for a full bucket instead of forever
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+    def settle(self, amount):
+        """Takes `amount` more tokens (or gives them back, if negative) without waiting."""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens - amount)
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute limits shared by every session of a batch.
+
+    Either limit may be None (unlimited). Token costs are estimated before a
+    request is sent and corrected with the usage the response reports.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    async def acquire(self, estimated_tokens):
+        if self.requests is not None:
+            await self.requests.acquire(1)
+        if self.tokens is not None:
+            await self.tokens.acquire(estimated_tokens)
+
+    def record(self, estimated_tokens, actual_tokens):
+        if self.tokens is not None and actual_tokens is not None:
+            self.tokens.settle(actual_tokens - estimated_tokens)
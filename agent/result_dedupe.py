@@ -0,0 +1,85 @@
+import difflib
+import json
+
+from .history import HistoryManager, _format_call
+
+# Tools whose result only depends on their arguments and the files they read, so
+# calling one again with the same arguments can be answered relative to last time
+DEDUPE_TOOLS = {"get_file_content", "get_files_info", "run_python_file", "search_code", "find_symbol", "list_symbols"}
+
+
+class ToolResultDeduper:
+    """
+    Stops near-identical tool results piling up in the conversation.
+
+    When a tool is called again with the same arguments (a file read again
+    after an edit, a script run again after a fix), the new result is compared
+    with the last one the model saw for that call:
+      - identical: it is replaced by a one-line "unchanged since turn N" note;
+      - changed, with a diff much smaller than the result: it is replaced by a
+        unified diff against the earlier result.
+    The results these notes refer to are pinned in the HistoryManager so
+    compaction never removes them, and a result compaction has already removed
+    is never referred to. After `max_chain` diffs in a row the full result is
+    sent again, so the model never has to replay a long chain of them.
+
+    Args:
+        history: The session's HistoryManager.
+        min_chars: Results shorter than this are always sent whole.
+        max_delta_ratio: A diff is only sent if it is at most this fraction of the full result.
+    """
+
+    def __init__(self, history, min_chars=200, max_delta_ratio=0.5, max_chain=4):
+        self.history = history
+        self.min_chars = min_chars
+        self.max_delta_ratio = max_delta_ratio
+        self.max_chain = max_chain
+        # call key -> {"turn", "text", "chain": [message indexes needed to rebuild text]}
+        self._seen = {}
+        self.stats = {"unchanged": 0, "deltas": 0, "chars_saved": 0}
+
+    def process(self, function_call, result, turn, index):
+        """
+        Returns the result to append to the messages in place of `result`.
+
+        Args:
+            function_call: The types.FunctionCall that produced the result.
+            result: Its types.Content from call_function.
+            turn: Number of the current turn, used in the notes.
+            index: Index in `messages` the result will be appended at.
+        """
+        text = HistoryManager._result_text(result)
+        if function_call.name not in DEDUPE_TOOLS or text is None:
+            return result
+        key = (function_call.name, json.dumps(dict(function_call.args or {}), sort_keys=True, default=str))
+        previous = self._seen.get(key)
+        self._seen[key] = {"turn": turn, "text": text, "chain": [index]}
+        if previous is None or len(text) < self.min_chars:
+            return result
+        if any(earlier in self.history.elided for earlier in previous["chain"]):
+            return result # The model no longer sees the earlier result
+
+        call = _format_call(function_call)
+        if text == previous["text"]:
+            note = (f"[Unchanged: identical to the result of this same {call} call "
+                    f"in turn {previous['turn']}, which is still above.]")
+            # Refer later calls to the turn with the actual content
+            self._seen[key] = previous
+            self.stats["unchanged"] += 1
+        else:
+            if len(previous["chain"]) >= self.max_chain:
+                return result
+            diff = "\n".join(difflib.unified_diff(
+                previous["text"].splitlines(), text.splitlines(),
+                fromfile=f"turn {previous['turn']}", tofile=f"turn {turn}", lineterm="", n=2,
+            ))
+            if len(diff) > self.max_delta_ratio * len(text):
+                return result
+            note = (f"[Changed since this same {call} call in turn {previous['turn']}. "
+                    f"Unified diff against that result:]\n{diff}")
+            self._seen[key]["chain"] = previous["chain"] + [index]
+            self.stats["deltas"] += 1
+
+        self.history.pinned.update(previous["chain"])
+        self.stats["chars_saved"] += len(text) - len(note)
+        return HistoryManager._with_result(result, note)
@@ -0,0 +1,226 @@
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+import zlib
+
+from google.genai import types
+
+from .history import HistoryManager
+
+SESSION_VERSION = 1
+
+# Where sessions are kept (next to the symbol index cache)
+sessions_directory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "sessions")
+
+# Strings longer than this (tool results, file contents sent to write_file...)
+# are stored once, compressed, in a blob named after their hash
+blob_threshold = 1024
+
+
+class SessionNotFoundError(LookupError):
+    pass
+
+
+def _file_state(path):
+    """(mtime_ns, size, sha1) of a file, or None if it cannot be read."""
+    try:
+        stat_result = os.stat(path)
+        with open(path, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return None
+    return [stat_result.st_mtime_ns, stat_result.st_size, digest]
+
+
+def _changed(path, state):
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return True
+    if [stat_result.st_mtime_ns, stat_result.st_size] == state[:2]:
+        return False
+    # Touched, or rewritten: only a different content counts
+    current = _file_state(path)
+    return current is None or current[2] != state[2]
+
+
+class SessionStore:
+    """
+    Sessions saved on disk, so a later run can pick up where one left off.
+
+    A session is a JSONL file: a header line, then one line per turn with the
+    messages that turn added. Strings longer than `blob_threshold` are
+    replaced by {"$blob": <sha256>} and written once, zlib-compressed, to
+    blobs/<sha256>, so a file read in many sessions (or many times in one)
+    is stored once.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or sessions_directory
+        self.blob_directory = os.path.join(self.directory, "blobs")
+
+    def _path(self, session_id):
+        return os.path.join(self.directory, f"{session_id}.jsonl")
+
+    def create(self, working_directory, source_files=None):
+        os.makedirs(self.blob_directory, exist_ok=True)
+        session_id = time.strftime("%Y%m%d-%H%M%S") + "-" + secrets.token_hex(2)
+        header = {"version": SESSION_VERSION, "id": session_id, "created": time.time(),
+                  "working_directory": os.path.realpath(working_directory)}
+        with open(self._path(session_id), "w") as f:
+            f.write(json.dumps(header, separators=(",", ":")) + "\n")
+        return Session(self, session_id, header["working_directory"], source_files=source_files)
+
+    def latest(self):
+        """Id of the most recently saved session, or None."""
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith(".jsonl")]
+        except OSError:
+            return None
+        if not names:
+            return None
+        latest = max(names, key=lambda name: os.path.getmtime(os.path.join(self.directory, name)))
+        return latest[:-len(".jsonl")]
+
+    def open(self, session_id, source_files=None):
+        """
+        Loads a session to continue it. `session_id` may be "last". Tool
+        results whose source files changed since they were saved get a
+        "[Stale: ...]" note in front.
+        """
+        if session_id == "last":
+            session_id = self.latest()
+        if not session_id or os.sep in session_id or not os.path.exists(self._path(session_id)):
+            raise SessionNotFoundError(f'No saved session "{session_id}"')
+        path = self._path(session_id)
+        with open(path, "r") as f:
+            header = json.loads(f.readline())
+            if header.get("version") != SESSION_VERSION:
+                raise SessionNotFoundError(f'Session "{session_id}" was saved in an unsupported format')
+            session = Session(self, session_id, header["working_directory"], source_files=source_files)
+            blobs = {}
+            for line in f:
+                try:
+                    turn = json.loads(line)
+                except ValueError:
+                    break # Cut short by a crash in the middle of writing
+                for entry in turn["messages"]:
+                    content = types.Content.model_validate(self._restore(entry["content"], blobs))
+                    changed = [relative for relative, state in entry.get("sources", {}).items()
+                               if _changed(os.path.join(session.working_directory, relative), state)]
+                    text = HistoryManager._result_text(content)
+                    if changed and text is not None:
+                        session.stale += 1
+                        content = HistoryManager._with_result(
+                            content,
+                            f"[Stale: {', '.join(changed)} changed after this result was saved in an earlier run. "
+                            f"Call the tool again for the current content.]\n{text}",
+                        )
+                    session.messages.append(content)
+        session.saved = len(session.messages)
+        return session
+
+    def _store(self, value):
+        if isinstance(value, str) and len(value) > blob_threshold:
+            data = value.encode("utf-8")
+            digest = hashlib.sha256(data).hexdigest()
+            path = os.path.join(self.blob_directory, digest)
+            if not os.path.exists(path):
+                temporary = f"{path}.{os.getpid()}.tmp"
+                with open(temporary, "wb") as f:
+                    f.write(zlib.compress(data))
+                os.replace(temporary, path)
+            return {"$blob": digest}
+        if isinstance(value, dict):
+            return {key: self._store(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._store(item) for item in value]
+        return value
+
+    def _restore(self, value, blobs):
+        if isinstance(value, dict):
+            if len(value) == 1 and "$blob" in value:
+                digest = value["$blob"]
+                if digest not in blobs:
+                    with open(os.path.join(self.blob_directory, digest), "rb") as f:
+                        blobs[digest] = zlib.decompress(f.read()).decode("utf-8")
+                return blobs[digest]
+            return {key: self._restore(item, blobs) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._restore(item, blobs) for item in value]
+        return value
+
+
+class Session:
+    """
+    One saved session. `messages` holds what was loaded from disk (empty for a
+    new session); save() appends whatever a loop added after that.
+
+    Args:
+        source_files: Optional callable(function_call) -> paths the call's
+                      result was computed from. Their content hashes are saved
+                      with the result, so a later resume can flag it as stale.
+                      They are taken by capture() when the call returns; a
+                      result nothing captured gets the hashes at save time.
+    """
+
+    def __init__(self, store, session_id, working_directory, source_files=None):
+        self.store = store
+        self.id = session_id
+        self.working_directory = working_directory
+        self.source_files = source_files
+        self.messages = []
+        self.saved = 0
+        self.stale = 0
+        # id(function_call) -> (function_call, {relative path: file state}), until saved
+        self._captured = {}
+        self._lock = threading.Lock()
+
+    def _sources(self, function_call):
+        sources = {}
+        for path in self.source_files(function_call):
+            state = _file_state(path)
+            if state is not None:
+                sources[os.path.relpath(path, self.working_directory)] = state
+        return sources
+
+    def capture(self, function_call):
+        """
+        Records the state of the files `function_call`'s result was computed
+        from. Called as soon as the call returns (ToolDispatcher's after_call),
+        so a later call of the same turn that writes one of them does not hide
+        that the result is out of date.
+        """
+        if self.source_files is None:
+            return
+        sources = self._sources(function_call)
+        with self._lock:
+            self._captured[id(function_call)] = (function_call, sources)
+
+    def save(self, messages):
+        """Appends the messages not saved yet, as one line."""
+        if len(messages) <= self.saved:
+            return
+        entries = []
+        for index in range(self.saved, len(messages)):
+            content = messages[index]
+            entry = {"content": self.store._store(content.model_dump(mode="json", exclude_none=True))}
+            previous = messages[index - 1] if index > 0 else None
+            if (self.source_files is not None and HistoryManager._result_text(content) is not None
+                    and previous is not None and previous.parts and previous.parts[0].function_call):
+                function_call = previous.parts[0].function_call
+                with self._lock:
+                    captured = self._captured.pop(id(function_call), None)
+                if captured is not None and captured[0] is function_call:
+                    sources = captured[1]
+                else:
+                    sources = self._sources(function_call)
+                if sources:
+                    entry["sources"] = sources
+            entries.append(entry)
+        with open(self.store._path(self.id), "a") as f:
+            f.write(json.dumps({"saved": time.time(), "messages": entries}, separators=(",", ":")) + "\n")
+        self.saved = len(messages)
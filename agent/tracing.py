@@ -0,0 +1,112 @@
+import json
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Fields copied from a response's usage_metadata into model spans
+USAGE_FIELDS = {
+    "prompt_tokens": "prompt_token_count",
+    "response_tokens": "candidates_token_count",
+    "cached_tokens": "cached_content_token_count",
+    "total_tokens": "total_token_count",
+}
+
+
+def usage_fields(response):
+    """The token counts of a model response, as span attributes."""
+    metadata = getattr(response, "usage_metadata", None)
+    if metadata is None:
+        return {}
+    return {key: getattr(metadata, field) or 0 for key, field in USAGE_FIELDS.items()}
+
+
+class Tracer:
+    """
+    Records a span for every model call and tool call of a session.
+
+    Each span is a dict such as
+        {"session": ..., "kind": "model" | "tool", "name": ..., "turn": 3,
+         "start": <unix time>, "duration_s": 0.82, ...}
+    with token usage for model calls, and argument/result sizes and file read
+    cache hits for tool calls. Spans are appended to a JSONL file if `path` is
+    given, and always added to the totals that summary() reports.
+
+    Tool spans are recorded from the dispatcher's threads, so everything here is thread-safe.
+    """
+
+    def __init__(self, path=None, session=None):
+        self.session = session or uuid.uuid4().hex[:12]
+        self.turn = 0 # Set by the agent loop; tool spans are tagged with it
+        self.started = time.perf_counter()
+        self.model = defaultdict(float)
+        self.tools = defaultdict(lambda: defaultdict(float))
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8") if path else None
+
+    @contextmanager
+    def span(self, kind, name, **attributes):
+        """
+        Times the body of a `with` block as one span. The yielded dict holds the
+        span's attributes; the body may add more (usage, sizes, ...).
+        """
+        span = {"session": self.session, "kind": kind, "name": name, "turn": self.turn, **attributes}
+        span["start"] = round(time.time(), 6)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span["duration_s"] = round(time.perf_counter() - started, 6)
+            self.record(span)
+
+    def record(self, span):
+        with self._lock:
+            if span["kind"] == "model":
+                totals = self.model
+            else:
+                totals = self.tools[span["name"]]
+            totals["calls"] += 1
+            totals["seconds"] += span["duration_s"]
+            for key, value in span.items():
+                if key not in ("turn", "start", "duration_s") and isinstance(value, (int, float)) \
+                        and not isinstance(value, bool):
+                    totals[key] += value
+            if self._file is not None:
+                self._file.write(json.dumps(span, separators=(",", ":")) + "\n")
+                self._file.flush()
+
+    def summary(self):
+        """A few lines on what the session cost and where its time went."""
+        wall = time.perf_counter() - self.started
+        with self._lock:
+            model = dict(self.model)
+            tools = {name: dict(totals) for name, totals in self.tools.items()}
+        lines = [f"Session {self.session}: {wall:.2f}s wall time"]
+        if model:
+            lines.append(
+                f"  model: {int(model['calls'])} calls, {model['seconds']:.2f}s "
+                f"({100 * model['seconds'] / wall if wall else 0:.0f}%), "
+                f"{int(model.get('prompt_tokens', 0))} prompt + {int(model.get('response_tokens', 0))} response "
+                f"= {int(model.get('total_tokens', 0))} tokens"
+                + (f" ({int(model['cached_tokens'])} cached)" if model.get("cached_tokens") else "")
+            )
+        tool_seconds = sum(totals["seconds"] for totals in tools.values())
+        if tools:
+            lines.append(f"  tools: {sum(int(t['calls']) for t in tools.values())} calls, {tool_seconds:.2f}s "
+                         "(summed over calls; concurrent calls overlap)")
+            for name, totals in sorted(tools.items(), key=lambda item: -item[1]["seconds"]):
+                line = (f"    {name}: {int(totals['calls'])} calls, {totals['seconds']:.3f}s, "
+                        f"{int(totals.get('args_bytes', 0))} bytes in, {int(totals.get('result_bytes', 0))} bytes out")
+                if totals.get("cache_hits") or totals.get("cache_misses"):
+                    line += f", read cache {int(totals.get('cache_hits', 0))} hits / {int(totals.get('cache_misses', 0))} misses"
+                lines.append(line)
+        return "\n".join(lines)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
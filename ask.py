@@ -0,0 +1,96 @@
+# ask.py
+"""
+Thin client for daemon.py: sends one prompt to the running daemon over its Unix
+socket and prints the session's output as it streams back.
+
+Only the standard library is imported here, so a prompt costs little more than
+starting the interpreter; the model client, tool declarations and indexes stay
+warm in the daemon.
+
+Usage:
+    python daemon.py &
+    python ask.py "fix the bug in the calculator" [-v] [--max-workers 4]
+    python ask.py --status
+    python ask.py --stop
+
+Protocol (one JSON object per line, both ways):
+    request:  {"command": "prompt" | "status" | "stop", "prompt": ..., <session options>}
+    replies:  {"type": "output", "text": ...} while the session runs, then
+              {"type": "done", ...} or {"type": "error", "error": ...}
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+
+
+def default_socket_path():
+    directory = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return os.path.join(directory, f"llm-code-assistant-{os.getuid()}.sock")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Send a prompt to the assistant daemon')
+    parser.add_argument("prompt", nargs="?", help="Prompt to send")
+    parser.add_argument('-v', '--verbose', action="store_true")
+    parser.add_argument('--socket', default=default_socket_path(), help="Path of the daemon's Unix socket")
+    parser.add_argument('--max-workers', type=int, default=None,
+                        help="How many tool calls from one turn may run concurrently")
+    parser.add_argument('--history-budget', type=int, default=None,
+                        help="Approximate token budget for the conversation history")
+    parser.add_argument('--deadline', type=float, default=None, help="Wall-clock limit for the session in seconds")
+    parser.add_argument('--model-timeout', type=float, default=None, help="Seconds before a model call is retried")
+    parser.add_argument('--tool-timeout', type=float, default=None, help="Seconds before a tool call is abandoned")
+    parser.add_argument('--status', action="store_true", help="Print the daemon's status instead")
+    parser.add_argument('--stop', action="store_true", help="Stop the daemon")
+    return parser.parse_args(argv)
+
+
+def request(socket_path, message):
+    """Sends one request and yields the daemon's replies as they arrive."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        connection.sendall((json.dumps(message) + "\n").encode("utf-8"))
+        with connection.makefile("r", encoding="utf-8") as replies:
+            for line in replies:
+                yield json.loads(line)
+
+
+def main():
+    args = parse_args()
+    if args.stop:
+        message = {"command": "stop"}
+    elif args.status:
+        message = {"command": "status"}
+    elif args.prompt:
+        message = {"command": "prompt", "prompt": args.prompt, "verbose": args.verbose}
+        for option in ("max_workers", "history_budget", "deadline", "model_timeout", "tool_timeout"):
+            if getattr(args, option) is not None:
+                message[option] = getattr(args, option)
+    else:
+        print("Error: Give a prompt, --status or --stop.")
+        sys.exit(1)
+
+    try:
+        for reply in request(args.socket, message):
+            if reply["type"] == "output":
+                sys.stdout.write(reply["text"])
+                sys.stdout.flush()
+            elif reply["type"] == "error":
+                print(f"Error: {reply['error']}", file=sys.stderr)
+                sys.exit(1)
+            else:
+                if message["command"] != "prompt":
+                    print(json.dumps({key: value for key, value in reply.items() if key != "type"}, indent=2))
+                return
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f'Error: No daemon is listening on "{args.socket}". Start one with: python daemon.py', file=sys.stderr)
+        sys.exit(1)
+    print("Error: The daemon closed the connection before the session finished.", file=sys.stderr)
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+# batch.py
+"""
+Runs many prompts, each as its own agent session, concurrently.
+
+Tasks are read from a JSONL file, one per line. A line is either
+{"id": ..., "prompt": ...} or a backlog entry such as those in requests.jsonl
+({"request_id": ..., "title": ..., "body": ...}, sent as title and body).
+Sessions run on the async model client, at most --concurrency at a time, and
+share one rate limiter (--rpm, --tpm). Requests that fail with 429 or 5xx are
+retried with backoff. One result line per task is written to the output file
+as soon as the task finishes:
+
+    {"id", "status": "ok" | "error", "response", "error", "turns", "tool_calls",
+     "usage": {...}, "wall_time_s"}
+
+Usage:
+    python batch.py tasks.jsonl --output results.jsonl --concurrency 16 --rpm 1000 --tpm 1000000
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+import main as agent_main
+from agent.model_client import RateLimitedClient
+from agent.rate_limit import RateLimiter
+from agent.tracing import Tracer
+from functions import run_python
+from functions.run_python import enable_worker_pool
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Run the prompts of a JSONL file as concurrent agent sessions')
+    parser.add_argument("tasks", help="JSONL file with one task per line")
+    parser.add_argument('-o', '--output', required=True, help="JSONL file the results are appended to")
+    parser.add_argument('--concurrency', type=int, default=8, help="Sessions running at once (default: 8)")
+    parser.add_argument('--rpm', type=int, default=None, help="Model requests per minute across all sessions")
+    parser.add_argument('--tpm', type=int, default=None, help="Model tokens per minute across all sessions")
+    parser.add_argument('--max-retries', type=int, default=5,
+                        help="Retries of a model request that failed with 429 or 5xx (default: 5)")
+    parser.add_argument('--max-workers', type=int, default=1,
+                        help="How many tool calls from one turn may run concurrently (default: 1)")
+    parser.add_argument('--history-budget', type=int, default=None,
+                        help="Approximate token budget for each session's history")
+    parser.add_argument('--repo-map-budget', type=int, default=agent_main.REPO_MAP_BUDGET,
+                        help="Tokens of working directory map (files, classes, functions) put in front of the system prompt of each session (default: %(default)s) (0: none)")
+    parser.add_argument('--deadline', type=float, default=None,
+                        help="Wall-clock limit for each session in seconds; near it the model is asked for a final answer")
+    parser.add_argument('--model-timeout', type=float, default=None,
+                        help="Seconds after which a model call is cancelled and retried")
+    parser.add_argument('--tool-timeout', type=float, default=None,
+                        help="Seconds after which a tool call is abandoned")
+    parser.add_argument('--trace', metavar="FILE", default=None,
+                        help="Append a JSONL span for every model call and tool call of every task to FILE")
+    parser.add_argument('--python-workers', type=int, default=0,
+                        help="Keep this many pre-started Python interpreters for run_python_file (default: 0, off)")
+    parser.add_argument('--local-url', metavar="URL", default=None,
+                        help="Use the model of a local OpenAI-compatible server (llama.cpp, Ollama...) instead of Gemini, "
+                             "e.g. http://127.0.0.1:8080/v1")
+    parser.add_argument('--local-model', metavar="NAME", default=None,
+                        help="Model name to ask the --local-url server for (default: the server's choice)")
+    parser.add_argument('--record', metavar="LOG", default=None,
+                        help="Record every model request/response to this JSONL log (.gz to compress)")
+    parser.add_argument('--replay', metavar="LOG", default=None,
+                        help="Serve model responses from a log written by --record, without network access")
+    return parser.parse_args(argv)
+
+
+def load_tasks(path):
+    """Returns (id, prompt) for every task in a JSONL file."""
+    tasks = []
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            task_id = entry.get("id") or entry.get("request_id") or str(number)
+            prompt = entry.get("prompt")
+            if prompt is None:
+                prompt = "\n\n".join(entry[key] for key in ("title", "body") if entry.get(key))
+            tasks.append((task_id, prompt))
+    return tasks
+
+
+def final_response(messages):
+    """The text of the model's last text part, or None."""
+    for content in reversed(messages):
+        if content.role == "model":
+            texts = [part.text for part in content.parts or [] if part.text]
+            if texts:
+                return "".join(texts)
+    return None
+
+
+async def run_task(client, task_id, prompt, trace_path=None, **session_options):
+    """Runs one session (see main.run_agent_async for the options) and returns its result line."""
+    usage = {}
+    # Spans of every task go to the same file, told apart by their "session" (the task id)
+    tracer = Tracer(trace_path, session=str(task_id))
+    started = time.perf_counter()
+    result = {"id": task_id}
+    try:
+        messages = await agent_main.run_agent_async(
+            client, prompt, quiet=True, usage=usage, tracer=tracer, **session_options
+        )
+        result["status"] = "ok"
+        result["response"] = final_response(messages)
+        result["turns"] = usage.get("model_calls", 0)
+        result["tool_calls"] = sum(
+            1 for content in messages for part in content.parts or [] if part.function_call
+        )
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        tracer.close()
+    if "model_time_s" in usage:
+        usage["model_time_s"] = round(usage["model_time_s"], 3)
+    result["usage"] = usage
+    result["wall_time_s"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+async def run_batch(client, tasks, output_path, concurrency=8, **session_options):
+    """
+    Runs `tasks` ((id, prompt) pairs) with at most `concurrency` sessions at a time,
+    appending each result to `output_path` as it finishes. `session_options` are
+    passed on to main.run_agent_async.
+
+    Returns:
+        The number of tasks that failed.
+    """
+    # Tool calls and blocking clients run on the default executor: size it for the sessions
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=concurrency * max(1, session_options.get("max_workers", 1)) + 4)
+    )
+    queue = asyncio.Queue()
+    for task in tasks:
+        queue.put_nowait(task)
+    failed = 0
+    done = 0
+
+    with open(output_path, "a", encoding="utf-8") as output:
+        async def worker():
+            nonlocal failed, done
+            while True:
+                try:
+                    task_id, prompt = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                result = await run_task(client, task_id, prompt, **session_options)
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+                done += 1
+                if result["status"] != "ok":
+                    failed += 1
+                print(f"[{done}/{len(tasks)}] {task_id}: {result['status']} in {result['wall_time_s']}s",
+                      file=sys.stderr)
+
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return failed
+
+
+def main():
+    load_dotenv()
+    args = parse_args()
+    if args.python_workers > 0:
+        enable_worker_pool(size=args.python_workers)
+    if args.tool_timeout is not None:
+        run_python.run_timeout = min(run_python.run_timeout, args.tool_timeout)
+
+    tasks = load_tasks(args.tasks)
+    limiter = RateLimiter(requests_per_minute=args.rpm, tokens_per_minute=args.tpm)
+    client = RateLimitedClient(agent_main.build_client(args), limiter, max_retries=args.max_retries)
+
+    started = time.perf_counter()
+    failed = asyncio.run(run_batch(client, tasks, args.output, concurrency=args.concurrency,
+                                   max_workers=args.max_workers, history_budget=args.history_budget,
+                                   deadline=args.deadline, model_timeout=args.model_timeout,
+                                   tool_timeout=args.tool_timeout, repo_map_budget=args.repo_map_budget,
+                                   trace_path=args.trace))
+    stats = client.stats
+    print(f"{len(tasks)} tasks in {time.perf_counter() - started:.1f}s: {len(tasks) - failed} ok, {failed} failed; "
+          f"{stats['requests']} model requests, {stats['retries']} retries, "
+          f"{stats['rate_limit_wait_s']:.1f}s waiting for the rate limit", file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
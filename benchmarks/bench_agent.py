@@ -0,0 +1,263 @@
+# bench_agent.py
+"""
+End-to-end benchmarks for the agent loop.
+
+Each scenario builds a throwaway working directory, then runs main.run_agent
+against a ScriptedClient standing in for the model, so the numbers measure the
+loop, the tools and the history handling without any network access.
+Every scenario runs in its own Python process so its peak RSS is its own.
+
+Usage (from the repository root):
+    python benchmarks/bench_agent.py --output before.json
+    python benchmarks/bench_agent.py --output after.json --compare before.json
+    python benchmarks/bench_agent.py --scenario slow_scripts --max-workers 4
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main as agent_main  # noqa: E402
+from agent.model_client import ModelClient, ScriptedClient, function_call_response  # noqa: E402
+from functions.dispatch import ToolDispatcher  # noqa: E402
+
+
+# --- Scenarios ---
+# Each scenario is (setup, script): setup(workdir) fills the working directory,
+# script(workdir) returns the ScriptedClient script that drives the session.
+
+def _setup_many_files(workdir):
+    for package in range(10):
+        package_dir = os.path.join(workdir, f"pkg{package}")
+        os.makedirs(package_dir)
+        for module in range(20):
+            with open(os.path.join(package_dir, f"module{module}.py"), "w") as f:
+                f.write(f"def function_{module}(x):\n    return x * {module}\n" * 100)
+
+
+def _script_many_files(workdir):
+    script = []
+    for package in range(10):
+        calls = [("get_file_content", {"file_path": f"pkg{package}/module{module}.py"}) for module in range(20)]
+        script.append(function_call_response(*calls))
+    script.append("Read all the modules.")
+    return script
+
+
+def _setup_large_directory(workdir):
+    big = os.path.join(workdir, "big")
+    os.makedirs(big)
+    for index in range(20000):
+        with open(os.path.join(big, f"file{index:05d}.txt"), "w") as f:
+            f.write("x" * (index % 100))
+
+
+def _script_large_directory(workdir):
+    return [
+        function_call_response(("get_files_info", {})),
+        function_call_response(("get_files_info", {"directory": "big"})),
+        function_call_response(("get_files_info", {"directory": "big"})),
+        "Listed the directory.",
+    ]
+
+
+def _setup_slow_scripts(workdir):
+    for index in range(4):
+        with open(os.path.join(workdir, f"slow{index}.py"), "w") as f:
+            f.write(f"import time\ntime.sleep(0.5)\nprint('slow script {index} done')\n")
+
+
+def _script_slow_scripts(workdir):
+    turn = []
+    for index in range(4):
+        turn.append(("run_python_file", {"file_path": f"slow{index}.py"}))
+        turn.append(("get_file_content", {"file_path": f"slow{index}.py"}))
+    return [function_call_response(*turn), function_call_response(*turn), "Ran the scripts."]
+
+
+def _setup_long_session(workdir):
+    with open(os.path.join(workdir, "big_module.py"), "w") as f:
+        f.write("# filler line for a big module\n" * 320)
+
+
+def _script_long_session(workdir):
+    script = []
+    # main.MAX_ITERATIONS is 20: 19 read/write turns, then the final answer
+    for turn in range(19):
+        script.append(function_call_response(
+            ("get_file_content", {"file_path": "big_module.py"}),
+            ("write_file", {"file_path": f"notes_turn{turn}.txt", "content": f"notes for turn {turn}\n" * 20}),
+        ))
+    script.append("Finished the long session.")
+    return script
+
+
+SCENARIOS = {
+    "read_many_files": (_setup_many_files, _script_many_files),
+    "list_large_directory": (_setup_large_directory, _script_large_directory),
+    "slow_scripts": (_setup_slow_scripts, _script_slow_scripts),
+    "long_session": (_setup_long_session, _script_long_session),
+}
+
+
+class TimedClient(ModelClient):
+    """Wraps the stand-in model to time each iteration and count the bytes sent to it."""
+
+    def __init__(self, inner, model_latency=0.0):
+        self.inner = inner
+        self.model_latency = model_latency
+        self.request_started = []
+        self.prompt_bytes = 0
+
+    def _record(self, contents):
+        self.request_started.append(time.perf_counter())
+        self.prompt_bytes += sum(
+            len(json.dumps(content.model_dump(mode="json", exclude_none=True))) for content in contents
+        )
+        if self.model_latency:
+            time.sleep(self.model_latency)
+
+    def generate_content(self, model, contents, config):
+        self._record(contents)
+        return self.inner.generate_content(model=model, contents=contents, config=config)
+
+    def generate_content_stream(self, model, contents, config):
+        self._record(contents)
+        yield from self.inner.generate_content_stream(model=model, contents=contents, config=config)
+
+
+def _peak_rss_kb(who):
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_scenario(name, max_workers=1, stream=False, history_budget=None, model_latency=0.0):
+    """Runs one scenario in this process and returns its measurements."""
+    setup, make_script = SCENARIOS[name]
+    with tempfile.TemporaryDirectory(prefix=f"bench_{name}_") as workdir:
+        setup(workdir)
+        client = TimedClient(ScriptedClient(make_script(workdir)), model_latency=model_latency)
+        dispatcher = ToolDispatcher(max_workers=max_workers, working_directory=workdir)
+
+        started = time.perf_counter()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            messages = agent_main.run_agent(
+                client, f"benchmark scenario {name}",
+                stream=stream, history_budget=history_budget, dispatcher=dispatcher,
+            )
+        finished = time.perf_counter()
+        dispatcher.shutdown()
+
+    boundaries = client.request_started + [finished]
+    iteration_latencies = [later - earlier for earlier, later in zip(boundaries, boundaries[1:])]
+    tool_result_bytes = sum(
+        len(str(content.parts[0].function_response.response))
+        for content in messages
+        if content.role == "tool" and content.parts and content.parts[0].function_response
+    )
+    return {
+        "wall_time_s": round(finished - started, 4),
+        "iterations": len(iteration_latencies),
+        "iteration_latency_s": [round(latency, 4) for latency in iteration_latencies],
+        "tool_time_s": {tool: round(stats["seconds"], 4) for tool, stats in dispatcher.tool_stats.items()},
+        "tool_calls": {tool: stats["calls"] for tool, stats in dispatcher.tool_stats.items()},
+        "tool_result_bytes": tool_result_bytes,
+        "prompt_bytes_sent": client.prompt_bytes,
+        "peak_rss_kb": _peak_rss_kb(resource.RUSAGE_SELF),
+        "peak_child_rss_kb": _peak_rss_kb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _print_comparison(baseline, results):
+    print(f"{'scenario':<24}{'before':>10}{'after':>10}{'change':>10}")
+    for name, result in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if before is None:
+            continue
+        old, new = before["wall_time_s"], result["wall_time_s"]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        print(f"{name:<24}{old:>9.3f}s{new:>9.3f}s{change:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the agent loop against a scripted stand-in model")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="Scenario to run (repeatable; default: all)")
+    parser.add_argument("--output", help="Write the results as JSON to this file (default: stdout)")
+    parser.add_argument("--compare", metavar="JSON", help="Print wall time changes against an earlier results file")
+    parser.add_argument("--max-workers", type=int, default=1)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--history-budget", type=int, default=None)
+    parser.add_argument("--model-latency", type=float, default=0.0,
+                        help="Seconds the stand-in model waits before each response")
+    parser.add_argument("--child-output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    options = {
+        "max_workers": args.max_workers,
+        "stream": args.stream,
+        "history_budget": args.history_budget,
+        "model_latency": args.model_latency,
+    }
+
+    # Child process: run the single requested scenario and write its result
+    if args.child_output:
+        with open(args.child_output, "w") as f:
+            json.dump(run_scenario(args.scenario[0], **options), f)
+        return
+
+    results = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "options": options,
+        "scenarios": {},
+    }
+    for name in args.scenario or list(SCENARIOS):
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
+            child_output = tmp.name
+        command = [sys.executable, os.path.abspath(__file__), "--scenario", name, "--child-output", child_output,
+                   "--max-workers", str(args.max_workers), "--model-latency", str(args.model_latency)]
+        if args.stream:
+            command.append("--stream")
+        if args.history_budget is not None:
+            command += ["--history-budget", str(args.history_budget)]
+        try:
+            subprocess.run(command, check=True)
+            with open(child_output) as f:
+                results["scenarios"][name] = json.load(f)
+        finally:
+            os.remove(child_output)
+        print(f"{name}: {results['scenarios'][name]['wall_time_s']:.3f}s", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            _print_comparison(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
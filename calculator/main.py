@@ -1,6 +1,47 @@
 import sys
+import time
 from pkg.calculator import Calculator
-from pkg.render import render
+from pkg.render import format_result, render
+
+
+def stream(lines, calculator, out, boxed=False, batch_size=1024, prompt=None):
+    """
+    Evaluates one expression per line and writes one result per line (or a box
+    per expression with boxed=True). A line that fails gives "Error: ..." in
+    place of its result and the stream goes on; blank lines give blank lines.
+    Output is written in batches of `batch_size` results.
+
+    Returns:
+        (expressions evaluated, errors)
+    """
+    count = 0
+    errors = 0
+    pending = []
+    if prompt:
+        out.write(prompt)
+        out.flush()
+    for line in lines:
+        expression = line.strip()
+        if not expression:
+            pending.append("")
+        else:
+            count += 1
+            try:
+                result = calculator.evaluate(expression)
+                pending.append(render(expression, result) if boxed else format_result(result))
+            except Exception as e:
+                errors += 1
+                pending.append(f"Error: {e}")
+        if len(pending) >= batch_size:
+            out.write("\n".join(pending) + "\n")
+            pending = []
+            if prompt:
+                out.write(prompt)
+            out.flush()
+    if pending:
+        out.write("\n".join(pending) + "\n")
+    out.flush()
+    return count, errors
 
 
 def main():
@@ -8,7 +49,31 @@ def main():
     if len(sys.argv) <= 1:
         print("Calculator App")
         print('Usage: python main.py "<expression>"')
+        print('       python main.py --stream [--boxed] [--stats] [FILE]')
         print('Example: python main.py "3 + 5"')
+        print('Example: printf "3 + 5\\n2 * 4\\n" | python main.py --stream')
+        return
+
+    if sys.argv[1] == "--stream":
+        options = [arg for arg in sys.argv[2:] if arg.startswith("--")]
+        files = [arg for arg in sys.argv[2:] if not arg.startswith("--")]
+        try:
+            source = open(files[0]) if files and files[0] != "-" else sys.stdin
+        except OSError as e:
+            print(f"Error: cannot read {files[0]}: {e.strerror}")
+            return
+        interactive = source.isatty()
+        started = time.perf_counter()
+        with source:
+            # One result at a time when typing; big batches when piped
+            count, errors = stream(source, calculator, sys.stdout, boxed="--boxed" in options,
+                                   batch_size=1 if interactive else 1024,
+                                   prompt="> " if interactive else None)
+        if "--stats" in options:
+            elapsed = time.perf_counter() - started
+            rate = count / elapsed if elapsed else 0
+            print(f"{count} expressions ({errors} errors) in {elapsed:.3f}s: {rate:.0f} expressions/s",
+                  file=sys.stderr)
         return
 
     expression = " ".join(sys.argv[1:])
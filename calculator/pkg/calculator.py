@@ -1,7 +1,20 @@
 # calculator.py
 
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError: # evaluate_many then works row by row
+    np = None
+
+# Kinds of step in a compiled program
+NUMBER = 0
+VARIABLE = 1
+OPERATOR = 2
+
+
 class Calculator:
-    def __init__(self):
+    def __init__(self, cache_size=1024):
         self.operators = {
             "+": lambda a, b: a + b,
             "-": lambda a, b: a - b,
@@ -14,16 +27,73 @@ class Calculator:
             "+": 1,
             "-": 1,
         }
+        # Compiled programs of recently used expressions, least recently used first
+        self.cache_size = cache_size
+        self._programs = OrderedDict()
 
-    def evaluate(self, expression):
+    def evaluate(self, expression, variables=None):
         if not expression or expression.isspace():
             return None
-        tokens = expression.strip().split()
-        return self._evaluate_infix(tokens)
+        return self._run(self.compile(expression), variables or {})
+
+    def compile(self, expression):
+        """
+        Turns an expression into a program in reverse Polish notation: a tuple of
+        (NUMBER, value), (VARIABLE, name) and (OPERATOR, symbol) steps. Programs
+        are cached by expression text, so an expression is only parsed once.
+        """
+        program = self._programs.get(expression)
+        if program is not None:
+            self._programs.move_to_end(expression)
+            return program
+        program = self._compile_infix(expression.strip().split())
+        self._programs[expression] = program
+        if len(self._programs) > self.cache_size:
+            self._programs.popitem(last=False)
+        return program
 
-    def _evaluate_infix(self, tokens):
-        values = []
+    def evaluate_many(self, expression, variables):
+        """
+        Evaluates one expression for many rows of variable values.
+
+        `variables` is either a dict of columns ({"x": [1, 2, 3], "y": ...}) or
+        a list of rows ([{"x": 1, "y": 4}, ...]). The expression is compiled
+        once. With NumPy installed the whole batch is evaluated in one pass over
+        arrays (division by zero then gives inf or nan instead of raising);
+        otherwise it is evaluated row by row. Returns a list of one float per
+        row either way.
+        """
+        program = self.compile(expression)
+        row_count = None
+        if isinstance(variables, (list, tuple)):
+            row_count = len(variables)
+            names = {name for row in variables for name in row}
+            for index, row in enumerate(variables):
+                for name in names:
+                    if name not in row:
+                        raise ValueError(f"row {index} has no value for variable {name}")
+            variables = {name: [row[name] for row in variables] for name in names}
+        rows = {len(column) for column in variables.values()}
+        if len(rows) > 1:
+            raise ValueError("all variables must have the same number of rows")
+        if row_count is None:
+            row_count = rows.pop() if rows else 0
+
+        if np is None:
+            return [
+                float(self._run(program, {name: column[row] for name, column in variables.items()}))
+                for row in range(row_count)
+            ]
+        columns = {name: np.asarray(column, dtype=float) for name, column in variables.items()}
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result = self._run(program, columns)
+        # An expression without variables gives a single number: repeat it for every row
+        return np.broadcast_to(np.asarray(result, dtype=float), (row_count,)).tolist()
+
+    def _compile_infix(self, tokens):
+        program = []
         operators = []
+        depth = 0 # Values on the stack when the program gets this far
 
         for token in tokens:
             if token in self.operators:
@@ -32,30 +102,46 @@ class Calculator:
                     and operators[-1] in self.operators
                     and self.precedence[operators[-1]] >= self.precedence[token]
                 ):
-                    self._apply_operator(operators, values)
+                    depth = self._emit_operator(operators, program, depth)
                 operators.append(token)
             else:
                 try:
-                    values.append(float(token))
+                    program.append((NUMBER, float(token)))
                 except ValueError:
-                    raise ValueError(f"invalid token: {token}")
+                    if not token.isidentifier():
+                        raise ValueError(f"invalid token: {token}")
+                    program.append((VARIABLE, token))
+                depth += 1
 
         while operators:
-            self._apply_operator(operators, values)
+            depth = self._emit_operator(operators, program, depth)
 
-        if len(values) != 1:
+        if depth != 1:
             raise ValueError("invalid expression")
 
-        return values[0]
-
-    def _apply_operator(self, operators, values):
-        if not operators:
-            return
+        return tuple(program)
 
+    def _emit_operator(self, operators, program, depth):
         operator = operators.pop()
-        if len(values) < 2:
+        if depth < 2:
             raise ValueError(f"not enough operands for operator {operator}")
+        program.append((OPERATOR, operator))
+        return depth - 1
 
-        b = values.pop()
-        a = values.pop()
-        values.append(self.operators[operator](a, b))
+    def _run(self, program, variables):
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        operators = self.operators
+        for kind, value in program:
+            if kind == NUMBER:
+                push(value)
+            elif kind == VARIABLE:
+                if value not in variables:
+                    raise ValueError(f"invalid token: {value}")
+                push(variables[value])
+            else:
+                b = pop()
+                a = pop()
+                push(operators[value](a, b))
+        return stack[0]
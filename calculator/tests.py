@@ -1,6 +1,8 @@
 # tests.py
 
+import io
 import unittest
+from main import stream
 from pkg.calculator import Calculator
 
 
@@ -44,6 +46,45 @@ class TestCalculator(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.calculator.evaluate("+ 3")
 
+    def test_variables(self):
+        result = self.calculator.evaluate("x * 2 + y", {"x": 3, "y": 1})
+        self.assertEqual(result, 7)
+
+    def test_unbound_variable(self):
+        with self.assertRaises(ValueError):
+            self.calculator.evaluate("x + 1")
+
+    def test_compile_cache(self):
+        program = self.calculator.compile("3 * 4 + 5")
+        self.assertIs(self.calculator.compile("3 * 4 + 5"), program)
+
+    def test_compile_cache_is_bounded(self):
+        calculator = Calculator(cache_size=2)
+        for expression in ("1 + 1", "2 + 2", "3 + 3"):
+            calculator.compile(expression)
+        self.assertEqual(list(calculator._programs), ["2 + 2", "3 + 3"])
+
+    def test_evaluate_many_columns(self):
+        result = self.calculator.evaluate_many("x * 2 + y", {"x": [1, 2, 3], "y": [10, 20, 30]})
+        self.assertEqual(result, [12.0, 24.0, 36.0])
+
+    def test_evaluate_many_rows(self):
+        result = self.calculator.evaluate_many("a - b / 2", [{"a": 5, "b": 4}, {"a": 1, "b": 1}])
+        self.assertEqual(result, [3.0, 0.5])
+
+    def test_evaluate_many_constant(self):
+        self.assertEqual(self.calculator.evaluate_many("1 + 2", [{}, {}]), [3.0, 3.0])
+
+    def test_evaluate_many_missing_variable(self):
+        with self.assertRaisesRegex(ValueError, "row 1 has no value for variable b"):
+            self.calculator.evaluate_many("a - b", [{"a": 5, "b": 4}, {"a": 1}])
+
+    def test_stream(self):
+        out = io.StringIO()
+        count, errors = stream(["3 + 5\n", "\n", "2 * $\n", "10 / 4\n"], self.calculator, out, batch_size=2)
+        self.assertEqual(out.getvalue(), "8\n\nError: invalid token: $\n2.5\n")
+        self.assertEqual((count, errors), (3, 1))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,265 @@
+# daemon.py
+"""
+Long-running assistant: keeps everything a session needs warm between prompts.
+
+A main.py run imports google.genai, reads .env, builds the client, opens TLS
+connections and builds the tool declarations before doing any work. The
+daemon pays for that once. It keeps one model client (and its pooled HTTP
+connections), the tool declarations, the file read cache and the code search
+and symbol indexes in memory, and serves prompts sent by ask.py over a Unix
+socket. Every prompt runs as its own session on main.run_agent_async, so
+several can run at once, and whatever the session prints is streamed back to
+the client that sent it.
+
+Usage:
+    python daemon.py [--socket PATH] [--python-workers 2] [--prefetch] [--trace FILE]
+    python ask.py "what does the calculator do?"
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from dotenv import load_dotenv
+
+import main as agent_main
+from agent.tracing import Tracer
+from ask import default_socket_path
+from functions.call_function import WORKING_DIRECTORY
+from functions import prefetch
+from functions.file_cache import read_cache
+from functions.run_python import enable_worker_pool
+from functions.search_code import get_index as get_search_index
+from functions.symbol_index import get_index as get_symbol_index
+
+# Options a request may set for its session (see main.run_agent_async)
+SESSION_OPTIONS = ("verbose", "max_workers", "history_budget", "deadline", "model_timeout", "tool_timeout",
+                   "repo_map_budget")
+
+# Where the current session's printed output goes; None outside sessions
+_session_output = contextvars.ContextVar("session_output", default=None)
+
+
+class _SessionStdout:
+    """
+    Stands in for sys.stdout in the daemon. What a session prints (the loop and
+    the tools only use print) is sent to the session's client; anything else
+    goes to the daemon's own stdout.
+    """
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def write(self, text):
+        send = _session_output.get()
+        if send is None:
+            return self.fallback.write(text)
+        send(text)
+        return len(text)
+
+    def flush(self):
+        if _session_output.get() is None:
+            self.fallback.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.fallback, name)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Serve assistant sessions over a Unix socket')
+    parser.add_argument('--socket', default=default_socket_path(), help="Path of the Unix socket to listen on")
+    parser.add_argument('--max-workers', type=int, default=1,
+                        help="Default for how many tool calls from one turn may run concurrently")
+    parser.add_argument('--history-budget', type=int, default=None,
+                        help="Default token budget for the conversation history")
+    parser.add_argument('--repo-map-budget', type=int, default=agent_main.REPO_MAP_BUDGET,
+                        help="Tokens of working directory map (files, classes, functions) put in front of the system prompt of each session (default: %(default)s) (0: none)")
+    parser.add_argument('--python-workers', type=int, default=0,
+                        help="Keep this many pre-started Python interpreters for run_python_file (default: 0, off)")
+    parser.add_argument('--python-worker-runs', type=int, default=1,
+                        help="Scripts each pre-started interpreter runs before it is replaced (default: 1)")
+    parser.add_argument('--prefetch', action="store_true",
+                        help="Read listed files and the local imports of read files ahead, on a background thread")
+    parser.add_argument('--trace', metavar="FILE", default=None,
+                        help="Append a JSONL span for every model call and tool call of every session to FILE")
+    parser.add_argument('--local-url', metavar="URL", default=None,
+                        help="Use the model of a local OpenAI-compatible server (llama.cpp, Ollama...) instead of Gemini, "
+                             "e.g. http://127.0.0.1:8080/v1")
+    parser.add_argument('--local-model', metavar="NAME", default=None,
+                        help="Model name to ask the --local-url server for (default: the server's choice)")
+    parser.add_argument('--record', metavar="LOG", default=None,
+                        help="Record every model request/response to this JSONL log (.gz to compress)")
+    parser.add_argument('--replay', metavar="LOG", default=None,
+                        help="Serve model responses from a log written by --record, without network access")
+    return parser.parse_args(argv)
+
+
+class AssistantDaemon:
+    """
+    Serves requests from ask.py on a Unix socket; see ask.py for the protocol.
+
+    Args:
+        client: The agent.model_client.ModelClient shared by every session.
+        socket_path: Where to listen.
+        defaults: Session options used when a request does not set them.
+        trace_path: Optional JSONL file for the spans of every session.
+    """
+
+    def __init__(self, client, socket_path, defaults=None, trace_path=None):
+        self.client = client
+        self.socket_path = socket_path
+        self.defaults = dict(defaults or {})
+        self.trace_path = trace_path
+        self.started = time.time()
+        self.sessions_served = 0
+        self.active_sessions = 0
+        self._stopping = None
+
+    def status(self):
+        return {
+            "pid": os.getpid(),
+            "uptime_s": round(time.time() - self.started, 1),
+            "sessions_served": self.sessions_served,
+            "active_sessions": self.active_sessions,
+            "file_read_cache": read_cache.stats(),
+            "prefetch": prefetch.prefetcher.stats() if prefetch.prefetcher is not None else None,
+        }
+
+    async def serve(self):
+        self._stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, self._stopping.set)
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        os.chmod(self.socket_path, 0o600) # Only this user may run prompts (and tools) through it
+        print(f"Listening on {self.socket_path}")
+        try:
+            async with server:
+                await self._stopping.wait()
+        finally:
+            try:
+                os.remove(self.socket_path)
+            except OSError:
+                pass
+
+    async def _handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+
+        def send(message):
+            # Called from tool threads too; the write itself always happens on the loop
+            loop.call_soon_threadsafe(writer.write, (json.dumps(message) + "\n").encode("utf-8"))
+
+        stop = False
+        try:
+            request = json.loads(await reader.readline() or "{}")
+            command = request.get("command", "prompt")
+            if command == "prompt":
+                await self._run_session(request, send, reader)
+            elif command == "status":
+                send({"type": "done", **self.status()})
+            elif command == "stop":
+                send({"type": "done", "stopping": True})
+                stop = True
+            else:
+                send({"type": "error", "error": f'Unknown command "{command}"'})
+        except Exception as e:
+            send({"type": "error", "error": f"{type(e).__name__}: {e}"})
+        finally:
+            await asyncio.sleep(0) # Let the writes scheduled by send() run
+            try:
+                await writer.drain()
+                writer.close()
+                await writer.wait_closed()
+            except (ConnectionError, BrokenPipeError):
+                pass
+            if stop:
+                # Only once the reply is out: stopping the server cancels open connections
+                self._stopping.set()
+
+    async def _run_session(self, request, send, reader):
+        if not request.get("prompt"):
+            send({"type": "error", "error": "The request has no prompt"})
+            return
+        options = dict(self.defaults)
+        options.update({key: request[key] for key in SESSION_OPTIONS if request.get(key) is not None})
+        usage = {}
+        tracer = Tracer(self.trace_path)
+        started = time.perf_counter()
+        self.active_sessions += 1
+
+        token = _session_output.set(lambda text: send({"type": "output", "text": text}))
+        try:
+            # Tasks copy the current context, so the session's output goes to this client
+            session = asyncio.ensure_future(agent_main.run_agent_async(
+                self.client, request["prompt"], usage=usage, tracer=tracer, **options
+            ))
+        finally:
+            _session_output.reset(token)
+        # The client sends nothing after its request: end of input means it went away
+        client_gone = asyncio.ensure_future(reader.read())
+        try:
+            await asyncio.wait({session, client_gone}, return_when=asyncio.FIRST_COMPLETED)
+            if not session.done():
+                session.cancel()
+                return
+            session.result()
+            send({"type": "done", "session": tracer.session, "usage": usage,
+                  "wall_time_s": round(time.perf_counter() - started, 3)})
+        finally:
+            client_gone.cancel()
+            tracer.close()
+            self.active_sessions -= 1
+            self.sessions_served += 1
+
+
+def _socket_in_use(path):
+    """True if a daemon is already listening on `path`; a socket file left by a dead one is removed."""
+    if not os.path.exists(path):
+        return False
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+            return True
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(path)
+            return False
+
+
+def _warm_indexes():
+    # Build the search and symbol indexes before the first prompt needs them
+    get_search_index(WORKING_DIRECTORY).refresh()
+    get_symbol_index(WORKING_DIRECTORY).refresh()
+
+
+def main():
+    load_dotenv()
+    args = parse_args()
+    if _socket_in_use(args.socket):
+        print(f'Error: A daemon is already listening on "{args.socket}".')
+        sys.exit(1)
+
+    if args.python_workers > 0:
+        enable_worker_pool(size=args.python_workers, max_runs=args.python_worker_runs)
+    if args.prefetch:
+        prefetch.enable_prefetch()
+    threading.Thread(target=_warm_indexes, daemon=True).start()
+
+    sys.stdout = _SessionStdout(sys.stdout)
+    daemon = AssistantDaemon(
+        agent_main.build_client(args),
+        args.socket,
+        defaults={"max_workers": args.max_workers, "history_budget": args.history_budget,
+                  "repo_map_budget": args.repo_map_budget},
+        trace_path=args.trace,
+    )
+    asyncio.run(daemon.serve())
+
+
+if __name__ == "__main__":
+    main()
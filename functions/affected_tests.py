@@ -0,0 +1,128 @@
+import os
+import re
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import run_python
+from .import_graph import get_graph
+
+# Longest exception message kept per failing test
+message_limit = 300
+
+_RAN = re.compile(r"^Ran (\d+) tests? in ", re.MULTILINE)
+_STATUS = re.compile(r"^(OK|FAILED)\b(.*)$", re.MULTILINE)
+_PROBLEM = re.compile(r"^(FAIL|ERROR): (\S+)(?: \(([^)]*)\))?$", re.MULTILINE)
+_EXCEPTION = re.compile(r"^[A-Za-z_][\w.]*(Error|Exception|Exit|Interrupt)\b.*$", re.MULTILINE)
+_RULE = re.compile(r"^(?:={70}|-{70})$", re.MULTILINE)
+
+
+def _exception(report):
+    """
+    The exception line of one failing test in unittest's output. `report` is
+    the output after its "FAIL:" line: a rule, the traceback, then another rule.
+    """
+    report = report.lstrip("\n")
+    traceback = _RULE.split(report, maxsplit=2)[1] if _RULE.match(report) else report
+    messages = [match.group(0) for match in _EXCEPTION.finditer(traceback)]
+    # The last one is the root cause when one exception was raised while handling another
+    message = messages[-1] if messages else (traceback.strip().splitlines() or [""])[-1]
+    return message[:message_limit] + ("..." if len(message) > message_limit else "")
+
+
+def is_test_module(relative_path):
+    name = os.path.basename(relative_path)
+    return name.endswith(".py") and (name.startswith("test") or name.endswith("_test.py"))
+
+
+def _run_module(working_directory, relative_path):
+    """Runs one test module with unittest. Returns a summary dict."""
+    started = time.perf_counter()
+    try:
+        completed = subprocess.run(
+            ["python3", "-m", "unittest", relative_path], cwd=working_directory, stdin=subprocess.DEVNULL,
+            capture_output=True, text=True, errors="replace", timeout=run_python.run_timeout,
+        )
+    except subprocess.TimeoutExpired:
+        return {"module": relative_path, "ok": False, "tests": None, "seconds": time.perf_counter() - started,
+                "status": f"timed out after {run_python.run_timeout} seconds", "problems": []}
+    output = completed.stdout + completed.stderr
+    ran = _RAN.search(output)
+    status = _STATUS.search(output)
+    problems = []
+    for match in _PROBLEM.finditer(output):
+        name, test_id = match.group(2), match.group(3)
+        if test_id and not test_id.endswith(name): # Before Python 3.11: "test_x (module.Class)"
+            test_id = f"{test_id}.{name}"
+        problems.append(f"{match.group(1)}: {test_id or name}: {_exception(output[match.end():])}")
+    ok = completed.returncode == 0
+    if ran is None and not ok:
+        # The module did not even load; the last lines say why
+        tail = [line for line in output.splitlines() if line.strip()][-1:] or [f"exit code {completed.returncode}"]
+        problems.append(f"ERROR: {tail[0].strip()[:message_limit]}")
+    return {
+        "module": relative_path,
+        "ok": ok,
+        "tests": int(ran.group(1)) if ran else None,
+        "seconds": time.perf_counter() - started,
+        "status": (status.group(1) + status.group(2)).strip() if status else f"exit code {completed.returncode}",
+        "problems": problems,
+    }
+
+
+def run_affected_tests(working_directory, changed_files=None, max_workers=4) -> str:
+    if not os.path.isabs(working_directory):
+        potential_path = os.path.join(os.getcwd(), working_directory)
+        if not os.path.isdir(potential_path):
+            return f'Error: "{working_directory}" is not a valid subdirectory of the current directory'
+        working_directory = potential_path
+
+    graph = get_graph(working_directory)
+    written = graph.take_changed()
+    if changed_files is None:
+        changed_files = written
+        if not changed_files:
+            return 'No files were written since the last run. Pass changed_files to say which files changed.'
+    if isinstance(changed_files, str):
+        changed_files = [changed_files]
+
+    changed = []
+    for file_path in changed_files:
+        relative = os.path.relpath(os.path.realpath(os.path.join(graph.root, file_path)), graph.root)
+        if relative.startswith(".."):
+            return f'Error: Cannot test "{file_path}" as it is outside the permitted working directory'
+        changed.append(relative)
+
+    try:
+        max_workers = max(1, int(max_workers))
+    except (TypeError, ValueError):
+        return 'Error: max_workers must be an integer'
+
+    graph.refresh()
+    modules = sorted(path for path in graph.dependants(changed) if is_test_module(path))
+    header = f"Changed: {', '.join(changed)}"
+    if not modules:
+        return header + "\nNo test module depends on these files."
+
+    started = time.perf_counter()
+    # Each module runs in its own interpreter; the threads only wait for them
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(modules))) as executor:
+        results = list(executor.map(lambda module: _run_module(graph.root, module), modules))
+    elapsed = time.perf_counter() - started
+
+    failed = [result for result in results if not result["ok"]]
+    tests = sum(result["tests"] or 0 for result in results)
+    lines = [
+        header,
+        f"Ran {len(results)} affected test module(s), {tests} tests, in {elapsed:.2f}s: "
+        f"{len(results) - len(failed)} passed, {len(failed)} failed",
+    ]
+    for result in results:
+        count = f"{result['tests']} tests" if result["tests"] is not None else "no tests run"
+        lines.append(f"{'PASS' if result['ok'] else 'FAIL'} {result['module']} ({count}, {result['seconds']:.2f}s)"
+                     + ("" if result["ok"] else f": {result['status']}"))
+        lines.extend(f"  {problem}" for problem in result["problems"])
+    skipped = len([path for path in graph.files() if is_test_module(path)]) - len(results)
+    if skipped:
+        lines.append(f"{skipped} other test module(s) do not depend on the changed files and were not run.")
+    return "\n".join(lines)
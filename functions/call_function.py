@@ -6,8 +6,25 @@ from .get_file_content import get_file_content
 from .get_files_info import get_files_info
 from .run_python import run_python_file
 from .write_file import write_file
+from .search_code import search_code
+from .symbol_index import find_symbol, list_symbols
+from .edit_file import edit_file, apply_patch
+from .affected_tests import run_affected_tests
+from . import prefetch
 
-def call_function(function_call_part, verbose=False):
+# Define the working directory for security and context
+# This directory is NOT controlled by the LLM
+# Assuming your project's main.py is at the root and 'calculator' is a subdirectory
+# If main.py is run from the root, then use './calculator', test
+WORKING_DIRECTORY = os.path.abspath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "calculator")
+)
+
+# Key a model client puts in a call's args, with the raw text as its value,
+# when the arguments it received were not valid JSON (see agent/openai_client.py)
+MALFORMED_ARGUMENTS = "$malformed_arguments"
+
+def call_function(function_call_part, verbose=False, working_directory=None):
     """
     Handles the execution of a function based on an LLM's function call suggestion.
 
@@ -15,6 +32,7 @@ def call_function(function_call_part, verbose=False):
         function_call_part: A types.FunctionCall object containing the
                             name of the function and its arguments.
         verbose: If True, prints detailed information about the function call and its result.
+        working_directory: Overrides WORKING_DIRECTORY (used by the benchmarks).
 
     Returns:
         A types.Content object with the result of the function call,
@@ -29,13 +47,23 @@ def call_function(function_call_part, verbose=False):
     else:
         print(f" - Calling function: {function_name}")
 
-    # Define the working directory for security and context
-    # This directory is NOT controlled by the LLM
-    # Assuming your project's main.py is at the root and 'calculator' is a subdirectory
-    # If main.py is run from the root, then use './calculator', test
-    working_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "calculator")
-    working_directory = os.path.abspath(working_directory) # Resolve to an absolute path
+    if function_args and MALFORMED_ARGUMENTS in function_args:
+        # Running the tool would fail on the unknown argument; let the model retry instead
+        raw = str(function_args[MALFORMED_ARGUMENTS])
+        return types.Content(
+            role="tool",
+            parts=[
+                types.Part.from_function_response(
+                    name=function_name,
+                    response={"error": f"The arguments for {function_name} were not valid JSON: {raw[:200]!r}. "
+                                       f"Call it again with its arguments as one JSON object."},
+                )
+            ],
+        )
 
+    # The working directory is fixed for security and context (see WORKING_DIRECTORY)
+    if working_directory is None:
+        working_directory = WORKING_DIRECTORY
 
     # Manually add the working_directory to the arguments for the actual function call
     # The LLM doesn't see or provide this argument.
@@ -43,16 +71,37 @@ def call_function(function_call_part, verbose=False):
     args_for_function_call = dict(function_args)
     args_for_function_call['working_directory'] = working_directory
 
+    # Speculative reads, when turned on (see functions/prefetch.py)
+    prefetcher = prefetch.prefetcher
+
     function_result = None
     # Based on the function name, call the corresponding Python function
     if function_name == "get_file_content":
+        if prefetcher is not None:
+            prefetcher.claim(working_directory, function_args.get("file_path"))
         function_result = get_file_content(**args_for_function_call)
+        if prefetcher is not None and not function_result.startswith("Error"):
+            prefetcher.after_read(working_directory, function_args.get("file_path"))
     elif function_name == "get_files_info":
         function_result = get_files_info(**args_for_function_call)
+        if prefetcher is not None and not function_result.startswith("Error"):
+            prefetcher.after_listing(working_directory, function_args.get("directory"), function_result)
     elif function_name == "run_python_file":
-        function_result = run_python_file(**args_for_function_call)
+        function_result = run_python_file(**args_for_function_call, verbose=verbose)
     elif function_name == "write_file":
         function_result = write_file(**args_for_function_call)
+    elif function_name == "edit_file":
+        function_result = edit_file(**args_for_function_call)
+    elif function_name == "apply_patch":
+        function_result = apply_patch(**args_for_function_call)
+    elif function_name == "run_affected_tests":
+        function_result = run_affected_tests(**args_for_function_call)
+    elif function_name == "search_code":
+        function_result = search_code(**args_for_function_call)
+    elif function_name == "find_symbol":
+        function_result = find_symbol(**args_for_function_call)
+    elif function_name == "list_symbols":
+        function_result = list_symbols(**args_for_function_call)
     else:
         # If the function name is not recognized, return an error
         return types.Content(
@@ -0,0 +1,188 @@
+import os
+import contextvars
+import json
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from .call_function import call_function, WORKING_DIRECTORY
+from .edit_file import patch_paths
+from .file_cache import read_cache
+from .import_graph import get_graph
+
+# Marker for "could touch any path in the working directory"
+ANY_PATH = "*"
+
+
+def _resolve(working_directory, path):
+    if path is None:
+        return working_directory
+    return os.path.normpath(os.path.join(working_directory, path))
+
+
+# For each tool: which paths it reads and which paths it writes, given the
+# working directory and its arguments.
+# Listings and scripts can look at anything, so they read ANY_PATH.
+# Tools missing from this table are treated as reading and writing everything,
+# which makes them run strictly in order.
+TOOL_ACCESS = {
+    "get_file_content": lambda wd, args: ({_resolve(wd, args.get("file_path"))}, set()),
+    "get_files_info": lambda wd, args: ({ANY_PATH}, set()),
+    "run_python_file": lambda wd, args: ({ANY_PATH}, set()),
+    "run_affected_tests": lambda wd, args: ({ANY_PATH}, set()),
+    "write_file": lambda wd, args: (set(), {_resolve(wd, args.get("file_path"))}),
+    "edit_file": lambda wd, args: (set(), {_resolve(wd, args.get("file_path"))}),
+    # A patch that cannot be parsed touches nothing: it fails without writing
+    "apply_patch": lambda wd, args: (set(), patch_paths(wd, args.get("patch"))),
+    "search_code": lambda wd, args: ({ANY_PATH}, set()),
+    "find_symbol": lambda wd, args: ({ANY_PATH}, set()),
+    "list_symbols": lambda wd, args: ({ANY_PATH}, set()),
+}
+
+
+def _access(working_directory, function_call_part):
+    access = TOOL_ACCESS.get(function_call_part.name)
+    if access is None:
+        return {ANY_PATH}, {ANY_PATH}
+    return access(working_directory, dict(function_call_part.args or {}))
+
+
+def source_files(working_directory, function_call_part):
+    """
+    The files a call's result was computed from, as far as that is known: the
+    file a tool read, or a script and the local modules it imports. Empty for
+    calls that can look at anything (listings, searches).
+    """
+    args = dict(function_call_part.args or {})
+    if function_call_part.name == "run_python_file" and args.get("file_path"):
+        graph = get_graph(working_directory)
+        graph.refresh()
+        script = os.path.relpath(_resolve(working_directory, args["file_path"]), graph.root)
+        return [os.path.join(graph.root, path) for path in sorted(graph.dependencies([script]))]
+    if function_call_part.name in ("get_file_content", "list_symbols") and args.get("file_path"):
+        return [_resolve(working_directory, args["file_path"])]
+    return []
+
+
+def _overlaps(a, b):
+    if not a or not b:
+        return False
+    return ANY_PATH in a or ANY_PATH in b or not a.isdisjoint(b)
+
+
+def _conflicts(earlier, later):
+    earlier_reads, earlier_writes = earlier
+    later_reads, later_writes = later
+    return (
+        _overlaps(earlier_writes, later_reads)
+        or _overlaps(earlier_writes, later_writes)
+        or _overlaps(earlier_reads, later_writes)
+    )
+
+
+class ToolDispatcher:
+    """
+    Runs the function calls the LLM suggests on a bounded pool of worker threads.
+
+    Calls are submitted in the order they appear in the response. A call only
+    waits for earlier calls it conflicts with (e.g. two writes to the same path,
+    or a read of a path that an earlier call writes), so independent calls run
+    side by side and a turn takes about as long as its slowest call.
+
+    Args:
+        max_workers: How many calls may run at once. 1 keeps the original
+                     behaviour of running each call inline, one after another.
+        verbose: Passed through to call_function.
+        working_directory: Passed through to call_function (default: WORKING_DIRECTORY).
+        tracer: Optional agent.tracing.Tracer that gets a span for every call.
+        after_call: Optional callable(function_call) run right after each call
+                    returns, before any later call that conflicts with it can
+                    start (a saved session records the state of the files the
+                    result came from with it).
+
+    The time spent in each tool is kept in `tool_stats`: {name: {"calls": n, "seconds": t}}.
+    """
+
+    def __init__(self, max_workers=1, verbose=False, working_directory=None, tracer=None, after_call=None):
+        self.max_workers = max(1, max_workers)
+        self.verbose = verbose
+        self.tracer = tracer
+        self.after_call = after_call
+        self.working_directory = working_directory or WORKING_DIRECTORY
+        self.tool_stats = defaultdict(lambda: {"calls": 0, "seconds": 0.0})
+        self._stats_lock = threading.Lock()
+        self._executor = None
+        if self.max_workers > 1:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="tool"
+            )
+        # (future, (reads, writes)) for every call that may still be running
+        self._in_flight = []
+
+    def submit(self, function_call_part):
+        """Starts a function call and returns a Future for its types.Content result."""
+        if self._executor is None:
+            future = Future()
+            try:
+                future.set_result(self._call(function_call_part))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        access = _access(self.working_directory, function_call_part)
+        self._in_flight = [entry for entry in self._in_flight if not entry[0].done()]
+        depends_on = [f for f, earlier in self._in_flight if _conflicts(earlier, access)]
+
+        # Dependencies were always submitted earlier, and the pool starts work in
+        # submission order, so waiting on them inside a worker cannot deadlock.
+        # The call runs in the caller's context (e.g. so the daemon can route what it prints)
+        future = self._executor.submit(contextvars.copy_context().run, self._run, function_call_part, depends_on)
+        self._in_flight.append((future, access))
+        return future
+
+    def _run(self, function_call_part, depends_on):
+        wait(depends_on)
+        return self._call(function_call_part)
+
+    def _call(self, function_call_part):
+        started = time.perf_counter()
+        try:
+            if self.tracer is not None:
+                result = self._traced_call(function_call_part)
+            else:
+                result = call_function(
+                    function_call_part, verbose=self.verbose, working_directory=self.working_directory
+                )
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._stats_lock:
+                stats = self.tool_stats[function_call_part.name]
+                stats["calls"] += 1
+                stats["seconds"] += elapsed
+        if self.after_call is not None:
+            self.after_call(function_call_part)
+        return result
+
+    def _traced_call(self, function_call_part):
+        args = dict(function_call_part.args or {})
+        with self.tracer.span("tool", function_call_part.name,
+                              args_bytes=len(json.dumps(args, default=str))) as span:
+            # The read cache counters are global: with concurrent calls these deltas are approximate
+            cache_before = read_cache.stats()
+            result = call_function(
+                function_call_part, verbose=self.verbose, working_directory=self.working_directory
+            )
+            cache_after = read_cache.stats()
+            span["cache_hits"] = cache_after["hits"] - cache_before["hits"]
+            span["cache_misses"] = cache_after["misses"] - cache_before["misses"]
+            response = result.parts[0].function_response.response or {}
+            span["result_bytes"] = sum(len(str(value)) for value in response.values())
+            if "error" in response:
+                span["error"] = str(response["error"])[:200]
+            return result
+
+    def shutdown(self, wait=True):
+        """Stops the pool. With wait=False, calls that have not started are cancelled and running ones are left to finish."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=not wait)
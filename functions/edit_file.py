@@ -0,0 +1,304 @@
+import os
+import re
+import difflib
+
+from .file_cache import notify_file_written
+from .write_file import write_atomically
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+class EditError(Exception):
+    """An edit that cannot be applied; the message is returned to the model."""
+
+
+def _resolve_path(working_directory, file_path):
+    """Returns the absolute path of file_path, or raises EditError if it is outside the working directory."""
+    if not file_path:
+        raise EditError('Error: file_path must not be empty')
+    path = file_path if os.path.isabs(file_path) else os.path.join(working_directory, file_path)
+    try:
+        common_path = os.path.commonpath([os.path.abspath(path), os.path.abspath(working_directory)])
+    except ValueError:
+        raise EditError(f'Error: Invalid path comparison between "{file_path}" and "{working_directory}"')
+    if os.path.abspath(common_path) != os.path.abspath(working_directory):
+        raise EditError(f'Error: Cannot edit "{file_path}" as it is outside the permitted working directory')
+    return path
+
+
+def _read(path, file_path):
+    try:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            return f.read()
+    except FileNotFoundError:
+        raise EditError(f'Error: File not found: "{file_path}"')
+    except (OSError, UnicodeDecodeError) as e:
+        raise EditError(f'Error: Cannot read "{file_path}": {e}')
+
+
+def _split_lines(text):
+    """
+    Splits text into lines on "\n" only, dropping one "\r" before it (CRLF).
+    Unlike str.splitlines, form feeds and other Unicode line breaks stay part
+    of their line, so rejoining the lines gives back the same text.
+    """
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return [line[:-1] if line.endswith("\r") else line for line in lines]
+
+
+def _line_range(start, end):
+    # 0-based half-open range -> "line 5" / "lines 5-9"
+    return f"line {start + 1}" if end - start == 1 else f"lines {start + 1}-{end}"
+
+
+def describe_changes(old_text, new_text):
+    """Summarizes which lines changed, e.g. 'lines 10-14 (was lines 10-12), removed line 40'."""
+    old_lines = _split_lines(old_text)
+    new_lines = _split_lines(new_text)
+    changes = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        if j2 == j1:
+            changes.append(f"removed {_line_range(i1, i2)}")
+        elif i2 == i1:
+            changes.append(f"added {_line_range(j1, j2)}")
+        else:
+            changes.append(f"{_line_range(j1, j2)} (was {_line_range(i1, i2)})")
+    if len(changes) > 20:
+        changes = changes[:20] + [f"... {len(changes) - 20} more"]
+    return ", ".join(changes) if changes else "no changes", len(new_lines)
+
+
+def _apply_edits(text, edits, file_path):
+    for number, edit in enumerate(edits, start=1):
+        search = edit.get("search")
+        replace = edit.get("replace", "")
+        if not search:
+            raise EditError(f'Error: Edit {number} for "{file_path}" has an empty search text')
+        count = text.count(search)
+        if count == 0 and "\r\n" in text and "\r\n" not in search:
+            # The model writes "\n"; match the file's own line endings
+            search = search.replace("\n", "\r\n")
+            replace = replace.replace("\n", "\r\n")
+            count = text.count(search)
+        if count == 0:
+            raise EditError(f'Error: Edit {number}: search text not found in "{file_path}". '
+                            'Read the file again and copy the text exactly, including indentation.')
+        if count > 1:
+            raise EditError(f'Error: Edit {number}: search text occurs {count} times in "{file_path}". '
+                            'Include more surrounding lines so it matches exactly once.')
+        text = text.replace(search, replace, 1)
+    return text
+
+
+def edit_file(working_directory, file_path, edits) -> str:
+    """
+    Applies search/replace edits to a file, in order, and writes it atomically.
+
+    Every edit must match exactly once in the file as it is after the previous
+    edits. Nothing is written unless all of them apply.
+    """
+    if not os.path.isabs(working_directory):
+        potential_path = os.path.join(os.getcwd(), working_directory)
+        if not os.path.isdir(potential_path):
+            return f'Error: "{working_directory}" is not a valid subdirectory of the current directory'
+        working_directory = potential_path
+    if not edits:
+        return 'Error: edits must contain at least one {"search", "replace"} block'
+
+    try:
+        path = _resolve_path(working_directory, file_path)
+        old_text = _read(path, file_path)
+        new_text = _apply_edits(old_text, [dict(edit) for edit in edits], file_path)
+    except EditError as e:
+        return str(e)
+
+    try:
+        write_atomically(path, new_text)
+    except OSError as e:
+        return f'Error: Cannot write to "{file_path}": {e}'
+    finally:
+        notify_file_written(path)
+    changes, line_count = describe_changes(old_text, new_text)
+    return f'Successfully edited "{file_path}": {changes}. The file now has {line_count} lines.'
+
+
+# --- Unified diffs ---
+
+def _strip_prefix(path):
+    path = path.split("\t")[0].strip()
+    if path == "/dev/null":
+        return None
+    if path.startswith(("a/", "b/")):
+        return path[2:]
+    return path
+
+
+def parse_patch(patch):
+    """
+    Splits a unified diff into [(old path, new path, [hunk])], where each hunk is
+    (old start line, [(kind, text)]) and kind is " ", "-" or "+". Paths are None
+    for /dev/null. Hunk line counts are not trusted: a hunk runs until the next
+    header, since hand-written diffs often get them wrong.
+    """
+    files = []
+    lines = _split_lines(patch)
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith("--- ") and i + 1 < len(lines) and lines[i + 1].startswith("+++ "):
+            files.append((_strip_prefix(line[4:]), _strip_prefix(lines[i + 1][4:]), []))
+            i += 2
+            continue
+        match = HUNK_HEADER.match(line)
+        if match:
+            if not files:
+                raise EditError("Error: The patch has a hunk before any ---/+++ file header")
+            body = []
+            i += 1
+            while i < len(lines):
+                line = lines[i]
+                if HUNK_HEADER.match(line) or line.startswith("diff ") or (
+                        line.startswith("--- ") and i + 1 < len(lines) and lines[i + 1].startswith("+++ ")):
+                    break
+                if line.startswith("\\"):
+                    # "\ No newline at end of file" applies to the line before it
+                    if body:
+                        body[-1] = (body[-1][0], body[-1][1], True)
+                elif line[:1] in (" ", "-", "+"):
+                    body.append((line[0], line[1:], False))
+                elif line == "":
+                    body.append((" ", "", False))
+                else:
+                    break
+                i += 1
+            files[-1][2].append((int(match.group(1)), body))
+            continue
+        i += 1
+    if not files:
+        raise EditError("Error: No ---/+++ file headers found; the patch must be a unified diff")
+    return files
+
+
+def patch_paths(working_directory, patch):
+    """The absolute paths a patch touches (empty if it cannot be parsed), for the dispatcher."""
+    try:
+        files = parse_patch(patch or "")
+    except EditError:
+        return set()
+    return {os.path.normpath(os.path.join(working_directory, path))
+            for old_path, new_path, _ in files for path in (old_path, new_path) if path}
+
+
+def _find(lines, wanted, expected, start):
+    """Index at or after `start` where `wanted` appears in `lines`, nearest to `expected` first."""
+    if not wanted:
+        return min(max(expected, start), len(lines))
+    for strip in (lambda s: s, lambda s: s.rstrip()):
+        target = [strip(line) for line in wanted]
+        candidates = range(start, len(lines) - len(wanted) + 1)
+        for index in sorted(candidates, key=lambda index: abs(index - expected)):
+            if all(strip(lines[index + k]) == target[k] for k in range(len(wanted))):
+                return index
+    return None
+
+
+def _apply_hunks(text, hunks, file_path):
+    newline = "\r\n" if "\r\n" in text else "\n"
+    lines = _split_lines(text)
+    ends_with_newline = text.endswith("\n")
+    offset = 0 # How far the hunks applied so far moved the following lines
+    start = 0
+    for number, (old_start, body) in enumerate(hunks, start=1):
+        before = [line for kind, line, _ in body if kind != "+"]
+        after = [line for kind, line, _ in body if kind != "-"]
+        expected = max(0, old_start - 1) + offset
+        if not before and old_start == 0:
+            expected = 0
+        index = _find(lines, before, expected, start)
+        if index is None:
+            first = next((line for line in before if line.strip()), before[0])
+            raise EditError(f'Error: Hunk {number} does not apply to "{file_path}": its lines starting with '
+                            f'{first!r} were not found. Read the file again and regenerate the diff.')
+        lines[index:index + len(before)] = after
+        offset += len(after) - len(before)
+        start = index + len(after)
+        if start == len(lines) and after:
+            # The hunk ends the file: its last line has a newline unless marked otherwise
+            last_new_line = [entry for entry in body if entry[0] != "-"][-1]
+            ends_with_newline = not last_new_line[2]
+    new_text = newline.join(lines)
+    if lines and ends_with_newline:
+        new_text += newline
+    return new_text
+
+
+def apply_patch(working_directory, patch) -> str:
+    """
+    Applies a unified diff, which may touch several files, and writes each file atomically.
+
+    Hunks are located by their context and removed lines, starting from the
+    line numbers in the hunk header, so small offsets are tolerated. Every file
+    is patched in memory first; nothing is written unless all hunks apply.
+    """
+    if not os.path.isabs(working_directory):
+        potential_path = os.path.join(os.getcwd(), working_directory)
+        if not os.path.isdir(potential_path):
+            return f'Error: "{working_directory}" is not a valid subdirectory of the current directory'
+        working_directory = potential_path
+    if not patch or not patch.strip():
+        return 'Error: patch must not be empty'
+
+    # path -> (file_path, old_text, new_text, created); new_text None deletes the file.
+    # A file with several sections in the patch gets each one applied to the text the previous ones planned.
+    planned = {}
+    try:
+        for old_path, new_path, hunks in parse_patch(patch):
+            file_path = new_path or old_path
+            if file_path is None:
+                raise EditError("Error: A file in the patch has /dev/null as both its old and new path")
+            path = _resolve_path(working_directory, file_path)
+            exists = planned[path][2] is not None if path in planned else os.path.exists(path)
+            if old_path is None:
+                if exists:
+                    raise EditError(f'Error: Cannot create "{file_path}": it already exists')
+                text = ""
+            elif path in planned:
+                if not exists:
+                    raise EditError(f'Error: Cannot patch "{file_path}": an earlier part of the patch deletes it')
+                text = planned[path][2]
+            else:
+                text = _read(path, file_path)
+            new_text = None if new_path is None else _apply_hunks(text, hunks, file_path)
+            if path in planned:
+                first_file_path, old_text, _, created = planned[path]
+                planned[path] = (first_file_path, old_text, new_text, created)
+            else:
+                planned[path] = (file_path, text, new_text, old_path is None)
+    except EditError as e:
+        return str(e)
+
+    output = []
+    for path, (file_path, old_text, new_text, created) in planned.items():
+        try:
+            if new_text is None:
+                os.remove(path)
+                output.append(f'Deleted "{file_path}"')
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_atomically(path, new_text)
+        except OSError as e:
+            output.append(f'Error: Cannot write to "{file_path}": {e}')
+            continue
+        finally:
+            notify_file_written(path)
+        changes, line_count = describe_changes(old_text, new_text)
+        if created:
+            output.append(f'Created "{file_path}" ({line_count} lines)')
+        else:
+            output.append(f'Patched "{file_path}": {changes}. The file now has {line_count} lines.')
+    return "\n".join(output)
@@ -0,0 +1,103 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class FileReadCache:
+    """
+    Process-wide LRU cache of file contents read by the tools.
+
+    Entries are keyed by the resolved path and remember the file's
+    (mtime, size, inode) at the time it was read. A lookup re-stats the file
+    and only returns the cached text if none of those changed, so edits made
+    outside the tools are still picked up. write_file also invalidates the
+    entry for the path it writes.
+
+    Args:
+        max_bytes: Upper bound on the total size of all cached files.
+                   Least recently used entries are evicted to stay under it.
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # path -> (signature, size, content)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def signature(stat_result):
+        return (stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino)
+
+    def get(self, path, stat_result):
+        """Returns the cached content of `path` if it still matches `stat_result`, else None."""
+        path = os.path.realpath(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == self.signature(stat_result):
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[2]
+            if entry is not None:
+                self._remove(path)
+            self.misses += 1
+            return None
+
+    def contains(self, path, stat_result):
+        """Like get, but only says whether there is a matching entry, without counting a hit or miss."""
+        path = os.path.realpath(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            return entry is not None and entry[0] == self.signature(stat_result)
+
+    def put(self, path, stat_result, content):
+        size = stat_result.st_size
+        if size > self.max_bytes:
+            return
+        path = os.path.realpath(path)
+        with self._lock:
+            if path in self._entries:
+                self._remove(path)
+            self._entries[path] = (self.signature(stat_result), size, content)
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, path):
+        path = os.path.realpath(path)
+        with self._lock:
+            if path in self._entries:
+                self._remove(path)
+
+    def _remove(self, path):
+        _, size, _ = self._entries.pop(path)
+        self._total_bytes -= size
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+            }
+
+
+# Shared by get_file_content and write_file.
+read_cache = FileReadCache()
+
+# Callbacks run with the path of every file a tool writes, so anything that
+# caches or indexes file contents can drop or refresh its entry.
+_write_listeners = []
+
+
+def add_write_listener(callback):
+    _write_listeners.append(callback)
+
+
+def notify_file_written(path):
+    """Called by the tools after they write `path`."""
+    read_cache.invalidate(path)
+    for callback in _write_listeners:
+        callback(os.path.realpath(path))
@@ -1,6 +1,21 @@
 import os
+import mmap
 
-def get_file_content(working_directory, file_path) -> str:
+from .file_cache import read_cache
+
+read_char_limit = 10000
+
+# Files up to this size are read whole (and cached); larger ones are only ever
+# read through mmap, so memory use does not depend on the file size.
+whole_read_limit = 1024 * 1024
+
+# (path, size, mtime) -> total line count of large files, so paging through a
+# big log does not rescan it on every call.
+_line_counts = {}
+
+
+def get_file_content(working_directory, file_path, start_line=None, line_count=None, tail_lines=None,
+                     byte_offset=None, byte_count=None) -> str:
     # Resolve working_directory if it's not absolute
     if not os.path.isabs(working_directory):
         cwd = os.getcwd()
@@ -29,13 +44,171 @@ def get_file_content(working_directory, file_path) -> str:
     if os.path.abspath(common_path) != os.path.abspath(working_directory):
         return f'Error: Cannot read "{file_path}" as it is outside the permitted working directory'
     
-    read_char_limit = 10000
     try:
-        with open(file_path, 'r') as file:
-            content = file.read()
-            if len(content) > read_char_limit:
-                return content[:read_char_limit] + f'[...File "{file_path}" truncated at 10000 characters]'
-            else:
+        start_line = int(start_line) if start_line is not None else None
+        line_count = int(line_count) if line_count is not None else None
+        tail_lines = int(tail_lines) if tail_lines is not None else None
+        byte_offset = int(byte_offset) if byte_offset is not None else None
+        byte_count = int(byte_count) if byte_count is not None else None
+    except (TypeError, ValueError):
+        return 'Error: start_line, line_count, tail_lines, byte_offset and byte_count must be integers'
+    ranged = any(value is not None for value in (start_line, line_count, tail_lines, byte_offset, byte_count))
+
+    try:
+        stat_result = os.stat(file_path)
+        if stat_result.st_size <= whole_read_limit:
+            # Serve repeated reads of an unchanged file from memory
+            content = read_cache.get(file_path, stat_result)
+            if content is None:
+                with open(file_path, 'r') as file:
+                    content = file.read()
+                    read_cache.put(file_path, os.fstat(file.fileno()), content)
+
+            if not ranged:
+                if len(content) > read_char_limit:
+                    return content[:read_char_limit] + (
+                        f'[...File "{file_path}" truncated at {read_char_limit} characters. '
+                        f'It has {_count_lines(content)} lines ({stat_result.st_size} bytes); '
+                        f'pass start_line/line_count, tail_lines or byte_offset/byte_count to read the rest]'
+                    )
                 return content
+            return _read_range_small(file_path, content, stat_result.st_size, start_line, line_count,
+                                     tail_lines, byte_offset, byte_count)
+
+        return _read_range_large(file_path, stat_result, start_line, line_count, tail_lines, byte_offset, byte_count)
     except Exception as e:
-        return f'Error: File not found or is not a regular file: "{file_path}"'
\ No newline at end of file
+        return f'Error: File not found or is not a regular file: "{file_path}"'
+
+
+def _count_lines(text):
+    return text.count("\n") + (1 if text and not text.endswith("\n") else 0)
+
+
+def _limit(text):
+    """Caps a slice at read_char_limit characters. Returns (text, was_cut)."""
+    if len(text) > read_char_limit:
+        return text[:read_char_limit], True
+    return text, False
+
+
+def _footer(file_path, shown, total_lines, total_bytes, cut):
+    note = f' (cut at {read_char_limit} characters; request a smaller range)' if cut else ''
+    return f'\n[Showing {shown}{note} of "{file_path}", which has {total_lines} lines and {total_bytes} bytes]'
+
+
+def _read_range_small(file_path, content, total_bytes, start_line, line_count, tail_lines, byte_offset, byte_count):
+    """Serves a line or byte range from the text of a file that was read whole."""
+    if byte_offset is not None or byte_count is not None:
+        data = content.encode('utf-8')
+        start = min(max(0, byte_offset or 0), len(data))
+        end = len(data) if byte_count is None else min(len(data), start + max(0, byte_count))
+        text, cut = _limit(data[start:end].decode('utf-8', errors='replace'))
+        shown = f'bytes {start}-{end}'
+        return text + _footer(file_path, shown, _count_lines(content), total_bytes, cut)
+
+    lines = content.splitlines(keepends=True)
+    if tail_lines is not None:
+        first = max(0, len(lines) - max(0, tail_lines))
+    else:
+        first = max(0, (start_line or 1) - 1)
+    last = len(lines) if tail_lines is not None or line_count is None else min(len(lines), first + max(0, line_count))
+
+    # Return whole lines up to the character limit (or part of a single longer line).
+    # Head ranges keep their first lines, tail ranges their last ones.
+    chars = 0
+    taken = 0
+    order = range(last - 1, first - 1, -1) if tail_lines is not None else range(first, last)
+    for index in order:
+        if taken and chars + len(lines[index]) > read_char_limit:
+            break
+        chars += len(lines[index])
+        taken += 1
+    cut = taken < last - first
+    if tail_lines is not None:
+        first = last - taken
+    else:
+        last = first + taken
+    text, text_cut = _limit("".join(lines[first:last]))
+    shown = f'lines {first + 1}-{last}' if taken else 'no lines'
+    return text + _footer(file_path, shown, len(lines), total_bytes, cut or text_cut)
+
+
+def _total_lines(file_path, stat_result, file, mapped):
+    key = (os.path.realpath(file_path), stat_result.st_size, stat_result.st_mtime_ns)
+    total = _line_counts.get(key)
+    if total is None:
+        # Count newlines one bounded chunk at a time, reusing a single buffer
+        total = 0
+        buffer = bytearray(1024 * 1024)
+        view = memoryview(buffer)
+        file.seek(0)
+        while True:
+            read = file.readinto(buffer)
+            if not read:
+                break
+            total += buffer.count(b"\n") if read == len(buffer) else view[:read].tobytes().count(b"\n")
+        if len(mapped) and mapped[len(mapped) - 1:] != b"\n":
+            total += 1
+        if len(_line_counts) >= 256:
+            _line_counts.clear()
+        _line_counts[key] = total
+    return total
+
+
+def _read_range_large(file_path, stat_result, start_line, line_count, tail_lines, byte_offset, byte_count):
+    """Serves a line or byte range of a large file through mmap, without reading it whole."""
+    # At most this many bytes are ever decoded for one call
+    max_bytes = read_char_limit * 4
+    with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        size = len(mapped)
+        total_lines = _total_lines(file_path, stat_result, file, mapped)
+
+        if byte_offset is not None or byte_count is not None:
+            start = min(max(0, byte_offset or 0), size)
+            end = size if byte_count is None else min(size, start + max(0, byte_count))
+            text, cut = _limit(mapped[start:min(end, start + max_bytes)].decode('utf-8', errors='replace'))
+            cut = cut or end - start > max_bytes
+            return text + _footer(file_path, f'bytes {start}-{end}', total_lines, size, cut)
+
+        # Collect whole lines up to the character limit (or part of a single longer line),
+        # walking backwards from the end for tail ranges and forwards otherwise.
+        shown_lines = 0
+        cut = False
+        if tail_lines is not None:
+            wanted = max(0, tail_lines)
+            start = end = size
+            # Position of the newline that ends the line being added (a final newline does not start a line)
+            position = size - 1 if size and mapped[size - 1:] == b"\n" else size
+            while shown_lines < wanted and start > 0:
+                newline = mapped.rfind(b"\n", 0, position)
+                if shown_lines and end - (newline + 1) > read_char_limit:
+                    cut = True
+                    break
+                start = newline + 1
+                position = newline
+                shown_lines += 1
+            first_line = total_lines - shown_lines + 1
+        else:
+            # Skip forward to the requested first line, then take line_count lines
+            first_line = max(1, start_line or 1)
+            start = 0
+            for _ in range(first_line - 1):
+                start = mapped.find(b"\n", start) + 1
+                if start == 0:
+                    start = size
+                    break
+            end = start
+            while end < size and (line_count is None or shown_lines < line_count):
+                newline = mapped.find(b"\n", end, start + max_bytes)
+                line_end = newline + 1 if newline != -1 else min(size, start + max_bytes)
+                if shown_lines and line_end - start > read_char_limit:
+                    cut = True
+                    break
+                end = line_end
+                shown_lines += 1
+                if newline == -1 and end < size:
+                    break # A single line longer than max_bytes; _limit cuts it below
+
+        text, text_cut = _limit(mapped[start:min(end, start + max_bytes)].decode('utf-8', errors='replace'))
+        shown = f'lines {first_line}-{first_line + shown_lines - 1}' if shown_lines else 'no lines'
+        return text + _footer(file_path, shown, total_lines, size, cut or text_cut)
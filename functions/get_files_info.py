@@ -1,6 +1,18 @@
 import os
+import re
+import fnmatch
 
-def get_files_info(working_directory, directory=None) -> str:
+DEFAULT_PAGE_SIZE = 200
+SORT_KEYS = {
+    "name": lambda entry: entry[0],
+    "size": lambda entry: (-entry[1], entry[0]),
+    "mtime": lambda entry: (-entry[3], entry[0]),
+    "type": lambda entry: (entry[2] != "directory", entry[0]),
+}
+
+
+def get_files_info(working_directory, directory=None, recursive=False, max_depth=None, pattern=None,
+                   respect_gitignore=True, sort_by="name", cursor=None, page_size=DEFAULT_PAGE_SIZE) -> str:
     # Resolve working_directory if it's not absolute
     if not os.path.isabs(working_directory):
         cwd = os.getcwd()
@@ -29,34 +41,157 @@ def get_files_info(working_directory, directory=None) -> str:
     if os.path.abspath(common_path) != os.path.abspath(working_directory):
         return f'Error: Cannot list "{directory}" as it is outside the permitted working directory'
 
+    if sort_by not in SORT_KEYS:
+        return f'Error: sort_by must be one of {", ".join(SORT_KEYS)}, not "{sort_by}"'
+    try:
+        offset = int(cursor) if cursor not in (None, "") else 0
+        page_size = max(1, int(page_size))
+        max_depth = int(max_depth) if max_depth is not None else None
+    except (TypeError, ValueError):
+        return 'Error: cursor, page_size and max_depth must be integers'
+
+    ignore = None
+    if respect_gitignore:
+        ignore = GitIgnore(working_directory)
+
     # List contents
-    contents = get_directory_contents(directory)
-    directory_contents = ""
-    for item, size, type in contents:
-        is_dir = (type == "directory")
-        directory_contents += f"- {item}: file_size={size} bytes, is_dir={str(is_dir)}\n"
-    return directory_contents
+    contents = get_directory_contents(directory, recursive=recursive, max_depth=max_depth,
+                                      pattern=pattern, ignore=ignore)
+    contents.sort(key=SORT_KEYS[sort_by])
 
+    page = contents[offset:offset + page_size]
+    lines = [f"- {item}: file_size={size} bytes, is_dir={type == 'directory'}" for item, size, type, _ in page]
+    next_offset = offset + len(page)
+    if next_offset < len(contents):
+        lines.append(f'[Showing entries {offset + 1}-{next_offset} of {len(contents)}. '
+                     f'Call again with cursor="{next_offset}" for the next page.]')
+    elif not contents:
+        return "No matching entries."
+    return "\n".join(lines) + "\n"
 
-def get_directory_contents(directory_path):
+
+def get_directory_contents(directory_path, recursive=False, max_depth=None, pattern=None, ignore=None,
+                           skip=(), quiet=False):
     """
     Lists files and directories in a directory, along with their sizes.
 
+    Uses os.scandir, so the file type comes with the directory entry and only
+    one stat() per entry is needed for its size.
+
     Args:
         directory_path: The path to the directory.
+        recursive: Also list the contents of subdirectories.
+        max_depth: With recursive, how many levels below directory_path to descend (None: no limit).
+        pattern: Only include entries whose name (or relative path) matches this glob, e.g. "*.py".
+        ignore: A GitIgnore deciding which entries to skip, or None.
+        skip: Names of directories that are neither listed nor descended into.
+        quiet: Skip entries that cannot be read without printing an error.
 
     Returns:
-        A list of tuples: (name, size in bytes, type = 'file' or 'directory').
+        A list of tuples: (path relative to directory_path, size in bytes,
+        type = 'file' or 'directory', modification time).
     """
+    match_pattern = re.compile(fnmatch.translate(pattern)).match if pattern else None
     contents = []
-    for item in os.listdir(directory_path):
-        full_path = os.path.join(directory_path, item)
+    pending = [(directory_path, "", 0)]
+    while pending:
+        current, prefix, depth = pending.pop()
+        rules = ignore.rules_for(current) if ignore is not None else None
         try:
-            item_size = os.stat(full_path).st_size
-            if os.path.isfile(full_path):
-                contents.append((item, item_size, "file"))
-            elif os.path.isdir(full_path):
-                contents.append((item, item_size, "directory"))
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    name = entry.name
+                    relative = prefix + name
+                    try:
+                        is_dir = entry.is_dir()
+                        if not is_dir and not entry.is_file():
+                            continue
+                        if rules and GitIgnore.matches(rules, name, is_dir):
+                            continue
+                        if is_dir and name in skip:
+                            continue
+                        if match_pattern is None or match_pattern(name) or match_pattern(relative):
+                            stat_result = entry.stat()
+                            contents.append((relative, stat_result.st_size, "directory" if is_dir else "file",
+                                             stat_result.st_mtime))
+                        # Never follow symlinked directories, they can form loops
+                        if (recursive and is_dir and name != ".git" and not entry.is_symlink()
+                                and (max_depth is None or depth < max_depth)):
+                            pending.append((entry.path, relative + "/", depth + 1))
+                    except OSError as e:
+                        if not quiet:
+                            print(f"Error accessing {relative}: {e}")
         except OSError as e:
-            print(f"Error accessing {item}: {e}")
+            if not quiet:
+                print(f"Error accessing {prefix or current}: {e}")
     return contents
+
+
+class GitIgnore:
+    """
+    Decides whether a path is excluded by the .gitignore files of a directory tree.
+
+    Supports the commonly used subset of the format: globs, "!" negation,
+    trailing "/" for directories only, and patterns anchored by a "/".
+    Each .gitignore applies to the directory it is in and everything below it.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        # directory -> rules that apply to its entries, as
+        # (prefix of the entry's path relative to the rule's .gitignore, regex match, negate, dir_only, anchored)
+        self._rules = {}
+
+    def _own_rules(self, directory):
+        rules = []
+        try:
+            with open(os.path.join(directory, ".gitignore"), "r") as f:
+                for line in f:
+                    line = line.rstrip("\n").rstrip()
+                    if not line or line.startswith("#"):
+                        continue
+                    negate = line.startswith("!")
+                    if negate:
+                        line = line[1:]
+                    dir_only = line.endswith("/")
+                    line = line.rstrip("/")
+                    anchored = "/" in line
+                    match = re.compile(fnmatch.translate(line.lstrip("/"))).match
+                    rules.append(("", match, negate, dir_only, anchored))
+        except OSError:
+            pass
+        return rules
+
+    def rules_for(self, directory):
+        """Returns the rules that apply to the entries of `directory` (computed once per directory)."""
+        directory = os.path.abspath(directory)
+        rules = self._rules.get(directory)
+        if rules is not None:
+            return rules
+        if directory == self.root:
+            rules = self._own_rules(directory)
+        elif os.path.commonpath([directory, self.root]) != self.root:
+            rules = []
+        else:
+            # Inherit the parent's rules, seen from one level further down
+            name = os.path.basename(directory) + "/"
+            rules = [(prefix + name, match, negate, dir_only, anchored)
+                     for prefix, match, negate, dir_only, anchored in self.rules_for(os.path.dirname(directory))]
+            rules += self._own_rules(directory)
+        self._rules[directory] = rules
+        return rules
+
+    @staticmethod
+    def matches(rules, name, is_dir):
+        # Later (deeper, or further down the same file) rules win
+        ignored = False
+        for prefix, match, negate, dir_only, anchored in rules:
+            if dir_only and not is_dir:
+                continue
+            if match(prefix + name if anchored else name):
+                ignored = not negate
+        return ignored
+
+    def is_ignored(self, path, is_dir):
+        path = os.path.abspath(path)
+        return self.matches(self.rules_for(os.path.dirname(path)), os.path.basename(path), is_dir)
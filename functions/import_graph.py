@@ -0,0 +1,145 @@
+import ast
+import os
+import threading
+
+from .file_cache import add_write_listener
+from .get_files_info import GitIgnore, get_directory_contents
+from .symbol_index import skipped_directories
+
+
+def local_imports(tree, path, working_directory):
+    """
+    Paths of the modules in `working_directory` that the parsed module at
+    `path` imports. Absolute imports are looked up next to the module (how a
+    script finds its packages) and in the working directory.
+    """
+    directory = os.path.dirname(path)
+    found = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules = [(alias.name, []) for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            # "from pkg import module" may import a submodule rather than a name
+            modules = [(node.module or "", [alias.name for alias in node.names])]
+        else:
+            continue
+        if isinstance(node, ast.ImportFrom) and node.level:
+            bases = [directory]
+            for _ in range(node.level - 1):
+                bases = [os.path.dirname(bases[0])]
+        else:
+            bases = [directory, working_directory]
+        for module, names in modules:
+            for base in bases:
+                package = os.path.join(base, *module.split(".")) if module else base
+                candidates = [package + ".py", os.path.join(package, "__init__.py")]
+                candidates += [os.path.join(package, name + ".py") for name in names]
+                found.extend(candidate for candidate in candidates
+                             if os.path.isfile(candidate) and candidate not in found)
+    return found
+
+
+class ImportGraph:
+    """
+    Which Python files of a directory tree import which others.
+
+    A refresh stats every Python file but only re-parses the ones whose mtime
+    or size changed, so keeping the graph current costs little more than a
+    directory listing.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self._files = {} # relative path -> {"mtime", "size", "imports": [relative paths]}
+        self._lock = threading.Lock()
+
+    def take_changed(self):
+        """The files under the root the tools wrote since the last call, relative to the root."""
+        with _written_lock:
+            changed = {path for path in _written if path.startswith(self.root + os.sep)}
+            _written.difference_update(changed)
+        return sorted(os.path.relpath(path, self.root) for path in changed)
+
+    def _parse(self, relative):
+        path = os.path.join(self.root, relative)
+        try:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                tree = ast.parse(f.read())
+        except (OSError, SyntaxError, ValueError):
+            return []
+        return sorted({os.path.relpath(imported, self.root) for imported in local_imports(tree, path, self.root)})
+
+    def refresh(self):
+        with self._lock:
+            seen = set()
+            python_files = get_directory_contents(self.root, recursive=True, pattern="*.py",
+                                                  ignore=GitIgnore(self.root), skip=skipped_directories, quiet=True)
+            for relative, size, type, mtime in python_files:
+                if type != "file":
+                    continue
+                seen.add(relative)
+                entry = self._files.get(relative)
+                if entry is None or entry["mtime"] != mtime or entry["size"] != size:
+                    self._files[relative] = {"mtime": mtime, "size": size, "imports": self._parse(relative)}
+            for relative in set(self._files) - seen:
+                del self._files[relative]
+
+    def files(self):
+        with self._lock:
+            return sorted(self._files)
+
+    def dependencies(self, paths):
+        """The files that any of `paths` import directly or indirectly, plus `paths` themselves."""
+        found = set(paths)
+        pending = list(paths)
+        with self._lock:
+            while pending:
+                entry = self._files.get(pending.pop())
+                for imported in entry["imports"] if entry else ():
+                    if imported not in found:
+                        found.add(imported)
+                        pending.append(imported)
+        return found
+
+    def dependants(self, paths):
+        """The files that import any of `paths` directly or indirectly, plus `paths` themselves."""
+        with self._lock:
+            imported_by = {}
+            for relative, entry in self._files.items():
+                for imported in entry["imports"]:
+                    imported_by.setdefault(imported, set()).add(relative)
+        found = set(paths)
+        pending = list(paths)
+        while pending:
+            for dependant in imported_by.get(pending.pop(), ()):
+                if dependant not in found:
+                    found.add(dependant)
+                    pending.append(dependant)
+        return found
+
+
+# One graph per working directory, shared by every call
+_graphs = {}
+_graphs_lock = threading.Lock()
+
+# Every file the tools wrote that no take_changed() has returned yet, the
+# default "what changed" for run_affected_tests
+_written = set()
+_written_lock = threading.Lock()
+
+
+def get_graph(working_directory):
+    root = os.path.realpath(working_directory)
+    with _graphs_lock:
+        graph = _graphs.get(root)
+        if graph is None:
+            graph = _graphs[root] = ImportGraph(root)
+        return graph
+
+
+def _on_file_written(path):
+    with _written_lock:
+        _written.add(path)
+
+
+add_write_listener(_on_file_written)
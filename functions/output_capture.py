@@ -0,0 +1,61 @@
+import os
+
+# Bytes of each stream (stdout, stderr) returned to the model: the first and last half of this
+stream_cap = 16 * 1024
+# A script whose combined output goes past this is killed instead of running to the timeout
+hard_limit = 32 * 1024 * 1024
+
+
+class BoundedOutput:
+    """
+    Collects a stream of bytes while keeping only its head and tail.
+
+    The first cap/2 and the last cap/2 bytes are kept; everything in between
+    is only counted, so memory use is bounded however much a script prints.
+
+    Args:
+        cap: Bytes kept in total.
+    """
+
+    def __init__(self, cap=None):
+        self.cap = stream_cap if cap is None else cap
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def write(self, data):
+        self.total += len(data)
+        half = self.cap // 2
+        room = half - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail += data[-half:] if half else b""
+            if len(self.tail) > half:
+                del self.tail[:len(self.tail) - half]
+
+    @property
+    def dropped(self):
+        return self.total - len(self.head) - len(self.tail)
+
+    def text(self):
+        head = self.head.decode("utf-8", errors="replace")
+        tail = self.tail.decode("utf-8", errors="replace")
+        if self.dropped:
+            return f"{head}\n[... {self.dropped} bytes of output dropped ...]\n{tail}"
+        return head + tail
+
+    @classmethod
+    def from_file(cls, path, cap=None):
+        """Reads only the head and tail of a file that a script wrote its output to."""
+        output = cls(cap)
+        half = output.cap // 2
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            output.head += f.read(half)
+            if size > half:
+                f.seek(max(half, size - half))
+                output.tail += f.read(half)
+        output.total = size
+        return output
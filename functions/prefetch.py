@@ -0,0 +1,167 @@
+import ast
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .file_cache import FileReadCache, add_write_listener, read_cache
+from .import_graph import local_imports
+
+# Only files with these extensions are read ahead after a listing
+TEXT_EXTENSIONS = {".py", ".txt", ".md", ".rst", ".json", ".toml", ".cfg", ".ini", ".yaml", ".yml",
+                   ".csv", ".html", ".css", ".js", ".ts", ".sh"}
+
+# A file line of get_files_info's output
+_LISTING_LINE = re.compile(r"^- (.+): file_size=(\d+) bytes, is_dir=False$", re.MULTILINE)
+
+# Set by enable_prefetch; None means prefetching is off
+prefetcher = None
+
+
+def enable_prefetch(**options):
+    """Turns on speculative reads for call_function; `options` go to Prefetcher."""
+    global prefetcher
+    if prefetcher is None:
+        prefetcher = Prefetcher(**options)
+        add_write_listener(prefetcher.cache.invalidate)
+    return prefetcher
+
+
+class Prefetcher:
+    """
+    Reads files the model is likely to ask for next, before it asks.
+
+    A session usually lists a directory and then reads the small source files
+    it saw there, one model round trip each. After get_files_info, the small
+    text files of the listing are read on a background thread; after
+    get_file_content on a Python file, so are the local modules it imports.
+    They go into a cache of their own, so a wrong guess never pushes a file the
+    model did read out of the shared read_cache. When get_file_content is then
+    called for one of them, call_function first moves it into read_cache and
+    the read is served from memory.
+
+    Entries are checked against the file's stat like read_cache entries, so a
+    file changed after it was prefetched is read again.
+
+    Args:
+        max_bytes: Upper bound on the total size of prefetched files kept.
+        max_file_bytes: Larger files are never prefetched.
+        max_files: At most this many files are read ahead per listing or read.
+    """
+
+    def __init__(self, max_bytes=4 * 1024 * 1024, max_file_bytes=64 * 1024, max_files=32):
+        self.cache = FileReadCache(max_bytes=max_bytes)
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._queued = set()
+        # Reads of files that were not in read_cache already: served from a prefetch or not
+        self.hits = 0
+        self.misses = 0
+        self.prefetched_files = 0
+        self.prefetched_bytes = 0
+        self.used_bytes = 0
+
+    def after_listing(self, working_directory, directory, listing):
+        """Called with the result of get_files_info; reads ahead the small text files it lists."""
+        base = os.path.join(working_directory, directory or "")
+        paths = []
+        for name, size in _LISTING_LINE.findall(listing):
+            if 0 < int(size) <= self.max_file_bytes and os.path.splitext(name)[1] in TEXT_EXTENSIONS:
+                paths.append(os.path.join(base, name))
+        self._schedule(working_directory, paths[:self.max_files])
+
+    def after_read(self, working_directory, file_path):
+        """Called after get_file_content reads `file_path`; reads ahead the local modules it imports."""
+        path = _inside(working_directory, file_path)
+        if path is not None and path.endswith(".py"):
+            self._executor.submit(self._prefetch_imports, working_directory, path)
+
+    def claim(self, working_directory, file_path):
+        """
+        Called before get_file_content reads `file_path`: if it was prefetched
+        and has not changed since, hands the content to read_cache.
+        """
+        path = _inside(working_directory, file_path)
+        if path is None:
+            return
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return
+        if read_cache.contains(path, stat_result):
+            return # Read before; prefetching had nothing to add
+        content = self.cache.get(path, stat_result)
+        with self._lock:
+            if content is None:
+                self.misses += 1
+                return
+            self.hits += 1
+            self.used_bytes += stat_result.st_size
+        self.cache.invalidate(path)
+        read_cache.put(path, stat_result, content)
+
+    def stats(self):
+        with self._lock:
+            reads = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / reads, 3) if reads else 0.0,
+                "prefetched_files": self.prefetched_files,
+                "prefetched_bytes": self.prefetched_bytes,
+                # Read ahead but (so far) never asked for
+                "wasted_bytes": self.prefetched_bytes - self.used_bytes,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _schedule(self, working_directory, paths):
+        for path in paths:
+            path = _inside(working_directory, path)
+            if path is None:
+                continue
+            with self._lock:
+                if path in self._queued:
+                    continue
+                self._queued.add(path)
+            self._executor.submit(self._prefetch, path)
+
+    def _prefetch(self, path):
+        with self._lock:
+            self._queued.discard(path)
+        try:
+            stat_result = os.stat(path)
+            if (stat_result.st_size > self.max_file_bytes or read_cache.contains(path, stat_result)
+                    or self.cache.contains(path, stat_result)):
+                return
+            with open(path, 'r') as file:
+                content = file.read()
+                stat_result = os.fstat(file.fileno())
+        except (OSError, UnicodeDecodeError):
+            return
+        self.cache.put(path, stat_result, content)
+        with self._lock:
+            self.prefetched_files += 1
+            self.prefetched_bytes += stat_result.st_size
+
+    def _prefetch_imports(self, working_directory, path):
+        try:
+            with open(path, 'r') as file:
+                tree = ast.parse(file.read())
+        except (OSError, SyntaxError, UnicodeDecodeError, ValueError):
+            return
+        self._schedule(working_directory, local_imports(tree, path, working_directory)[:self.max_files])
+
+
+def _inside(working_directory, file_path):
+    """The real path of `file_path` if it is inside `working_directory`, else None."""
+    if not file_path:
+        return None
+    root = os.path.realpath(working_directory)
+    path = os.path.realpath(os.path.join(root, file_path))
+    if os.path.commonpath([path, root]) != root:
+        return None
+    return path
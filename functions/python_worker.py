@@ -0,0 +1,92 @@
+# python_worker.py
+"""
+A pre-started Python interpreter that runs scripts on request, for PythonWorkerPool.
+
+Started as: python3 python_worker.py <request fd> <response fd> <max runs> [module to preload ...]
+
+Each request is one JSON line: {"file": ..., "cwd": ..., "stdout": ..., "stderr": ...}.
+The script runs as __main__ in a fresh namespace with fds 1 and 2 redirected to
+the given files, and the reply is one JSON line: {"exit_code": ...}.
+The worker exits after <max runs> requests.
+"""
+import json
+import os
+import runpy
+import sys
+import traceback
+
+
+def _exit_code(exit):
+    # Same rules as the interpreter uses for SystemExit
+    if exit.code is None:
+        return 0
+    if isinstance(exit.code, int):
+        return exit.code
+    print(exit.code, file=sys.stderr)
+    return 1
+
+
+def run_script(request, base_path, base_modules):
+    file_path = request["file"]
+    stdout_fd = os.open(request["stdout"], os.O_WRONLY | os.O_TRUNC)
+    stderr_fd = os.open(request["stderr"], os.O_WRONLY | os.O_TRUNC)
+    saved_stdout, saved_stderr = os.dup(1), os.dup(2)
+    os.dup2(stdout_fd, 1)
+    os.dup2(stderr_fd, 2)
+    os.close(stdout_fd)
+    os.close(stderr_fd)
+
+    # Set things up the way "python3 file_path" would
+    os.chdir(request["cwd"])
+    sys.argv = [file_path]
+    sys.path[:] = [os.path.dirname(file_path)] + base_path[1:]
+    try:
+        runpy.run_path(file_path, run_name="__main__")
+        exit_code = 0
+    except SystemExit as exit:
+        exit_code = _exit_code(exit)
+    except BaseException as error:
+        # Hide the runpy frames, like a traceback from "python3 file_path"
+        tb = error.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != file_path:
+            tb = tb.tb_next
+        traceback.print_exception(type(error), error, tb)
+        exit_code = 1
+    finally:
+        sys.stdout = sys.__stdout__
+        sys.stderr = sys.__stderr__
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved_stdout, 1)
+        os.dup2(saved_stderr, 2)
+        os.close(saved_stdout)
+        os.close(saved_stderr)
+
+    # Forget everything the script imported, so the next run sees fresh code
+    for name in set(sys.modules) - base_modules:
+        del sys.modules[name]
+    sys.path[:] = base_path
+    return exit_code
+
+
+def main():
+    request_fd, response_fd, max_runs = int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3])
+    for module in sys.argv[4:]:
+        __import__(module)
+
+    requests = os.fdopen(request_fd, "r")
+    responses = os.fdopen(response_fd, "w")
+    base_path = list(sys.path)
+    base_modules = set(sys.modules)
+
+    for _ in range(max_runs):
+        line = requests.readline()
+        if not line:
+            return
+        exit_code = run_script(json.loads(line), base_path, base_modules)
+        responses.write(json.dumps({"exit_code": exit_code}) + "\n")
+        responses.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import os
+import json
+import queue
+import select
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+
+from .output_capture import BoundedOutput
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "python_worker.py")
+
+
+class _Worker:
+    def __init__(self, python, max_runs, preload):
+        request_read, self._request_write = os.pipe()
+        self._response_read, response_write = os.pipe()
+        self.process = subprocess.Popen(
+            [python, WORKER_SCRIPT, str(request_read), str(response_write), str(max_runs), *preload],
+            pass_fds=(request_read, response_write),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True, # so a timeout can kill anything the script started too
+        )
+        os.close(request_read)
+        os.close(response_write)
+        self.runs_left = max_runs
+        self._responses = b""
+
+    def run(self, request, timeout, on_poll=None, poll_interval=0.05):
+        """
+        Sends a request and waits for the exit code. Returns None if the worker died.
+
+        While waiting, on_poll() is called every poll_interval seconds; if it
+        returns True the run is abandoned and "aborted" is returned.
+        """
+        os.write(self._request_write, (json.dumps(request) + "\n").encode("utf-8"))
+        self.runs_left -= 1
+        deadline = time.monotonic() + timeout
+        while b"\n" not in self._responses:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(request["file"], timeout)
+            if on_poll is not None:
+                if on_poll():
+                    return "aborted"
+                remaining = min(remaining, poll_interval)
+            ready, _, _ = select.select([self._response_read], [], [], remaining)
+            if ready:
+                chunk = os.read(self._response_read, 4096)
+                if not chunk:
+                    return None
+                self._responses += chunk
+        line, self._responses = self._responses.split(b"\n", 1)
+        return json.loads(line)["exit_code"]
+
+    def kill(self):
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.process.wait()
+        self.close()
+
+    def close(self):
+        for fd in (self._request_write, self._response_read):
+            if fd is not None:
+                os.close(fd)
+        self._request_write = self._response_read = None
+
+
+class PythonWorkerPool:
+    """
+    Pool of pre-started Python interpreters for run_python_file.
+
+    Starting python3 for every call costs more than many of the scripts it runs.
+    Here interpreters are started ahead of time (optionally with some modules
+    already imported) and each one runs a script in a fresh __main__ namespace,
+    with the working directory as cwd. A worker is retired after `max_runs`
+    scripts, or straight away if it crashes or times out, and a replacement is
+    started in the background so the next call finds a warm one.
+
+    Args:
+        size: Number of interpreters kept ready.
+        max_runs: Scripts a worker runs before it is replaced (1: a fresh interpreter every time).
+        preload: Modules each worker imports before it is used.
+    """
+
+    def __init__(self, size=2, max_runs=1, preload=("unittest",), python="python3"):
+        self.size = max(1, size)
+        self.max_runs = max(1, max_runs)
+        self.preload = tuple(preload)
+        self.python = python
+        self._idle = queue.Queue()
+        self._closed = False
+        for _ in range(self.size):
+            self._idle.put(self._start())
+
+    def _start(self):
+        return _Worker(self.python, self.max_runs, self.preload)
+
+    def _replace(self, worker):
+        if worker.runs_left > 0 and not self._closed:
+            self._idle.put(worker)
+            return
+        worker.process.wait() # It exits by itself after its last run
+        worker.close()
+        if not self._closed:
+            self._idle.put(self._start())
+
+    def run(self, working_directory, file_path, timeout=30, on_output=None):
+        """
+        Runs a script in a worker.
+
+        Args:
+            on_output: Optional callback(stream_name, new_bytes, total_bytes_so_far) called
+                       while the script runs. If it returns True the script is killed.
+
+        Returns:
+            (stdout, stderr, exit_code): BoundedOutput for each stream, and the exit code
+            (-SIGKILL if on_output had the script killed).
+
+        Raises:
+            subprocess.TimeoutExpired: if the script did not finish within `timeout` seconds.
+        """
+        worker = self._idle.get()
+        output_paths = []
+        for _ in range(2):
+            fd, path = tempfile.mkstemp(prefix="run_python_", suffix=".out")
+            os.close(fd)
+            output_paths.append(path)
+        request = {"file": file_path, "cwd": working_directory, "stdout": output_paths[0], "stderr": output_paths[1]}
+        on_poll = None
+        if on_output is not None:
+            offsets = [0, 0]
+
+            def on_poll():
+                # Pass on what the script wrote since the last poll, in the same chunks
+                # _run_subprocess reads, so on_output can stop it as soon as it goes over a limit
+                for index, (name, path) in enumerate(zip(("stdout", "stderr"), output_paths)):
+                    with open(path, "rb") as f:
+                        f.seek(offsets[index])
+                        while True:
+                            data = f.read(65536)
+                            if not data:
+                                break
+                            offsets[index] += len(data)
+                            if on_output(name, data, sum(offsets)):
+                                return True
+                return False
+
+        try:
+            try:
+                exit_code = worker.run(request, timeout, on_poll=on_poll)
+            except BaseException:
+                worker.kill()
+                worker.runs_left = 0
+                raise
+            if exit_code == "aborted":
+                worker.kill()
+                worker.runs_left = 0
+                exit_code = -signal.SIGKILL
+            elif exit_code is None:
+                # The script took the interpreter down with it (os._exit, a crash, ...)
+                exit_code = worker.process.wait()
+                worker.runs_left = 0
+            elif on_poll is not None and on_poll(): # Whatever was written after the last poll
+                exit_code = -signal.SIGKILL
+            stdout, stderr = (BoundedOutput.from_file(path) for path in output_paths)
+            return stdout, stderr, exit_code
+        finally:
+            for path in output_paths:
+                os.remove(path)
+            # Hand the worker back, or wait for it to exit and start a replacement, off the caller's path
+            threading.Thread(target=self._replace, args=(worker,), daemon=True).start()
+
+    def shutdown(self):
+        self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.kill()
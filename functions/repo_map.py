@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import threading
+
+from .affected_tests import is_test_module
+from .get_files_info import GitIgnore, get_directory_contents
+from .import_graph import get_graph
+from .symbol_index import cache_directory, get_index, skipped_directories
+
+MAP_VERSION = 2
+
+# Same estimate as agent.history.estimate_tokens
+CHARS_PER_TOKEN = 4
+
+# Longest docstring summary shown for a class or function
+doc_limit = 80
+
+HEADER = ("Map of the working directory: its files, then the classes and functions of its Python files, "
+          "most used first, with line numbers. Paths are relative to the working directory. "
+          "Use it to go straight to the files you need instead of listing directories first.")
+
+# root -> (state key, map text), so a session only rebuilds the map when the tree changed
+_maps = {}
+_maps_lock = threading.Lock()
+
+
+def _size(size):
+    if size < 1024:
+        return f"{size} B"
+    return f"{size / 1024:.1f} KB"
+
+
+def _tree(files, depth_limit=None):
+    """Indented file tree. With depth_limit, deeper directories are collapsed into a file count."""
+    lines = []
+    shown_directories = set()
+    collapsed = {}
+    for relative, size in files:
+        parts = relative.split("/")
+        if depth_limit is not None and len(parts) - 1 > depth_limit:
+            directory = "/".join(parts[:depth_limit + 1])
+            if directory not in collapsed:
+                collapsed[directory] = 0
+                lines.append((directory, None))
+            collapsed[directory] += 1
+            continue
+        for depth in range(len(parts) - 1):
+            directory = "/".join(parts[:depth + 1])
+            if directory not in shown_directories:
+                shown_directories.add(directory)
+                lines.append((directory + "/", "dir"))
+        lines.append((relative, size))
+    output = []
+    for relative, size in lines:
+        if size is None:
+            output.append(f"{'  ' * relative.count('/')}{relative.rsplit('/', 1)[-1]}/ "
+                          f"({collapsed[relative]} files not shown)")
+        elif size == "dir":
+            name = relative.rstrip("/")
+            output.append(f"{'  ' * name.count('/')}{name.rsplit('/', 1)[-1]}/")
+        else:
+            output.append(f"{'  ' * relative.count('/')}{relative.rsplit('/', 1)[-1]} ({_size(size)})")
+    return output
+
+
+def _outline(relative, symbols, importers):
+    """The lines for one Python file: its classes and functions, and the public methods of its classes."""
+    title = relative if not importers else f"{relative} (used by {importers} file{'s' if importers > 1 else ''})"
+    lines = [title]
+    if is_test_module(relative):
+        # Test names say little about the code; only count them
+        for symbol in symbols:
+            if symbol["kind"] == "class":
+                tests = sum(1 for other in symbols if other["qualname"].startswith(symbol["qualname"] + ".test"))
+                lines.append(f"  {symbol['line']}: {symbol['signature']}: {tests} tests")
+        return lines
+    for symbol in symbols:
+        depth = symbol["qualname"].count(".")
+        # Classes, functions and public methods; nothing nested in functions
+        if depth > 1 or (symbol["kind"] == "function" and depth) or (
+                symbol["kind"] == "method" and symbol["name"].startswith("_") and symbol["name"] != "__init__"):
+            continue
+        line = f"{'  ' * (depth + 1)}{symbol['line']}: {symbol['signature']}"
+        if symbol["doc"] and symbol["kind"] != "method":
+            doc = symbol["doc"].split(". ")[0]
+            line += f"  # {doc[:doc_limit]}{'...' if len(doc) > doc_limit else ''}"
+        lines.append(line)
+    return lines
+
+
+def build_repo_map(working_directory, token_budget=1000):
+    """
+    Builds the map of `working_directory` given to the model at the start of
+    a session, in about `token_budget` tokens: the file tree (collapsed to the
+    top levels if it does not fit in half the budget), then an outline of the
+    Python files, those imported by the most other files first, until the
+    budget is used up.
+
+    The symbol index and import graph it reads are updated incrementally, and
+    the finished map is cached in memory and on disk under a key made from
+    every file's path, size and mtime, so an unchanged tree costs one
+    directory walk.
+    """
+    root = os.path.realpath(working_directory)
+    entries = get_directory_contents(root, recursive=True, ignore=GitIgnore(root), skip=skipped_directories, quiet=True)
+    files = sorted((relative, size) for relative, size, type, _ in entries if type == "file")
+    mtimes = {relative: mtime for relative, _, type, mtime in entries if type == "file"}
+    state = hashlib.sha1(json.dumps(
+        [MAP_VERSION, token_budget, [(relative, size, mtimes[relative]) for relative, size in files]]
+    ).encode("utf-8")).hexdigest()
+
+    with _maps_lock:
+        cached = _maps.get(root)
+    if cached is not None and cached[0] == state:
+        return cached[1]
+    path = os.path.join(cache_directory, f"repo-map-{hashlib.sha1(root.encode('utf-8')).hexdigest()[:16]}.json")
+    try:
+        with open(path, "r") as f:
+            stored = json.load(f)
+        if stored.get("state") == state:
+            with _maps_lock:
+                _maps[root] = (state, stored["map"])
+            return stored["map"]
+    except (OSError, ValueError):
+        pass
+
+    budget = token_budget * CHARS_PER_TOKEN
+    lines = [HEADER, "", "Files:"]
+    tree = _tree(files)
+    depth_limit = 2
+    while sum(len(line) + 1 for line in tree) > budget // 2 and depth_limit >= 0:
+        tree = _tree(files, depth_limit)
+        depth_limit -= 1
+    if sum(len(line) + 1 for line in tree) > budget // 2:
+        # Too many entries even at the top level: show the first ones
+        room = budget // 2 - len(f"[... {len(tree)} more entries]") - 1
+        shown = 0
+        for line in tree:
+            room -= len(line) + 1
+            if room < 0:
+                break
+            shown += 1
+        tree = tree[:shown] + [f"[... {len(tree) - shown} more entries]"]
+    lines += tree
+
+    symbols_by_file = {}
+    for symbol in get_index(root).symbols():
+        symbols_by_file.setdefault(symbol["file"], []).append(symbol)
+    graph = get_graph(root)
+    graph.refresh()
+    importers = {relative: len(graph.dependants([relative])) - 1 for relative in symbols_by_file}
+    ranked = sorted(symbols_by_file, key=lambda relative: (
+        is_test_module(relative), -importers[relative], relative.count("/"), relative))
+
+    lines += ["", "Python files:"]
+    # Room is kept for the line saying how many files were left out
+    used = sum(len(line) + 1 for line in lines) + len(f"[{len(ranked)} more Python files not outlined; "
+                                                      f"use list_symbols to outline one]")
+    left_out = 0
+    for relative in ranked:
+        symbols = sorted(symbols_by_file[relative], key=lambda symbol: symbol["line"])
+        outline = _outline(relative, symbols, importers[relative])
+        size = sum(len(line) + 1 for line in outline)
+        if used + size > budget:
+            left_out += 1
+            continue
+        lines += outline
+        used += size
+    if left_out:
+        lines.append(f"[{left_out} more Python files not outlined; use list_symbols to outline one]")
+
+    repo_map = "\n".join(lines)
+    with _maps_lock:
+        _maps[root] = (state, repo_map)
+    try:
+        os.makedirs(cache_directory, exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({"state": state, "map": repo_map}, f)
+        os.replace(temporary, path)
+    except OSError:
+        pass # The map still works from memory
+    return repo_map
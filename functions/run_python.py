@@ -1,7 +1,97 @@
+import contextvars
 import os
+import signal
 import subprocess
+import sys
+import threading
+import time
 
-def run_python_file(working_directory, file_path):
+from . import output_capture
+from .output_capture import BoundedOutput
+from .python_worker_pool import PythonWorkerPool
+
+# Optional pool of pre-started interpreters (see enable_worker_pool)
+worker_pool = None
+# Seconds a script may run before it is killed
+run_timeout = 30
+
+
+def enable_worker_pool(size=2, max_runs=1):
+    """Runs scripts in pre-started interpreters instead of starting python3 for every call."""
+    global worker_pool
+    if worker_pool is None:
+        worker_pool = PythonWorkerPool(size=size, max_runs=max_runs)
+    return worker_pool
+
+
+def _kill_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def _run_subprocess(working_directory, file_path, timeout, on_output):
+    """
+    Runs "python3 file_path", reading its output as it is produced instead of
+    buffering all of it, the same way PythonWorkerPool.run reports it.
+    """
+    process = subprocess.Popen(['python3', file_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               stdin=subprocess.DEVNULL, cwd=working_directory,
+                               start_new_session=True) # so a kill also reaches anything the script started
+    outputs = {"stdout": BoundedOutput(), "stderr": BoundedOutput()}
+    total = [0]
+    lock = threading.Lock()
+    aborted = threading.Event()
+    finished = threading.Event()
+
+    def pump(name, pipe):
+        fd = pipe.fileno()
+        while True:
+            data = os.read(fd, 65536)
+            if not data:
+                break
+            with lock:
+                if finished.is_set():
+                    break
+                outputs[name].write(data)
+                total[0] += len(data)
+                if on_output(name, data, total[0]):
+                    aborted.set()
+                    _kill_group(process)
+        pipe.close()
+
+    # The readers call on_output in the caller's context (e.g. so the daemon can route what it prints)
+    readers = [threading.Thread(target=contextvars.copy_context().run, args=(pump, name, getattr(process, name)),
+                                daemon=True)
+               for name in outputs]
+    for reader in readers:
+        reader.start()
+    deadline = time.monotonic() + timeout
+    try:
+        returncode = process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill_group(process)
+        process.wait()
+        raise
+    finally:
+        # Something the script started in the background may still hold the
+        # pipes open: wait for the output until the timeout, then kill the
+        # group so the pipes close
+        for reader in readers:
+            reader.join(max(0, deadline - time.monotonic()))
+        if any(reader.is_alive() for reader in readers):
+            _kill_group(process)
+            for reader in readers:
+                reader.join(1)
+        with lock:
+            finished.set() # A reader still blocked (its process left the group) records nothing more
+    if aborted.is_set():
+        returncode = -signal.SIGKILL
+    return outputs["stdout"], outputs["stderr"], returncode
+
+
+def run_python_file(working_directory, file_path, verbose=False):
     # Resolve working_directory if it's not absolute
     if not os.path.isabs(working_directory):
         cwd = os.getcwd()
@@ -34,17 +124,37 @@ def run_python_file(working_directory, file_path):
     if not os.path.exists(file_path):
         return f'Error: File "{relative_file_path}" not found.'
 
+    # Only the head and tail of each stream are kept; a script that prints
+    # without end is killed once it goes past output_capture.hard_limit
+    hard_limit = output_capture.hard_limit
+    over_limit = []
+
+    def on_output(name, data, total):
+        if verbose:
+            sys.stdout.write(data.decode("utf-8", errors="replace"))
+            sys.stdout.flush()
+        if total > hard_limit:
+            over_limit.append(total)
+            return True
+        return False
+
     try:
-        result = subprocess.run(['python3', file_path], capture_output=True, text=True, timeout=30, cwd=working_directory)
-        
+        if worker_pool is not None:
+            stdout, stderr, returncode = worker_pool.run(working_directory, os.path.abspath(file_path),
+                                                         timeout=run_timeout, on_output=on_output)
+        else:
+            stdout, stderr, returncode = _run_subprocess(working_directory, file_path, run_timeout, on_output)
+
         output = []
 
-        if result.stdout:
-            output.append("STDOUT:\n" + result.stdout.strip())
-        if result.stderr:
-            output.append("STDERR:\n" + result.stderr.strip())
-        if result.returncode != 0:
-            output.append(f'Error: Process exited with code {result.returncode}')
+        if stdout.total:
+            output.append("STDOUT:\n" + stdout.text().strip())
+        if stderr.total:
+            output.append("STDERR:\n" + stderr.text().strip())
+        if over_limit:
+            output.append(f'Error: Process killed after producing more than {hard_limit} bytes of output')
+        elif returncode != 0:
+            output.append(f'Error: Process exited with code {returncode}')
 
         if not output:
             return "No output produced."
@@ -52,6 +162,6 @@ def run_python_file(working_directory, file_path):
         return "\n\n".join(output)
     
     except subprocess.TimeoutExpired:
-        return f'Error: Execution timed out after 30 seconds.'
+        return f'Error: Execution timed out after {run_timeout} seconds.'
     except Exception as e:
         return f'Error: executing Python file: {e}'
\ No newline at end of file
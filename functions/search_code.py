@@ -0,0 +1,371 @@
+import os
+import re
+import fnmatch
+import threading
+import time
+
+from .file_cache import add_write_listener
+from .get_files_info import GitIgnore
+
+# Files bigger than this, or that look binary, are not indexed
+max_indexed_file_bytes = 1024 * 1024
+# The result is cut at this many characters, like get_file_content
+result_char_limit = 10000
+# Directories that are never worth searching
+skipped_directories = {".git", "__pycache__", ".venv", "venv", "node_modules"}
+# How often a query re-stats the tree to pick up changes made outside the tools
+refresh_interval = 2.0
+
+
+def _trigrams(text):
+    grams = set()
+    # Identical lines (blank lines, repeated boilerplate) only need to be scanned once
+    for line in set(text.splitlines()):
+        grams.update(line[i:i + 3] for i in range(len(line) - 2))
+    return grams
+
+
+_QUANTIFIER = re.compile(r"\{\d*(?:,\d*)?\}")
+
+
+def _required_literals(pattern):
+    """
+    Returns literal strings that every match of the regex `pattern` must contain,
+    so the index can narrow down the files to scan. An empty list means "no
+    usable literal", and every file is scanned: when in doubt, this gives up
+    rather than risk skipping a file that matches.
+    """
+    try:
+        literals, end, alternation = _sequence_literals(pattern, 0)
+    except ValueError:
+        return []
+    if end != len(pattern) or alternation:
+        return []
+    return [literal for literal in literals if len(literal) >= 3]
+
+
+def _sequence_literals(pattern, i):
+    """
+    Literals required by the part of `pattern` that starts at `i` and ends at
+    the closing parenthesis of the enclosing group (or the end of the pattern).
+    Returns (literals, index of that parenthesis, whether the part has a "|").
+    Raises ValueError for anything it does not understand.
+    """
+    literals = []
+    current = ""
+    alternation = False
+    while i < len(pattern):
+        char = pattern[i]
+        if char == ")":
+            break
+        if char == "|":
+            alternation = True
+            i += 1
+            literals.append(current)
+            current = ""
+            continue
+        if char == "(":
+            literals.append(current)
+            current = ""
+            if pattern.startswith("(?", i):
+                if not pattern.startswith(("(?:", "(?P<", "(?=", "(?!", "(?<=", "(?<!", "(?#"), i):
+                    raise ValueError("inline flags may change what the rest of the pattern means")
+                # Lookarounds, comments and non-capturing groups: their text is not counted
+                _, i, _ = _sequence_literals(pattern, i + 2)
+                if i >= len(pattern):
+                    raise ValueError("unbalanced parenthesis")
+                i += 1
+                continue
+            inner, i, inner_alternation = _sequence_literals(pattern, i + 1)
+            if i >= len(pattern):
+                raise ValueError("unbalanced parenthesis")
+            i += 1
+            # A group that may be absent, or that has alternatives, requires nothing
+            if not inner_alternation and not (i < len(pattern) and pattern[i] in "?*{"):
+                literals.extend(inner)
+            continue
+        if char == "\\" and i + 1 < len(pattern):
+            escaped = pattern[i + 1]
+            i += 2
+            if escaped in "xuUN" or escaped.isdigit():
+                # Character codes and backreferences: the text after them is not literal
+                raise ValueError(f"escape \\{escaped} is not understood")
+            if escaped.isalnum():
+                # \d, \w, \b, ... are classes or anchors, not literals
+                literals.append(current)
+                current = ""
+                continue
+            char = escaped
+        elif char == "[":
+            end = i + 1
+            if pattern.startswith("^", end):
+                end += 1
+            end += 1 # A "]" right after "[" or "[^" is part of the class
+            while end < len(pattern) and pattern[end] != "]":
+                end += 2 if pattern[end] == "\\" else 1
+            i = end + 1
+            literals.append(current)
+            current = ""
+            continue
+        elif char == "{":
+            # Skip a {m,n} repeat whole, so its digits are not taken for text
+            quantifier = _QUANTIFIER.match(pattern, i)
+            i = quantifier.end() if quantifier else i + 1
+            literals.append(current)
+            current = ""
+            continue
+        elif char in ".^$+*?}":
+            i += 1
+            literals.append(current)
+            current = ""
+            continue
+        else:
+            i += 1
+        # A character followed by ?, * or {..} may be absent from the match
+        if i < len(pattern) and pattern[i] in "?*{":
+            literals.append(current)
+            current = ""
+            continue
+        current += char
+    literals.append(current)
+    return literals, i, alternation
+
+
+class SearchIndex:
+    """
+    In-memory trigram index over the text files of a directory tree.
+
+    The text of every indexed file is kept in memory, and each lowercase
+    trigram maps to the files containing it, so a query only scans the files
+    that contain all the trigrams of its literal parts. The index is built on
+    the first query and kept up to date incrementally: files written by the
+    tools are re-indexed on the next query, and every `refresh_interval`
+    seconds a query re-stats the tree to pick up other changes.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self._files = {} # path -> (signature, text)
+        self._postings = {} # trigram -> set of paths
+        self._dirty = set()
+        self._last_refresh = None
+        self._lock = threading.RLock()
+
+    def mark_dirty(self, path):
+        with self._lock:
+            self._dirty.add(path)
+
+    def _walk(self):
+        ignore = GitIgnore(self.root)
+        pending = [self.root]
+        while pending:
+            directory = pending.pop()
+            rules = ignore.rules_for(directory)
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            is_dir = entry.is_dir(follow_symlinks=False)
+                            if rules and GitIgnore.matches(rules, entry.name, is_dir):
+                                continue
+                            if is_dir:
+                                if entry.name not in skipped_directories:
+                                    pending.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False):
+                                yield entry.path, entry.stat()
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+
+    def _add(self, path, signature):
+        try:
+            with open(path, "rb") as f:
+                data = f.read(max_indexed_file_bytes + 1)
+        except OSError:
+            return
+        if len(data) > max_indexed_file_bytes or b"\0" in data[:8192]:
+            return
+        text = data.decode("utf-8", errors="replace")
+        self._files[path] = (signature, text)
+        for gram in _trigrams(text.lower()):
+            self._postings.setdefault(gram, set()).add(path)
+
+    def _remove(self, path):
+        entry = self._files.pop(path, None)
+        if entry is None:
+            return
+        for gram in _trigrams(entry[1].lower()):
+            paths = self._postings.get(gram)
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del self._postings[gram]
+
+    def refresh(self, force=False):
+        """Brings the index up to date with the files on disk."""
+        with self._lock:
+            now = time.monotonic()
+            if force or self._last_refresh is None or now - self._last_refresh >= refresh_interval:
+                seen = set()
+                for path, stat_result in self._walk():
+                    seen.add(path)
+                    signature = (stat_result.st_mtime_ns, stat_result.st_size)
+                    entry = self._files.get(path)
+                    if entry is None or entry[0] != signature:
+                        self._remove(path)
+                        if stat_result.st_size <= max_indexed_file_bytes:
+                            self._add(path, signature)
+                for path in set(self._files) - seen:
+                    self._remove(path)
+                self._last_refresh = now
+                self._dirty.clear()
+            elif self._dirty:
+                # Only the files the tools wrote since the last query
+                for path in self._dirty:
+                    self._remove(path)
+                    try:
+                        stat_result = os.stat(path)
+                    except OSError:
+                        continue
+                    if stat_result.st_size <= max_indexed_file_bytes:
+                        self._add(path, (stat_result.st_mtime_ns, stat_result.st_size))
+                self._dirty.clear()
+
+    def candidates(self, literals):
+        """Paths of the files containing every trigram of every literal (all files if there are none)."""
+        grams = set()
+        for literal in literals:
+            grams.update(_trigrams(literal.lower()))
+        if not grams:
+            return list(self._files)
+        postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+        result = set(postings[0])
+        for paths in postings[1:]:
+            result &= paths
+            if not result:
+                break
+        return result
+
+    def search(self, regex, literals, path_filter=None, max_results=50):
+        """
+        Finds the lines matching `regex` in the files that contain all `literals`.
+
+        Returns:
+            (results, capped): [(relative path, text, [matching line numbers])] covering
+            at most max_results lines, and whether the search stopped at that limit.
+        """
+        with self._lock:
+            self.refresh()
+            paths = sorted(self.candidates(literals))
+            files = {path: self._files[path][1] for path in paths}
+
+        results = []
+        found = 0
+        for path in paths:
+            relative = os.path.relpath(path, self.root)
+            if path_filter is not None and not path_filter(relative):
+                continue
+            text = files[path]
+            line_numbers = []
+            line = 1
+            position = 0
+            for match in regex.finditer(text):
+                line += text.count("\n", position, match.start())
+                position = match.start()
+                if not line_numbers or line_numbers[-1] != line:
+                    line_numbers.append(line)
+                    found += 1
+                    if found >= max_results:
+                        break
+            if line_numbers:
+                results.append((relative, text, line_numbers))
+            if found >= max_results:
+                break
+        return results, found >= max_results
+
+
+# One index per working directory, shared by every call
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(working_directory):
+    root = os.path.realpath(working_directory)
+    with _indexes_lock:
+        index = _indexes.get(root)
+        if index is None:
+            index = _indexes[root] = SearchIndex(root)
+        return index
+
+
+def _on_file_written(path):
+    for root, index in list(_indexes.items()):
+        if path.startswith(root + os.sep):
+            index.mark_dirty(path)
+
+
+add_write_listener(_on_file_written)
+
+
+def search_code(working_directory, query, regex=False, case_sensitive=False, path_glob=None,
+                context_lines=2, max_results=50) -> str:
+    # Resolve working_directory if it's not absolute
+    if not os.path.isabs(working_directory):
+        cwd = os.getcwd()
+        potential_path = os.path.join(cwd, working_directory)
+        if not os.path.isdir(potential_path):
+            return f'Error: "{working_directory}" is not a valid subdirectory of the current directory'
+        working_directory = potential_path
+
+    if not query:
+        return 'Error: query must not be empty'
+    try:
+        context_lines = max(0, int(context_lines))
+        max_results = max(1, int(max_results))
+    except (TypeError, ValueError):
+        return 'Error: context_lines and max_results must be integers'
+
+    flags = re.MULTILINE if case_sensitive else re.MULTILINE | re.IGNORECASE
+    try:
+        compiled = re.compile(query if regex else re.escape(query), flags)
+    except re.error as e:
+        return f'Error: Invalid regular expression "{query}": {e}'
+    literals = _required_literals(query) if regex else [query]
+
+    path_filter = None
+    if path_glob:
+        glob = re.compile(fnmatch.translate(path_glob)).match
+        path_filter = lambda relative: glob(relative) or glob(os.path.basename(relative))
+
+    results, capped = get_index(working_directory).search(compiled, literals, path_filter, max_results)
+    if not results:
+        return f'No matches for "{query}".'
+
+    # grep-like output: "path:line: text" for matches, "path-line- text" for context
+    output = []
+    for relative, text, line_numbers in results:
+        lines = text.splitlines()
+        matched = set(line_numbers)
+        shown = set()
+        previous = None
+        for number in line_numbers:
+            for context in range(max(1, number - context_lines), min(len(lines), number + context_lines) + 1):
+                if context in shown:
+                    continue
+                if previous is not None and context > previous + 1:
+                    output.append("--")
+                separator = ":" if context in matched else "-"
+                output.append(f"{relative}{separator}{context}{separator} {lines[context - 1]}")
+                shown.add(context)
+                previous = context
+        output.append("")
+
+    found = sum(len(line_numbers) for _, _, line_numbers in results)
+    header = f"Found {found} matching lines in {len(results)} files"
+    if capped:
+        header += f" (stopped at max_results={max_results})"
+    body = "\n".join(output)
+    if len(body) > result_char_limit:
+        body = body[:result_char_limit] + f"\n[...Results truncated at {result_char_limit} characters; narrow the query or use path_glob]"
+    return header + ":\n" + body
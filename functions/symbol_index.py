@@ -0,0 +1,249 @@
+import os
+import ast
+import json
+import hashlib
+import threading
+import time
+
+from .file_cache import add_write_listener
+from .get_files_info import GitIgnore, get_directory_contents
+
+# Where the indexes are stored between runs (one JSON file per working directory)
+cache_directory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache")
+# Bump when the stored format changes, so old caches are rebuilt
+INDEX_VERSION = 1
+# How often a query re-stats the tree to pick up changes made outside the tools
+refresh_interval = 2.0
+# Directories that are never indexed
+skipped_directories = {".git", "__pycache__", ".venv", "venv", "node_modules"}
+
+
+def _signature(node):
+    if isinstance(node, ast.ClassDef):
+        bases = [ast.unparse(base) for base in node.bases] + [ast.unparse(keyword) for keyword in node.keywords]
+        return f"class {node.name}({', '.join(bases)})" if bases else f"class {node.name}"
+    prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+    returns = f" -> {ast.unparse(node.returns)}" if node.returns is not None else ""
+    return f"{prefix} {node.name}({ast.unparse(node.args)}){returns}"
+
+
+def _doc_summary(node):
+    doc = ast.get_docstring(node)
+    if not doc:
+        return ""
+    return doc.strip().split("\n\n")[0].replace("\n", " ")[:200]
+
+
+def extract_symbols(source, relative_path):
+    """Returns an entry for every class, function and method defined in `source`."""
+    symbols = []
+
+    def visit(body, scope, in_class):
+        for node in body:
+            if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+                qualname = f"{scope}.{node.name}" if scope else node.name
+                if isinstance(node, ast.ClassDef):
+                    kind = "class"
+                else:
+                    kind = "method" if in_class else "function"
+                symbols.append({
+                    "name": node.name,
+                    "qualname": qualname,
+                    "kind": kind,
+                    "file": relative_path,
+                    "line": node.lineno,
+                    "signature": _signature(node),
+                    "doc": _doc_summary(node),
+                })
+                visit(node.body, qualname, isinstance(node, ast.ClassDef))
+
+    visit(ast.parse(source).body, "", False)
+    return symbols
+
+
+class SymbolIndex:
+    """
+    Index of the classes, functions and methods in the Python files of a directory tree.
+
+    The index is stored on disk and reused across runs. When it is refreshed,
+    only files whose mtime or size changed are looked at again, and those are
+    only re-parsed if their content hash changed too, so the cost of a refresh
+    is proportional to what changed.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        key = hashlib.sha1(self.root.encode("utf-8")).hexdigest()[:16]
+        self.path = os.path.join(cache_directory, f"symbols-{key}.json")
+        self._files = {} # relative path -> {"mtime", "size", "sha1", "symbols"}
+        self._dirty = set()
+        self._last_refresh = None
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return
+        if stored.get("version") == INDEX_VERSION and stored.get("root") == self.root:
+            self._files = stored.get("files", {})
+
+    def _save(self):
+        os.makedirs(cache_directory, exist_ok=True)
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({"version": INDEX_VERSION, "root": self.root, "files": self._files}, f, separators=(",", ":"))
+        os.replace(temporary, self.path)
+
+    def mark_dirty(self, path):
+        with self._lock:
+            self._dirty.add(os.path.relpath(path, self.root))
+
+    def _update_file(self, relative, mtime, size):
+        """Re-indexes one file if it changed. Returns True if the index changed."""
+        entry = self._files.get(relative)
+        if entry is not None and entry["mtime"] == mtime and entry["size"] == size:
+            return False
+        try:
+            with open(os.path.join(self.root, relative), "rb") as f:
+                data = f.read()
+        except OSError:
+            return self._files.pop(relative, None) is not None
+        digest = hashlib.sha1(data).hexdigest()
+        if entry is not None and entry["sha1"] == digest:
+            symbols = entry["symbols"] # Touched but not changed
+        else:
+            try:
+                symbols = extract_symbols(data.decode("utf-8", errors="replace"), relative)
+            except (SyntaxError, ValueError):
+                symbols = []
+        self._files[relative] = {"mtime": mtime, "size": size, "sha1": digest, "symbols": symbols}
+        return True
+
+    def refresh(self):
+        with self._lock:
+            changed = False
+            now = time.monotonic()
+            if self._last_refresh is None or now - self._last_refresh >= refresh_interval:
+                seen = set()
+                python_files = get_directory_contents(self.root, recursive=True, pattern="*.py",
+                                                      ignore=GitIgnore(self.root), skip=skipped_directories,
+                                                      quiet=True)
+                for relative, size, type, mtime in python_files:
+                    if type != "file":
+                        continue
+                    seen.add(relative)
+                    changed |= self._update_file(relative, mtime, size)
+                for relative in set(self._files) - seen:
+                    del self._files[relative]
+                    changed = True
+                self._last_refresh = now
+            else:
+                # Only the files the tools wrote since the last query
+                for relative in self._dirty:
+                    try:
+                        stat_result = os.stat(os.path.join(self.root, relative))
+                    except OSError:
+                        changed |= self._files.pop(relative, None) is not None
+                        continue
+                    if relative.endswith(".py") and skipped_directories.isdisjoint(relative.split(os.sep)[:-1]):
+                        changed |= self._update_file(relative, stat_result.st_mtime, stat_result.st_size)
+            self._dirty.clear()
+            if changed:
+                try:
+                    self._save()
+                except OSError:
+                    pass # The index still works in memory
+
+    def symbols(self):
+        self.refresh()
+        with self._lock:
+            return [symbol for entry in self._files.values() for symbol in entry["symbols"]]
+
+
+# One index per working directory, shared by every call
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(working_directory):
+    root = os.path.realpath(working_directory)
+    with _indexes_lock:
+        index = _indexes.get(root)
+        if index is None:
+            index = _indexes[root] = SymbolIndex(root)
+        return index
+
+
+def _on_file_written(path):
+    for root, index in list(_indexes.items()):
+        if path.startswith(root + os.sep):
+            index.mark_dirty(path)
+
+
+add_write_listener(_on_file_written)
+
+
+def _format(symbol):
+    line = f"{symbol['file']}:{symbol['line']}: {symbol['kind']} {symbol['qualname']} -- {symbol['signature']}"
+    if symbol["doc"]:
+        line += f"\n    {symbol['doc']}"
+    return line
+
+
+def _resolve_working_directory(working_directory):
+    if not os.path.isabs(working_directory):
+        potential_path = os.path.join(os.getcwd(), working_directory)
+        if not os.path.isdir(potential_path):
+            return None
+        working_directory = potential_path
+    return working_directory
+
+
+def find_symbol(working_directory, name, kind=None, max_results=20) -> str:
+    resolved = _resolve_working_directory(working_directory)
+    if resolved is None:
+        return f'Error: "{working_directory}" is not a valid subdirectory of the current directory'
+    if not name:
+        return 'Error: name must not be empty'
+
+    max_results = int(max_results)
+    symbols = get_index(resolved).symbols()
+    if kind:
+        symbols = [symbol for symbol in symbols if symbol["kind"] == kind]
+
+    # Exact names (or dotted qualified names) first; otherwise fall back to substrings
+    matches = [symbol for symbol in symbols if name in (symbol["name"], symbol["qualname"])]
+    if not matches:
+        lowered = name.lower()
+        matches = [symbol for symbol in symbols if lowered in symbol["qualname"].lower()]
+        if not matches:
+            return f'No symbol named "{name}" found.'
+    matches.sort(key=lambda symbol: (symbol["file"], symbol["line"]))
+    output = [_format(symbol) for symbol in matches[:max_results]]
+    if len(matches) > max_results:
+        output.append(f"[...{len(matches) - max_results} more matches not shown]")
+    return "\n".join(output)
+
+
+def list_symbols(working_directory, file_path=None, max_results=200) -> str:
+    resolved = _resolve_working_directory(working_directory)
+    if resolved is None:
+        return f'Error: "{working_directory}" is not a valid subdirectory of the current directory'
+
+    max_results = int(max_results)
+    symbols = get_index(resolved).symbols()
+    if file_path:
+        relative = os.path.relpath(os.path.join(resolved, file_path), resolved)
+        if relative.startswith(".."):
+            return f'Error: Cannot list symbols of "{file_path}" as it is outside the permitted working directory'
+        symbols = [symbol for symbol in symbols if symbol["file"] == relative]
+        if not symbols:
+            return f'No symbols found in "{file_path}".'
+    symbols.sort(key=lambda symbol: (symbol["file"], symbol["line"]))
+    output = [_format(symbol) for symbol in symbols[:max_results]]
+    if len(symbols) > max_results:
+        output.append(f"[...{len(symbols) - max_results} more symbols; pass file_path to narrow down]")
+    return "\n".join(output) if output else "No symbols found."
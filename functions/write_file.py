@@ -1,4 +1,41 @@
 import os
+import tempfile
+
+from .file_cache import notify_file_written
+
+# The process umask, read once at import: os.umask can only be read by
+# setting it, and changing it later would race with other tool threads
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+def write_atomically(path, content):
+    """
+    Replaces the file at `path` with `content` so readers see either the old or
+    the new file, never a partial one: the text goes to a temporary file in the
+    same directory, which is flushed to disk and then renamed over `path`.
+    A symlink is written through: its target is replaced, not the link.
+    """
+    path = os.path.realpath(path)
+    directory = os.path.dirname(path)
+    fd, temporary = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(temporary, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            os.chmod(temporary, 0o666 & ~_umask)
+        os.replace(temporary, path)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise
+
 
 def write_file(working_directory, file_path, content) -> str:
     # Resolve working_directory if it's not absolute
@@ -26,8 +63,10 @@ def write_file(working_directory, file_path, content) -> str:
     
     # write to file
     try:
-        with open(file_path, 'w') as file:
-            file.write(content)
+        write_atomically(file_path, content)
         return f'Successfully wrote to "{file_path}" ({len(content)} characters written)'
     except Exception as e:
-        return f'Error: Cannot write to "{file_path}", encounterd error"{e}"'
\ No newline at end of file
+        return f'Error: Cannot write to "{file_path}", encounterd error"{e}"'
+    finally:
+        # Never serve the old content from the read cache (or any index) again
+        notify_file_written(file_path)
\ No newline at end of file
@@ -1,18 +1,77 @@
 # main.py
 import os
+import asyncio
+import cProfile
+import pstats
 import sys
+import time
 import argparse
+import functools
 from dotenv import load_dotenv
-from google import genai
 from google.genai import types
-from functions.call_function import call_function
-
-load_dotenv()
-api_key = os.environ.get("GEMINI_API_KEY")
-parser = argparse.ArgumentParser(description='Gemini CLI prompt with API')
-parser.add_argument("prompt", type=str, help="Prompt to send to Gemini")
-parser.add_argument('-v','--verbose', action="store_true")
-args = parser.parse_args()
+from functions.call_function import WORKING_DIRECTORY
+from functions.dispatch import ToolDispatcher, source_files
+from agent.history import CHARS_PER_TOKEN, HistoryManager, estimate_tokens
+from agent.result_dedupe import ToolResultDeduper
+from agent.model_client import GeminiClient, RecordingClient, ReplayClient
+from agent.openai_client import OpenAICompatibleClient
+from agent.sessions import SessionNotFoundError, SessionStore
+from agent.tracing import Tracer, usage_fields
+from functions.file_cache import read_cache
+from functions import prefetch, run_python
+from functions.repo_map import build_repo_map
+from functions.run_python import enable_worker_pool
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Gemini CLI prompt with API')
+    parser.add_argument("prompt", type=str, help="Prompt to send to Gemini")
+    parser.add_argument('-v','--verbose', action="store_true")
+    parser.add_argument('--max-workers', type=int, default=1,
+                        help="How many tool calls from one turn may run concurrently (default: 1, one after another)")
+    parser.add_argument('--stream', action="store_true",
+                        help="Stream the response: print text as it arrives and start tool calls as soon as they arrive "
+                             "(not with --deadline, --model-timeout or --tool-timeout)")
+    parser.add_argument('--history-budget', type=int, default=None,
+                        help="Approximate token budget for the conversation history; older tool results are compacted to fit")
+    parser.add_argument('--python-workers', type=int, default=0,
+                        help="Keep this many pre-started Python interpreters for run_python_file (default: 0, off)")
+    parser.add_argument('--python-worker-runs', type=int, default=1,
+                        help="Scripts each pre-started interpreter runs before it is replaced (default: 1)")
+    parser.add_argument('--prefetch', action="store_true",
+                        help="Read listed files and the local imports of read files ahead, on a background thread")
+    parser.add_argument('--repo-map-budget', type=int, default=REPO_MAP_BUDGET,
+                        help="Tokens of working directory map (files, classes, functions) put in front of the system prompt (default: %(default)s) (0: none)")
+    parser.add_argument('--no-dedupe', action="store_true",
+                        help="Always send tool results whole, even when a repeated call returns the same or nearly the same result")
+    parser.add_argument('--local-url', metavar="URL", default=None,
+                        help="Use the model of a local OpenAI-compatible server (llama.cpp, Ollama...) instead of Gemini, "
+                             "e.g. http://127.0.0.1:8080/v1")
+    parser.add_argument('--local-model', metavar="NAME", default=None,
+                        help="Model name to ask the --local-url server for (default: the server's choice)")
+    parser.add_argument('--record', metavar="LOG", default=None,
+                        help="Record every model request/response to this JSONL log (.gz to compress)")
+    parser.add_argument('--replay', metavar="LOG", default=None,
+                        help="Serve model responses from a log written by --record, without network access")
+    parser.add_argument('--deadline', type=float, default=None,
+                        help="Wall-clock limit for the whole session in seconds; near it the model is asked for a final answer")
+    parser.add_argument('--model-timeout', type=float, default=None,
+                        help="Seconds after which a model call is cancelled and retried")
+    parser.add_argument('--tool-timeout', type=float, default=None,
+                        help="Seconds after which a tool call is abandoned (also caps run_python_file's own timeout)")
+    parser.add_argument('--trace', metavar="FILE", default=None,
+                        help="Append a JSONL span for every model call and tool call to FILE, and print a summary at the end")
+    parser.add_argument('--resume', metavar="ID", default=None,
+                        help='Continue a saved session ("last" for the most recent one); tool results whose files changed are flagged as stale')
+    parser.add_argument('--no-save', action="store_true",
+                        help="Do not save this session to .cache/sessions")
+    parser.add_argument('--profile', metavar="FILE", default=None,
+                        help="Profile the run with cProfile, save the stats to FILE and print the top functions")
+    args = parser.parse_args(argv)
+    if args.stream and (args.deadline is not None or args.model_timeout is not None or args.tool_timeout is not None):
+        # Time limits need the cancellable async loop, which does not stream
+        parser.error("--stream cannot be combined with --deadline, --model-timeout or --tool-timeout")
+    return args
 
 
 # --- Defining the LLM's Tools (Function Declarations) ---
@@ -26,12 +85,17 @@ args = parser.parse_args()
 
 get_file_content_tool = types.FunctionDeclaration(
     name="get_file_content", # The name the LLM will use to refer to this tool
-    description="Gets the content of a file from the specified file path.", # What the tool does (for the LLM to understand its purpose)
+    description="Gets the content of a file from the specified file path. Returns at most 10000 characters per call; for large files, read a range of lines or bytes and page through it.", # What the tool does (for the LLM to understand its purpose)
     parameters=types.Schema( # Defines the inputs the tool expects
         type=types.Type.OBJECT, # It expects a set of named parameters
         properties={
-            "file_path": types.Schema(type=types.Type.STRING, description="The path to the file to read, relative to the working directory.")
+            "file_path": types.Schema(type=types.Type.STRING, description="The path to the file to read, relative to the working directory."),
                                     # 'working_directory' is deliberately absent here!
+            "start_line": types.Schema(type=types.Type.INTEGER, description="First line to read (1-based)."),
+            "line_count": types.Schema(type=types.Type.INTEGER, description="Number of lines to read from start_line."),
+            "tail_lines": types.Schema(type=types.Type.INTEGER, description="Read only this many lines from the end of the file."),
+            "byte_offset": types.Schema(type=types.Type.INTEGER, description="Read from this byte offset instead of by lines."),
+            "byte_count": types.Schema(type=types.Type.INTEGER, description="Number of bytes to read from byte_offset."),
         },
         #required=["file_path"] # Which of these parameters *must* the LLM provide?
     )
@@ -39,11 +103,18 @@ get_file_content_tool = types.FunctionDeclaration(
 
 get_files_info_tool = types.FunctionDeclaration(
     name="get_files_info",
-    description="Lists files and directories within a specified directory or the current working directory. Paths should be relative to the working directory.",
+    description="Lists files and directories within a specified directory or the current working directory. Paths should be relative to the working directory. Large listings are returned one page at a time.",
         parameters=types.Schema(
         type=types.Type.OBJECT,
         properties={
-            "directory": types.Schema(type=types.Type.STRING, description="The directory to list files from, relative to the working directory. If not provided, lists the current working directory.")
+            "directory": types.Schema(type=types.Type.STRING, description="The directory to list files from, relative to the working directory. If not provided, lists the current working directory."),
+            "recursive": types.Schema(type=types.Type.BOOLEAN, description="Also list the contents of subdirectories. Defaults to false."),
+            "max_depth": types.Schema(type=types.Type.INTEGER, description="With recursive, how many levels of subdirectories to descend into."),
+            "pattern": types.Schema(type=types.Type.STRING, description="Only list entries matching this glob, e.g. '*.py'."),
+            "respect_gitignore": types.Schema(type=types.Type.BOOLEAN, description="Skip entries excluded by .gitignore files. Defaults to true."),
+            "sort_by": types.Schema(type=types.Type.STRING, enum=["name", "size", "mtime", "type"], description="Order of the entries. Defaults to name."),
+            "cursor": types.Schema(type=types.Type.STRING, description="Cursor from a previous call to get the next page of a large listing."),
+            "page_size": types.Schema(type=types.Type.INTEGER, description="Maximum number of entries per page. Defaults to 200."),
         },
         #required=[] # 'directory' is optional, so nothing is strictly required here.
     )
@@ -61,6 +132,22 @@ run_python_file_tool = types.FunctionDeclaration(
     )
 )
 
+run_affected_tests_tool = types.FunctionDeclaration(
+    name="run_affected_tests",
+    description="Runs only the unittest modules (test*.py, *_test.py) that import the changed files, directly or through other modules, each in its own process, and returns a short pass/fail summary with the failing tests and their errors. Much faster than running every test script after a change.",
+    parameters=types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            "changed_files": types.Schema(
+                type=types.Type.ARRAY,
+                items=types.Schema(type=types.Type.STRING),
+                description="The changed files, relative to the working directory. If not provided, the files written since the last run_affected_tests call.",
+            ),
+            "max_workers": types.Schema(type=types.Type.INTEGER, description="How many test modules may run at once. Defaults to 4."),
+        },
+    )
+)
+
 write_file_tool = types.FunctionDeclaration(
     name="write_file",
     description="Writes content to a specified file path. Use path relative to the working directory if absolute path not specified. Creates the file if it doesn't exist, overwrites if it does.",
@@ -74,6 +161,83 @@ write_file_tool = types.FunctionDeclaration(
     )
 )
 
+edit_file_tool = types.FunctionDeclaration(
+    name="edit_file",
+    description="Changes part of an existing file with search/replace blocks, without sending the whole file. Each search text must match exactly once (include a few surrounding lines to make it unique). Edits are applied in order, and the file is only written if all of them apply. Returns the changed line ranges.",
+    parameters=types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            "file_path": types.Schema(type=types.Type.STRING, description="The path to the file to edit, relative to the working directory."),
+            "edits": types.Schema(
+                type=types.Type.ARRAY,
+                description="The search/replace blocks to apply, in order.",
+                items=types.Schema(
+                    type=types.Type.OBJECT,
+                    properties={
+                        "search": types.Schema(type=types.Type.STRING, description="Exact text currently in the file, including indentation."),
+                        "replace": types.Schema(type=types.Type.STRING, description="The text to put in its place (empty to delete it)."),
+                    },
+                    required=["search", "replace"],
+                ),
+            ),
+        },
+        required=["file_path", "edits"],
+    )
+)
+
+apply_patch_tool = types.FunctionDeclaration(
+    name="apply_patch",
+    description="Applies a unified diff (as produced by 'diff -u' or 'git diff') to one or more files. Use --- /dev/null to create a file and +++ /dev/null to delete one. Files are only written if every hunk applies. Returns the changed line ranges.",
+    parameters=types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            "patch": types.Schema(type=types.Type.STRING, description="The unified diff, with ---/+++ file headers and @@ hunk headers. Paths are relative to the working directory."),
+        },
+        required=["patch"],
+    )
+)
+
+search_code_tool = types.FunctionDeclaration(
+    name="search_code",
+    description="Searches the text of all files in the working directory and returns the matching lines with a few lines of context. Much faster than listing directories and reading files to find where something is defined or used.",
+    parameters=types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            "query": types.Schema(type=types.Type.STRING, description="The text to search for, or a regular expression if regex is true."),
+            "regex": types.Schema(type=types.Type.BOOLEAN, description="Treat query as a Python regular expression. Defaults to false."),
+            "case_sensitive": types.Schema(type=types.Type.BOOLEAN, description="Match case exactly. Defaults to false."),
+            "path_glob": types.Schema(type=types.Type.STRING, description="Only search files whose path matches this glob, e.g. '*.py' or 'pkg/*'."),
+            "context_lines": types.Schema(type=types.Type.INTEGER, description="Lines of context around each match. Defaults to 2."),
+            "max_results": types.Schema(type=types.Type.INTEGER, description="Stop after this many matching lines. Defaults to 50."),
+        },
+        required=["query"]
+    )
+)
+
+find_symbol_tool = types.FunctionDeclaration(
+    name="find_symbol",
+    description="Finds where a Python class, function or method is defined. Returns the file, line, signature and docstring summary of each match, without reading whole files.",
+    parameters=types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            "name": types.Schema(type=types.Type.STRING, description="The symbol name, e.g. '_compile_infix' or 'Calculator.evaluate'."),
+            "kind": types.Schema(type=types.Type.STRING, enum=["class", "function", "method"], description="Only return symbols of this kind."),
+        },
+        required=["name"]
+    )
+)
+
+list_symbols_tool = types.FunctionDeclaration(
+    name="list_symbols",
+    description="Lists the classes, functions and methods defined in a Python file (or in the whole working directory), with line numbers and signatures.",
+    parameters=types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            "file_path": types.Schema(type=types.Type.STRING, description="The Python file to outline, relative to the working directory. If not provided, lists symbols from every file."),
+        },
+    )
+)
+
 # This list is like gathering all the "user manuals" into one binder.
 
 available_functions = types.Tool(
@@ -81,7 +245,13 @@ available_functions = types.Tool(
     get_file_content_tool,
     get_files_info_tool,
     run_python_file_tool,
-    write_file_tool    
+    run_affected_tests_tool,
+    write_file_tool,
+    edit_file_tool,
+    apply_patch_tool,
+    search_code_tool,
+    find_symbol_tool,
+    list_symbols_tool
     ]
 )
 
@@ -99,7 +269,11 @@ When a user asks a question or makes a request, make a function call plan. You c
 - List files and directories
 - Read file contents
 - Execute Python files with optional arguments
+- Run just the tests affected by the files you changed
 - Write or overwrite files
+- Edit part of a file with search/replace blocks, or apply a unified diff (prefer these over rewriting a whole file)
+- Search the code for text or a regular expression
+- Find where classes, functions and methods are defined, or outline a file
 
 All paths you provide should be relative to the working directory. 
 
@@ -108,114 +282,627 @@ When asked to fix a bug, always start by:
 2. Running any executables to reproduce the issue
 3. Reading the relevant source code to identify the problem
 4. Making the necessary code changes
-5. Testing to confirm the fix works
+5. Testing to confirm the fix works (run_affected_tests runs only the tests that depend on what you changed)
 
 "fix the bug" means "investigate and repair the code," not "create a workaround."
 """
 
 
-if args.prompt.startswith('--'):
-    print("Error: Prompt must be the first argument.")
-    sys.exit(1)
-
-client = genai.Client(api_key=api_key)
-prompt_content = args.prompt
-
-messages = [
-    types.Content(role="user", parts=[types.Part(text=prompt_content)])
-]
-
-# --- Multi-Turn Conversation Loop ---
-# This loop allows the agent to interact with the LLM in multiple turns,
-# executing tool calls and feeding results back, until the LLM provides a final text response
-# or a maximum number of iterations is reached.
 MAX_ITERATIONS = 20 # Limit to prevent infinite loops
 
-for i in range(MAX_ITERATIONS):
-    # Flag to track if a function was called in the current iteration.
-    # If no function is called, it means the LLM has provided a final text response.
-    function_called_in_this_turn = False
-
-    # Make the API call to generate content.
-    # The entire `messages` list is passed to maintain the conversation history.
-    response = client.models.generate_content(
-        model='gemini-2.0-flash-001',
-        contents=messages, # Crucially, pass the entire accumulated message history
-        config=types.GenerateContentConfig(
-            system_instruction=system_prompt, # High-level instructions for the model
-            tools=[available_functions]        # Inform the model about available tools
-        )
-    )
+MODEL_NAME = 'gemini-2.0-flash-001'
 
-    # Check if the LLM provided any response candidates
-    if not response.candidates:
-        print("No candidates in response. LLM might be done or encountered an issue.")
-        break # Exit the loop if no response is received
+generate_content_config = types.GenerateContentConfig(
+    system_instruction=system_prompt, # High-level instructions for the model
+    tools=[available_functions]        # Inform the model about available tools
+)
 
-    # Get the primary response candidate from the LLM
-    candidate = response.candidates[0]
+# Used by run_agent_async once a session's deadline is close: same tools, but the model may not call them
+final_answer_config = types.GenerateContentConfig(
+    system_instruction=system_prompt,
+    tools=[available_functions],
+    tool_config=types.ToolConfig(function_calling_config=types.FunctionCallingConfig(mode="NONE")),
+)
 
-    # Process each part of the LLM's response
-    if candidate.content.parts:
-        for part in candidate.content.parts:
-            # Check if the part is a function call suggested by the LLM
+# Default token budget of the working directory map in the system prompt (see --repo-map-budget)
+REPO_MAP_BUDGET = 1000
+
+# Share of a session's deadline kept back for the final answer
+FINAL_ANSWER_RESERVE = 0.2
+
+FINAL_ANSWER_PROMPT = ("You are out of time. Do not call any more tools: answer now, "
+                       "based on what you have found so far, and say what is left unfinished.")
+
+
+def session_configs(working_directory=None, repo_map_budget=None):
+    """
+    The model configs (normal, final answer) for a session. With a
+    repo_map_budget, a map of the working directory of about that many tokens
+    is put in front of the system prompt (see functions/repo_map.py), so the
+    model does not have to spend its first turns listing and reading files.
+    """
+    if not repo_map_budget:
+        return generate_content_config, final_answer_config
+    instruction = build_repo_map(working_directory or WORKING_DIRECTORY, repo_map_budget) + "\n" + system_prompt
+    return (generate_content_config.model_copy(update={"system_instruction": instruction}),
+            final_answer_config.model_copy(update={"system_instruction": instruction}))
+
+
+def stream_turn(client, dispatcher, contents, verbose=False, config=None):
+    """
+    Streams one model turn instead of waiting for the whole candidate.
+
+    Text is printed as soon as it arrives, and every function call is handed to
+    the dispatcher as soon as its part has arrived (Gemini sends each function
+    call part complete within a single chunk).
+
+    Returns:
+        (last_chunk, parts, pending_calls): the final chunk (it carries the usage
+        metadata), the candidate's parts with consecutive text chunks merged, and
+        the dispatched calls keyed by their index in `parts`.
+        last_chunk is None if the stream produced no candidates.
+
+    `config` defaults to generate_content_config.
+    """
+    started = time.perf_counter()
+    first_token_at = None
+    first_call_at = None
+    text_open = False # True while a line of streamed text is still being printed
+
+    last_chunk = None
+    saw_candidates = False
+    parts = []
+    pending_calls = {}
+    for chunk in client.generate_content_stream(
+        model=MODEL_NAME, contents=contents, config=config or generate_content_config
+    ):
+        last_chunk = chunk
+        if not chunk.candidates:
+            continue
+        saw_candidates = True
+        content = chunk.candidates[0].content
+        if not content or not content.parts:
+            continue
+
+        for part in content.parts:
             if part.function_call:
-                # If a function call is suggested, execute it using our `call_function` handler.
-                function_call_result = call_function(part.function_call, verbose=args.verbose)
-
-                # Validate the structure of the `types.Content` object returned by `call_function`.
-                # This ensures we received a valid function response.
-                if not (function_call_result and
-                        function_call_result.parts and
-                        function_call_result.parts[0].function_response and
-                        function_call_result.parts[0].function_response.response):
-                    raise ValueError("Unexpected structure in function_call_result from call_function.")
-
-                # If verbose mode is enabled, print the result of the function call.
-                if args.verbose:
-                    print(f"-> {function_call_result.parts[0].function_response.response}")
-
-                # Append the LLM's suggested function call to the messages history.
-                # This shows the LLM's intent to call a tool.
-                messages.append(types.Content(role="model", parts=[part]))
-                
-                # Append the *result* of the function call (the tool's response) to the messages history.
-                # This is crucial for the LLM to understand the outcome of its action and plan the next step.
-                messages.append(function_call_result)
-                
-                # Mark that a function was called in this turn, indicating the loop should continue.
-                function_called_in_this_turn = True
-
-            # If the part is a text response from the LLM
+                if text_open:
+                    print()
+                    text_open = False
+                if first_call_at is None:
+                    first_call_at = time.perf_counter() - started
+                pending_calls[len(parts)] = dispatcher.submit(part.function_call)
+                parts.append(part)
             elif part.text:
-                # Append the LLM's text response to the messages history.
-                messages.append(types.Content(role="model", parts=[part]))
-                # Print the LLM's final text response (or intermediate text).
-                print('Response (Text): ', part.text)
-                
-    else:
-        # If the LLM's response has no parts (neither text nor function call), it's an unexpected scenario.
-        print("Response has no content parts.")
-        break # Exit the loop
-
-    # --- Loop Continuation Logic ---
-    # If a function was called in this turn, we continue the loop
-    # to allow the LLM to process the tool's output and potentially make another call.
-    if function_called_in_this_turn:
-        # Continue to the next iteration to send the updated message history back to the LLM.
-        continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter() - started
+                if not text_open:
+                    print('Response (Text): ', end="")
+                    text_open = True
+                print(part.text, end="", flush=True)
+                # Merge consecutive text chunks so the history holds one text part, as without streaming
+                if parts and parts[-1].text and not parts[-1].function_call:
+                    parts[-1] = types.Part(text=parts[-1].text + part.text)
+                else:
+                    parts.append(part)
+
+    if text_open:
+        print()
+    if verbose:
+        if first_token_at is not None:
+            print(f"Time to first token: {first_token_at:.3f}s")
+        if first_call_at is not None:
+            print(f"Time to first tool call: {first_call_at:.3f}s")
+    if not saw_candidates:
+        return None, parts, pending_calls
+    return last_chunk, parts, pending_calls
+
+
+def run_agent(client, prompt_content, verbose=False, stream=False, max_workers=1, history_budget=None,
+              dispatcher=None, working_directory=None, tracer=None, dedupe_results=True, session=None,
+              repo_map_budget=None):
+    """
+    Runs one agent session: sends the prompt, executes the tool calls the model
+    asks for and feeds their results back until it gives a final text answer.
+
+    Args:
+        client: An agent.model_client.ModelClient (live, recorded, replayed or scripted).
+        prompt_content: The user's prompt.
+        verbose, stream, max_workers, history_budget: See the command line options.
+        dispatcher: A ToolDispatcher to reuse (e.g. to read its tool_stats afterwards).
+                    By default one is created for this session and shut down at the end.
+        working_directory: Directory the tools operate in (default: the calculator project).
+        tracer: An agent.tracing.Tracer to record spans with (see --trace).
+                By default the spans are only kept for the verbose summary.
+        dedupe_results: Send repeated tool results as "unchanged" notes or diffs (see ToolResultDeduper).
+        session: An agent.sessions.Session to continue from and to save every turn to (see --resume).
+        repo_map_budget: Token budget of the working directory map put in front of the
+                         system prompt (see --repo-map-budget). None leaves it out.
+
+    Returns:
+        The full `messages` history of the session.
+    """
+    # A resumed session starts from the messages of the earlier runs
+    messages = (list(session.messages) if session is not None else []) + [
+        types.Content(role="user", parts=[types.Part(text=prompt_content)])
+    ]
+    tracer = tracer or Tracer()
+    config, _ = session_configs(working_directory, repo_map_budget)
+    if verbose and repo_map_budget:
+        print(f"Repo map: ~{(len(config.system_instruction) - len(system_prompt)) // CHARS_PER_TOKEN} tokens "
+              "in front of the system prompt")
+
+    # Runs the tool calls of each turn, several at once if max_workers > 1.
+    owns_dispatcher = dispatcher is None
+    if owns_dispatcher:
+        dispatcher = ToolDispatcher(max_workers=max_workers, verbose=verbose, working_directory=working_directory,
+                                    tracer=tracer, after_call=session.capture if session is not None else None)
+
+    # Decides what part of `messages` is actually sent each turn (see --history-budget).
+    history = HistoryManager(token_budget=history_budget)
+    # Shortens tool results the model has already seen (see --no-dedupe).
+    deduper = ToolResultDeduper(history) if dedupe_results else None
+
+    response = None
+
+    # --- Multi-Turn Conversation Loop ---
+    # This loop allows the agent to interact with the LLM in multiple turns,
+    # executing tool calls and feeding results back, until the LLM provides a final text response
+    # or a maximum number of iterations is reached.
+    for i in range(MAX_ITERATIONS):
+        # Flag to track if a function was called in the current iteration.
+        # If no function is called, it means the LLM has provided a final text response.
+        function_called_in_this_turn = False
+        tracer.turn = i + 1
+
+        # `messages` keeps the full history; only the compacted copy is sent to the model.
+        prompt_contents = history.compact(messages)
+        prompt_tokens = estimate_tokens(prompt_contents)
+        if verbose:
+            print(f"Prompt size (turn {i + 1}): ~{estimate_tokens(messages)} tokens, "
+                  f"~{prompt_tokens} after compaction")
+
+        if stream:
+            # Stream the turn; function calls are already running by the time this returns.
+            with tracer.span("model", MODEL_NAME, stream=True, estimated_prompt_tokens=prompt_tokens) as span:
+                response, parts, pending_calls = stream_turn(client, dispatcher, prompt_contents, verbose=verbose,
+                                                             config=config)
+                span.update(usage_fields(response))
+            if response is None:
+                print("No candidates in response. LLM might be done or encountered an issue.")
+                break
+        else:
+            # Make the API call to generate content.
+            # The (compacted) `messages` list is passed to maintain the conversation history.
+            with tracer.span("model", MODEL_NAME, estimated_prompt_tokens=prompt_tokens) as span:
+                response = client.generate_content(
+                    model=MODEL_NAME,
+                    contents=prompt_contents, # Crucially, pass the accumulated message history
+                    config=config
+                )
+                span.update(usage_fields(response))
+
+            # Check if the LLM provided any response candidates
+            if not response.candidates:
+                print("No candidates in response. LLM might be done or encountered an issue.")
+                break # Exit the loop if no response is received
+
+            # Get the primary response candidate from the LLM
+            candidate = response.candidates[0]
+            parts = candidate.content.parts
+
+            # Start every function call of this turn up front so independent calls can run concurrently.
+            # Results are still collected below in the original part order.
+            pending_calls = {
+                index: dispatcher.submit(part.function_call)
+                for index, part in enumerate(parts or [])
+                if part.function_call
+            }
+
+        # Process each part of the LLM's response
+        if parts:
+            for index, part in enumerate(parts):
+                # Check if the part is a function call suggested by the LLM
+                if part.function_call:
+                    # Wait for the result of the call started above (executed by our `call_function` handler).
+                    function_call_result = pending_calls[index].result()
+
+                    # Validate the structure of the `types.Content` object returned by `call_function`.
+                    # This ensures we received a valid function response.
+                    if not (function_call_result and
+                            function_call_result.parts and
+                            function_call_result.parts[0].function_response and
+                            function_call_result.parts[0].function_response.response):
+                        raise ValueError("Unexpected structure in function_call_result from call_function.")
+
+                    # A repeated call whose result the model has seen comes back as a note or a diff.
+                    if deduper is not None:
+                        function_call_result = deduper.process(part.function_call, function_call_result,
+                                                               turn=i + 1, index=len(messages) + 1)
+
+                    # If verbose mode is enabled, print the result of the function call.
+                    if verbose:
+                        print(f"-> {function_call_result.parts[0].function_response.response}")
+
+                    # Append the LLM's suggested function call to the messages history.
+                    # This shows the LLM's intent to call a tool.
+                    messages.append(types.Content(role="model", parts=[part]))
+
+                    # Append the *result* of the function call (the tool's response) to the messages history.
+                    # This is crucial for the LLM to understand the outcome of its action and plan the next step.
+                    messages.append(function_call_result)
+
+                    # Mark that a function was called in this turn, indicating the loop should continue.
+                    function_called_in_this_turn = True
+
+                # If the part is a text response from the LLM
+                elif part.text:
+                    # Append the LLM's text response to the messages history.
+                    messages.append(types.Content(role="model", parts=[part]))
+                    # Print the LLM's final text response (or intermediate text).
+                    # When streaming, the text has already been printed as it arrived.
+                    if not stream:
+                        print('Response (Text): ', part.text)
+
+        else:
+            # If the LLM's response has no parts (neither text nor function call), it's an unexpected scenario.
+            print("Response has no content parts.")
+            break # Exit the loop
+
+        # Append this turn to the saved session (see --resume)
+        if session is not None:
+            session.save(messages)
+
+        # --- Loop Continuation Logic ---
+        # If a function was called in this turn, we continue the loop
+        # to allow the LLM to process the tool's output and potentially make another call.
+        if function_called_in_this_turn:
+            # Continue to the next iteration to send the updated message history back to the LLM.
+            continue
+        else:
+            # If no function was called, it means the LLM has provided its final text response
+            # or it couldn't make a function call. In either case, we break the loop.
+            break
+
+    if session is not None:
+        session.save(messages)
+    if owns_dispatcher:
+        dispatcher.shutdown()
+
+    # --- Final Output (for verbose mode) ---
+    # Print token usage if verbose mode is enabled.
+    if verbose:
+        print('User prompt:', prompt_content)
+        # Check if usage_metadata exists before accessing
+        if response is not None and response.usage_metadata:
+            print('Prompt tokens:', str(response.usage_metadata.prompt_token_count))
+            print('Response tokens:', str(response.usage_metadata.candidates_token_count))
+        cache_stats = read_cache.stats()
+        print(f"File read cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+        if prefetch.prefetcher is not None:
+            prefetch_stats = prefetch.prefetcher.stats()
+            print(f"Prefetch: {prefetch_stats['hits']} hits, {prefetch_stats['misses']} misses "
+                  f"(hit rate {prefetch_stats['hit_rate']:.0%}), {prefetch_stats['prefetched_files']} files / "
+                  f"{prefetch_stats['prefetched_bytes']} bytes read ahead, {prefetch_stats['wasted_bytes']} bytes unused")
+        if deduper is not None:
+            print(f"Repeated tool results: {deduper.stats['unchanged']} unchanged, {deduper.stats['deltas']} sent as diffs, "
+                  f"~{deduper.stats['chars_saved']} characters saved")
+        # Usage and timing of every turn, not just the last one
+        print(tracer.summary())
+
+    return messages
+
+
+def _add_usage(usage, response, model_seconds):
+    usage["model_calls"] = usage.get("model_calls", 0) + 1
+    usage["model_time_s"] = usage.get("model_time_s", 0.0) + model_seconds
+    metadata = response.usage_metadata
+    for key, field in (("prompt_tokens", "prompt_token_count"),
+                       ("response_tokens", "candidates_token_count"),
+                       ("total_tokens", "total_token_count")):
+        usage[key] = usage.get(key, 0) + ((getattr(metadata, field, None) or 0) if metadata else 0)
+
+
+class _Deadline:
+    """Wall-clock budget of one session, split into working time and a reserve for the final answer."""
+
+    def __init__(self, seconds, reserve=None):
+        self.at = None if seconds is None else time.monotonic() + seconds
+        if reserve is None:
+            reserve = 0 if seconds is None else seconds * FINAL_ANSWER_RESERVE
+        self.final_at = None if seconds is None else self.at - reserve
+
+    def remaining(self):
+        return None if self.at is None else self.at - time.monotonic()
+
+    def working_time_left(self):
+        return None if self.final_at is None else self.final_at - time.monotonic()
+
+
+def _bound(*timeouts):
+    """The smallest of the given timeouts that are set (None if none is), never below zero."""
+    timeouts = [timeout for timeout in timeouts if timeout is not None]
+    return max(0.0, min(timeouts)) if timeouts else None
+
+
+def _abandoned_call_result(function_call, timeout):
+    return types.Content(role="tool", parts=[types.Part.from_function_response(
+        name=function_call.name,
+        response={"error": f"The tool call did not finish within {timeout:.1f} seconds and was abandoned."},
+    )])
+
+
+async def _run_inline(dispatcher, function_call):
+    # With max_workers <= 1 the dispatcher runs the call on the thread that submits it
+    future = await asyncio.to_thread(dispatcher.submit, function_call)
+    return future.result()
+
+
+async def run_agent_async(client, prompt_content, verbose=False, max_workers=1, history_budget=None,
+                          dispatcher=None, working_directory=None, quiet=False, usage=None,
+                          deadline=None, model_timeout=None, tool_timeout=None, final_answer_reserve=None,
+                          tracer=None, dedupe_results=True, session=None, repo_map_budget=None):
+    """
+    The agent loop of run_agent for asyncio code, so many sessions can share one
+    event loop, with optional time limits.
+
+    Model calls go through client.generate_content_async, and tool calls run on
+    threads, so a session waiting for either does not hold up the others.
+
+    With a `deadline`, the session never runs longer than that many seconds.
+    Model and tool calls are cut off when they would run into the last
+    `final_answer_reserve` seconds (by default FINAL_ANSWER_RESERVE of the
+    deadline). From then on the model is asked for a final answer with tool
+    calling turned off. A model call that runs past `model_timeout` is
+    cancelled and retried. A tool call that runs past `tool_timeout` is
+    abandoned, and the model is told so in place of its result.
+
+    Args:
+        quiet: Do not print the model's text responses (e.g. in batch mode).
+        usage: Optional dict that is updated with the session's model_calls,
+               prompt_tokens, response_tokens, total_tokens and model_time_s,
+               plus timed_out_model_calls, abandoned_tool_calls, forced_final_answer
+               and deadline_exceeded when those happen.
+        deadline, model_timeout, tool_timeout, final_answer_reserve: Seconds (None: no limit).
+        The other arguments are the same as for run_agent.
+
+    Returns:
+        The full `messages` history of the session.
+    """
+    # A resumed session starts from the messages of the earlier runs
+    messages = (list(session.messages) if session is not None else []) + [
+        types.Content(role="user", parts=[types.Part(text=prompt_content)])
+    ]
+    usage = {} if usage is None else usage
+    session_deadline = _Deadline(deadline, final_answer_reserve)
+    tracer = tracer or Tracer()
+    config, final_config = session_configs(working_directory, repo_map_budget)
+    if verbose and repo_map_budget:
+        print(f"Repo map: ~{(len(config.system_instruction) - len(system_prompt)) // CHARS_PER_TOKEN} tokens "
+              "in front of the system prompt")
+
+    owns_dispatcher = dispatcher is None
+    if owns_dispatcher:
+        dispatcher = ToolDispatcher(max_workers=max_workers, verbose=verbose, working_directory=working_directory,
+                                    tracer=tracer, after_call=session.capture if session is not None else None)
+    history = HistoryManager(token_budget=history_budget)
+    # Shortens tool results the model has already seen (see --no-dedupe).
+    deduper = ToolResultDeduper(history) if dedupe_results else None
+    abandoned_calls = False
+
+    try:
+        final_answer = False
+        for i in range(MAX_ITERATIONS):
+            working_time_left = session_deadline.working_time_left()
+            if not final_answer and working_time_left is not None and working_time_left <= 0:
+                # Out of working time: ask for an answer from what has been found so far
+                final_answer = True
+                usage["forced_final_answer"] = True
+                messages.append(types.Content(role="user", parts=[types.Part(text=FINAL_ANSWER_PROMPT)]))
+                if verbose:
+                    print("Deadline is close: asking for a final answer")
+
+            tracer.turn = i + 1
+            prompt_contents = history.compact(messages)
+            prompt_tokens = estimate_tokens(prompt_contents)
+            if verbose:
+                print(f"Prompt size (turn {i + 1}): ~{estimate_tokens(messages)} tokens, "
+                      f"~{prompt_tokens} after compaction")
+
+            if final_answer:
+                timeout = _bound(model_timeout, session_deadline.remaining())
+            else:
+                timeout = _bound(model_timeout, working_time_left)
+            started = time.perf_counter()
+            try:
+                with tracer.span("model", MODEL_NAME, estimated_prompt_tokens=prompt_tokens,
+                                 final_answer=final_answer) as span:
+                    response = await asyncio.wait_for(client.generate_content_async(
+                        model=MODEL_NAME, contents=prompt_contents,
+                        config=final_config if final_answer else config,
+                    ), timeout)
+                    span.update(usage_fields(response))
+            except asyncio.TimeoutError:
+                usage["timed_out_model_calls"] = usage.get("timed_out_model_calls", 0) + 1
+                remaining = session_deadline.remaining()
+                if final_answer or (remaining is not None and remaining <= 0):
+                    usage["deadline_exceeded"] = True
+                    print(f"Deadline of {deadline} seconds reached before a final answer.")
+                    break
+                if verbose:
+                    print(f"Model call timed out after {time.perf_counter() - started:.1f}s, retrying")
+                continue
+            _add_usage(usage, response, time.perf_counter() - started)
+
+            if not response.candidates:
+                print("No candidates in response. LLM might be done or encountered an issue.")
+                break
+            parts = response.candidates[0].content.parts
+            if not parts:
+                print("Response has no content parts.")
+                break
+            if final_answer:
+                # Tool calling is turned off; anything but text is ignored
+                parts = [part for part in parts if part.text]
+
+            # Start every call of the turn before waiting for any, unless they run one after another anyway
+            pending_calls = {}
+            if dispatcher.max_workers > 1:
+                for index, part in enumerate(parts):
+                    if part.function_call:
+                        pending_calls[index] = asyncio.wrap_future(dispatcher.submit(part.function_call))
+
+            function_called_in_this_turn = False
+            for index, part in enumerate(parts):
+                if part.function_call:
+                    call = pending_calls.get(index) or _run_inline(dispatcher, part.function_call)
+                    timeout = _bound(tool_timeout, session_deadline.working_time_left())
+                    try:
+                        function_call_result = await asyncio.wait_for(call, timeout)
+                    except asyncio.TimeoutError:
+                        # A thread cannot be stopped: the call finishes (or hits its own limit) in the background
+                        abandoned_calls = True
+                        usage["abandoned_tool_calls"] = usage.get("abandoned_tool_calls", 0) + 1
+                        function_call_result = _abandoned_call_result(part.function_call, timeout)
+                    if not (function_call_result and
+                            function_call_result.parts and
+                            function_call_result.parts[0].function_response and
+                            function_call_result.parts[0].function_response.response):
+                        raise ValueError("Unexpected structure in function_call_result from call_function.")
+                    if deduper is not None:
+                        function_call_result = deduper.process(part.function_call, function_call_result,
+                                                               turn=i + 1, index=len(messages) + 1)
+                    if verbose:
+                        print(f"-> {function_call_result.parts[0].function_response.response}")
+                    messages.append(types.Content(role="model", parts=[part]))
+                    messages.append(function_call_result)
+                    function_called_in_this_turn = True
+                elif part.text:
+                    messages.append(types.Content(role="model", parts=[part]))
+                    if not quiet:
+                        print('Response (Text): ', part.text)
+
+            if session is not None:
+                session.save(messages)
+            if not function_called_in_this_turn:
+                break
+    finally:
+        if session is not None:
+            session.save(messages)
+        if owns_dispatcher:
+            # Do not wait for abandoned calls; they only hold a worker thread until they end
+            await asyncio.to_thread(dispatcher.shutdown, wait=not abandoned_calls)
+
+    if verbose:
+        print('User prompt:', prompt_content)
+        print('Prompt tokens:', usage.get("prompt_tokens", 0))
+        print('Response tokens:', usage.get("response_tokens", 0))
+        print(tracer.summary())
+
+    return messages
+
+
+def build_client(args):
+    """
+    Picks the model client: a replay of a recorded session, or a live model
+    (Gemini, or a local server with --local-url), optionally recorded.
+    """
+    if args.replay:
+        return ReplayClient(args.replay)
+    if args.local_url:
+        client = OpenAICompatibleClient(args.local_url, model=args.local_model,
+                                        api_key=os.environ.get("LOCAL_MODEL_API_KEY"))
     else:
-        # If no function was called, it means the LLM has provided its final text response
-        # or it couldn't make a function call. In either case, we break the loop.
-        break
-
-# --- Final Output (for verbose mode) ---
-# Print token usage if verbose mode is enabled.
-if args.verbose:
-    print('User prompt:', prompt_content)
-    # Check if usage_metadata exists before accessing
-    if response.usage_metadata:
-        print('Prompt tokens:', str(response.usage_metadata.prompt_token_count))
-        print('Response tokens:', str(response.usage_metadata.candidates_token_count))
-else:
-    pass
\ No newline at end of file
+        client = GeminiClient(api_key=os.environ.get("GEMINI_API_KEY"))
+    if args.record:
+        client = RecordingClient(client, args.record)
+    return client
+
+
+def main():
+    load_dotenv()
+    args = parse_args()
+
+    if args.prompt.startswith('--'):
+        print("Error: Prompt must be the first argument.")
+        sys.exit(1)
+
+    if args.python_workers > 0:
+        enable_worker_pool(size=args.python_workers, max_runs=args.python_worker_runs)
+
+    if args.prefetch:
+        prefetch.enable_prefetch()
+
+    if args.tool_timeout is not None:
+        run_python.run_timeout = min(run_python.run_timeout, args.tool_timeout)
+
+    # Sessions are saved after every turn, so a later run can --resume them
+    session = None
+    store = SessionStore()
+    tool_sources = functools.partial(source_files, WORKING_DIRECTORY)
+    if args.resume:
+        try:
+            session = store.open(args.resume, source_files=tool_sources)
+        except SessionNotFoundError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"Resumed session {session.id}: {len(session.messages)} messages, "
+              f"{session.stale} stale tool results")
+    elif not args.no_save:
+        session = store.create(WORKING_DIRECTORY, source_files=tool_sources)
+
+    client = build_client(args)
+    tracer = Tracer(args.trace)
+    profiler = None
+    if args.profile:
+        # Profiles this thread: the model calls and the loop, and tool calls run inline (--max-workers 1)
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        if args.deadline is not None or args.model_timeout is not None or args.tool_timeout is not None:
+            # Time limits need the cancellable async loop
+            asyncio.run(run_agent_async(
+                client,
+                args.prompt,
+                verbose=args.verbose,
+                max_workers=args.max_workers,
+                history_budget=args.history_budget,
+                deadline=args.deadline,
+                model_timeout=args.model_timeout,
+                tool_timeout=args.tool_timeout,
+                tracer=tracer,
+                dedupe_results=not args.no_dedupe,
+                session=session,
+                repo_map_budget=args.repo_map_budget,
+            ))
+        else:
+            run_agent(
+                client,
+                args.prompt,
+                verbose=args.verbose,
+                stream=args.stream,
+                max_workers=args.max_workers,
+                history_budget=args.history_budget,
+                tracer=tracer,
+                dedupe_results=not args.no_dedupe,
+                session=session,
+                repo_map_budget=args.repo_map_budget,
+            )
+    finally:
+        tracer.close()
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+
+    if session is not None:
+        print(f"Session saved as {session.id}; continue it with --resume {session.id}")
+    # Verbose mode has printed the summary already
+    if (args.trace or args.profile) and not args.verbose:
+        print(tracer.summary())
+    if profiler is not None:
+        print(f"Profile saved to {args.profile}; top functions by cumulative time:")
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats("cumulative").print_stats(15)
+
+
+if __name__ == "__main__":
+    main()
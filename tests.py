@@ -1,10 +1,25 @@
 # tests.py
 
 #import unittest
+import os
+import tempfile
+
 from functions.get_files_info import get_files_info
 from functions.get_file_content import get_file_content
 from functions.write_file import write_file
 from functions.run_python import run_python_file
+from functions.search_code import search_code
+from functions.symbol_index import find_symbol, list_symbols
+from functions.edit_file import edit_file, apply_patch
+from functions.affected_tests import run_affected_tests
+from functions.repo_map import CHARS_PER_TOKEN, build_repo_map
+from agent.model_client import ScriptedClient
+from agent.openai_client import completion_to_response
+import main as agent
+import functools
+from google.genai import types
+from agent.sessions import SessionStore
+from functions.dispatch import source_files
 
 
 """
@@ -58,18 +73,77 @@ print(get_files_info("calculator", "."))
 print(get_files_info("calculator", "pkg"))
 print(get_files_info("calculator", "/bin"))
 print(get_files_info("calculator", "../"))
+print(get_files_info("calculator", ".", recursive=True, pattern="*.py"))
+print(get_files_info("calculator", ".", recursive=True, sort_by="size", page_size=3, cursor="3"))
 """
 # print(get_file_content("calculator", "lorem.txt"))
 
 # print(get_file_content("calculator", "main.py"))
 # print(get_file_content("calculator", "pkg/calculator.py"))
 # print(get_file_content("calculator", "/bin/cat"))
+# print(get_file_content("calculator", "pkg/calculator.py", start_line=20, line_count=10))
+# print(get_file_content("calculator", "pkg/calculator.py", tail_lines=5))
+# print(get_file_content("calculator", "lorem.txt", byte_offset=6, byte_count=10))
+
+
+
+# print(search_code("calculator", "_compile_infix"))
+# print(search_code("calculator", r"def \w+\(self", regex=True, path_glob="*.py", context_lines=0))
+
+# Text in optional, repeated or alternative groups is not required, so the index must not skip the file
+with tempfile.TemporaryDirectory() as directory:
+    with open(os.path.join(directory, "module.py"), "w") as f:
+        f.write("def foo():\n    return 1\n")
+    for pattern in [r"(async )?def foo", r"(?:abc)*def foo", r"(abc|def) foo", r"x{0,3}def foo", r"(?=def)def foo",
+                    r"\x64ef foo", r"\144ef foo"]:
+        print(pattern, "->", search_code(directory, pattern, regex=True, context_lines=0).splitlines()[0])
+# print(find_symbol("calculator", "_compile_infix"))
+# print(list_symbols("calculator", "pkg/calculator.py"))
+# print(run_affected_tests("calculator", ["pkg/calculator.py"]))
+
+# The repo map stays within its budget, even for a directory of thousands of files
+with tempfile.TemporaryDirectory() as directory:
+    for number in range(3000):
+        with open(os.path.join(directory, f"module_{number}.py"), "w") as f:
+            f.write(f"def function_{number}():\n    pass\n")
+    repo_map = build_repo_map(directory, token_budget=1000)
+    print(len(repo_map), "<=", 1000 * CHARS_PER_TOKEN, len(repo_map) <= 1000 * CHARS_PER_TOKEN)
 
 
 
 # print(write_file("calculator", "lorem.txt", "wait, this isn't lorem ipsum"))
 # print(write_file("calculator", "pkg/morelorem.txt", "lorem ipsum dolor sit amet"))
 # print(write_file("calculator", "/tmp/temp.txt", "this should not be allowed"))
+# print(edit_file("calculator", "lorem.txt", [{"search": "lorem", "replace": "LOREM"}]))
+# print(apply_patch("calculator", "--- a/lorem.txt\n+++ b/lorem.txt\n@@ -1 +1 @@\n-wait, this isn't lorem ipsum\n+lorem ipsum\n"))
+
+# Writes go through a symlink to its target; the link stays a link
+with tempfile.TemporaryDirectory() as directory:
+    with open(os.path.join(directory, "target.txt"), "w") as f:
+        f.write("hello\n")
+    os.symlink("target.txt", os.path.join(directory, "link.txt"))
+    print(write_file(directory, "link.txt", "bye\n"))
+    print(edit_file(directory, "link.txt", [{"search": "bye", "replace": "ciao"}]))
+    print(os.path.islink(os.path.join(directory, "link.txt")), get_file_content(directory, "target.txt"))
+
+# A tool call whose arguments are cut-off JSON gets an error back, and the session goes on
+truncated = completion_to_response({"choices": [{"message": {"tool_calls": [{"function": {
+    "name": "get_file_content", "arguments": '{"file_path": "main.py"'}}]}, "finish_reason": "tool_calls"}]})
+messages = agent.run_agent(ScriptedClient([truncated, "done"]), "read main.py", working_directory="calculator")
+print(messages[-2].parts[0].function_response.response, messages[-1].parts[0].text)
+
+# A read followed by a write of the same file in one turn is stale when the session is resumed
+with tempfile.TemporaryDirectory() as directory:
+    with open(os.path.join(directory, "a.py"), "w") as f:
+        f.write("x = 1\n")
+    store = SessionStore(os.path.join(directory, ".sessions"))
+    session = store.create(directory, source_files=functools.partial(source_files, directory))
+    read_then_write = types.GenerateContentResponse(candidates=[types.Candidate(content=types.Content(role="model", parts=[
+        types.Part(function_call=types.FunctionCall(name="get_file_content", args={"file_path": "a.py"})),
+        types.Part(function_call=types.FunctionCall(name="write_file", args={"file_path": "a.py", "content": "x = 2\n"})),
+    ]))])
+    agent.run_agent(ScriptedClient([read_then_write, "done"]), "bump x", working_directory=directory, session=session)
+    print("stale results:", store.open(session.id, source_files=functools.partial(source_files, directory)).stale)
 
 
 print(run_python_file("calculator", "main.py"))